@@ -0,0 +1,99 @@
+from typing import Callable, Dict, List
+from pymongo.errors import BulkWriteError
+from center.database.address import TrackedAddress
+
+
+class AddressRegistry:
+    """跟踪的合约地址
+
+    内存中每个合约一个 地址 -> 发现区块 的字典, 判断地址是否跟踪只需一次查找。
+    配置文件中的固定地址只保存在内存中; 事件处理器动态添加的地址连同发现区块保存在 `tracked_addresses` 集合中,
+    添加时只记录待写入, `flush` 时一次批量写入, 由扫描状态在每个 chunk 结束时调用。
+    每添加一个地址按顺序通知订阅者, 例如扫描器的分发表增量加入新地址的路由。
+    """
+
+    def __init__(self, collection=None):
+        """
+        :param collection: 保存动态地址的 pymongo 集合, 为空时使用 `TrackedAddress` 的集合
+        """
+        self.collection = collection
+        self.addresses: Dict[str, Dict[str, int]] = {}
+        self.pending: List[dict] = []
+        self.listeners: List[Callable] = []
+        # 每添加一个地址或整体替换时加一, 用于判断预先获取的数据与分发表是否需要更新
+        self.version = 0
+
+    def _collection(self):
+        if self.collection is None:
+            self.collection = TrackedAddress._get_collection()
+        return self.collection
+
+    def subscribe(self, listener: Callable):
+        """订阅新地址, listener(合约名, 地址, 添加后的版本)"""
+        self.listeners.append(listener)
+
+    def _seed(self, seeds: dict):
+        self.addresses = { contract: { address: 0 } for contract, address in seeds.items() if address }
+        self.pending = []
+        self.version += 1
+
+    def reset(self, seeds: dict):
+        """只保留配置的固定地址, 删除保存的动态地址
+
+        :param seeds: 合约名 -> 固定地址, 即配置中的 contracts
+        """
+        self._seed(seeds)
+        self._collection().delete_many({})
+
+    def load(self, seeds: dict, last_block: int):
+        """恢复固定地址与 last_block 及之前发现的动态地址
+
+        之后发现的地址还没有对应的扫描进度, 删除后重新扫描时会再次添加。
+        """
+        self._seed(seeds)
+        collection = self._collection()
+        collection.delete_many({ "blockNumber": { "$gt": last_block } })
+        for doc in sorted(collection.find({}), key=lambda d: d['blockNumber']):
+            self.addresses.setdefault(doc['contract'], {}).setdefault(doc['address'], doc['blockNumber'])
+
+    def rollback(self, block_number: int):
+        """链重组回滚到 block_number 时删除之后发现的动态地址, 订阅者按版本变化重建"""
+        for adds in self.addresses.values():
+            for address in [a for a, b in adds.items() if b > block_number]:
+                del adds[address]
+        self.pending = [p for p in self.pending if p['blockNumber'] <= block_number]
+        self._collection().delete_many({ "blockNumber": { "$gt": block_number } })
+        self.version += 1
+
+    def add(self, contract: str, address: str, block_number: int = 0) -> bool:
+        """添加动态地址, 已经跟踪时返回 False"""
+        adds = self.addresses.setdefault(contract, {})
+        if address in adds:
+            return False
+        adds[address] = block_number
+        self.pending.append({ "_id": f"{contract}-{address}", "contract": contract, "address": address, "blockNumber": block_number })
+        self.version += 1
+        for listener in self.listeners:
+            listener(contract, address, self.version)
+        return True
+
+    def has(self, contract: str, address: str) -> bool:
+        return address in self.addresses.get(contract, ())
+
+    def get(self, contract: str) -> list:
+        return list(self.addresses.get(contract, ()))
+
+    def flush(self):
+        """写入待保存的动态地址"""
+        if len(self.pending) == 0:
+            return
+        pending, self.pending = self.pending, []
+        try:
+            self._collection().insert_many(pending, ordered=False)
+        except BulkWriteError as e:
+            # 从旧状态文件导入的地址可能已经保存过
+            if any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+                raise
+
+    def stats(self) -> dict:
+        return { "contracts": len(self.addresses), "addresses": sum(len(a) for a in self.addresses.values()), "pending": len(self.pending) }
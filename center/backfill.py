@@ -0,0 +1,112 @@
+import asyncio
+from typing import Callable, Optional, Tuple
+from center.block_scanner import BlockScanner
+from center.logger import Logger
+
+
+class Backfill:
+    """分片并行的历史数据回填。
+
+    把扫描范围切成连续的分片, 多个 worker 同时下载不同分片的区块与收据(并写入 `BlockLog` / `ReceiptLog` 归档),
+    唯一的应用阶段按区块顺序等待下一个分片就绪后调用 `process_event`, 事件处理器看到的顺序与顺序扫描相同。
+
+    worker 按下载时跟踪的地址筛选收据, 应用阶段发现事件处理器添加了新的跟踪地址时,
+    已经预先下载的分片会按新的地址集合重新获取。
+    分片应用前与 `BlockScanner.scan_chunk` 一样检查链重组, 发现时回滚到分叉点, 之后已下载的分片作废, 从分叉点之后逐个 chunk 扫描。
+    """
+
+    def __init__(self, scanner: BlockScanner, shard_size: int = 10, workers: int = 4, max_pending: int = None, logger: Logger = None):
+        """
+        :param scanner: 区块扫描器, 分片通过它的 `fetch_chunk` 获取
+        :param shard_size: 每个分片的区块数
+        :param workers: 同时下载的分片数
+        :param max_pending: 已下载但还没有应用的最大分片数, 默认为 workers 的两倍
+        :param logger: 日志对象
+        """
+        self.scanner = scanner
+        self.state = scanner.state
+        self.shard_size = max(1, shard_size)
+        self.workers = max(1, workers)
+        self.max_pending = max_pending or self.workers * 2
+        self.logger = logger
+        self.refetched = 0
+
+    async def run(self, start_block: int, end_block: int, progress_callback: Optional[Callable] = None) -> Tuple[int, int]:
+        """回填 [start_block, end_block]
+
+        :param progress_callback: 与 `BlockScanner.scan` 的进度回调相同
+        :return: tuple(处理的事件数, 分片数)
+        """
+        assert start_block <= end_block, "start_block:{} end_block:{}".format(start_block, end_block)
+        scanner = self.scanner
+        scanner.IS_RUN = True
+        shards = [(s, min(s + self.shard_size - 1, end_block)) for s in range(start_block, end_block + 1, self.shard_size)]
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in shards]
+        pending = asyncio.Semaphore(self.max_pending)
+        indexes = iter(range(len(shards)))
+
+        async def worker():
+            # 所有 worker 共用一个迭代器, 拿到名额后才按顺序领取分片, 应用阶段等待的分片总能先下载
+            while True:
+                await pending.acquire()
+                i = next(indexes, None)
+                if i is None:
+                    pending.release()
+                    return
+                if not scanner.IS_RUN:
+                    futures[i].set_result(None)
+                    return
+                s, e = shards[i]
+                try:
+                    version = self.state.get_address_version()
+                    futures[i].set_result((version, await scanner.fetch_chunk(s, e)))
+                except Exception as ex:
+                    futures[i].set_exception(ex)
+                    return
+                if not scanner.adaptive_rate:
+                    await asyncio.sleep(scanner.request_interval_sec)
+
+        tasks = [asyncio.create_task(worker()) for _ in range(min(self.workers, len(shards)))]
+        processed_event_count = 0
+        total_shards = 0
+        fork = None
+        try:
+            for i, (s, e) in enumerate(shards):
+                result = await futures[i]
+                if result is None or not scanner.IS_RUN:
+                    break
+                pending.release()
+                version, chunk = result
+                if version != self.state.get_address_version():
+                    self.refetched += 1
+                    chunk = await scanner.fetch_chunk(s, e)
+                self.state.start_chunk(s)
+                fork = await scanner.check_reorg(chunk)
+                if fork is not None:
+                    await scanner.rollback(fork)
+                    await scanner.end_chunk(fork)
+                    break
+                applied = await scanner.apply_events(chunk.events, chunk)
+                await scanner.end_chunk(e)
+                processed_event_count += applied
+                total_shards += 1
+                if progress_callback:
+                    progress_callback(start_block, end_block, s, chunk.block_timestamp, e - s + 1, applied)
+                if scanner.provider_pool:
+                    await scanner.provider_pool.recover()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for future in futures:
+                # 取出未应用分片的异常, 避免 "exception was never retrieved"
+                if future.done() and not future.cancelled():
+                    future.exception()
+        if self.refetched > 0 and self.logger:
+            self.logger.debug(f"Backfill refetched {self.refetched} shards after new addresses were tracked")
+        if fork is not None and scanner.IS_RUN:
+            events, chunks = await scanner.scan(fork + 1, end_block, progress_callback)
+            processed_event_count += events
+            total_shards += chunks
+        return processed_event_count, total_shards
@@ -50,9 +50,44 @@ class BaseScannerState(ABC):
         """
 
     @abstractmethod
-    def add_address(self, contract: str, address: str) -> None:
-        """添加新的要跟踪的合约地址"""
+    def add_address(self, contract: str, address: str, block_number: int = 0) -> bool:
+        """添加新的要跟踪的合约地址
+        :param block_number: 发现该地址的区块
+        :return: 是否是新地址
+        """
 
     @abstractmethod
     def get_address(self, contract: str) -> list:
         """返回动态跟踪的合约地址"""
+
+    def has_address(self, contract: str, address: str) -> bool:
+        """地址是否已经跟踪"""
+        return address in self.get_address(contract)
+
+    def subscribe_address(self, listener: Callable):
+        """订阅新添加的跟踪地址, listener(合约名, 地址, 添加后的版本), 不支持时不会通知, 订阅者按版本变化重建"""
+
+    def set_chain_head(self, head: int):
+        """当前的链头块号, 用于判断哪些区块还可能发生链重组"""
+
+    def may_reorg(self, block_number: int) -> bool:
+        """该区块是否还在可能发生链重组、需要检查哈希的范围内"""
+        return False
+
+    def check_blocks(self, blocks: list) -> Optional[int]:
+        """检查新区块的父哈希与已扫描的区块是否一致
+        :return: 第一个父哈希不一致的块号, 没有发现链重组或不支持检查时为 None
+        """
+        return None
+
+    def get_block_hash(self, block_number: int) -> Optional[str]:
+        """已扫描区块的哈希, 未知时为 None"""
+        return None
+
+    def get_deploy_block(self, contract: str) -> int:
+        """合约的部署区块, 在此之前不需要为该合约扫描, 未知时为 0"""
+        return 0
+
+    def get_address_version(self) -> int:
+        """跟踪地址集合的版本, 每次添加新地址后变化"""
+        return 0
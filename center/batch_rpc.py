@@ -0,0 +1,226 @@
+import asyncio
+import itertools
+import json
+import orjson
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from aiohttp import ClientSession, ClientResponseError, ClientTimeout
+from eth_utils import to_hex
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+from web3.middleware.geth_poa import geth_poa_cleanup
+from web3._utils.method_formatters import block_formatter, receipt_formatter
+from center.logger import Logger
+from center.rate_controller import RateController, request_slot
+from center.http_session import SessionPool
+from center.hedge import Hedge
+from center.records import block_record, receipt_record
+
+
+class BatchRpc:
+    """把多个 JSON-RPC 调用打包成一个数组请求发送。
+
+    `BlockScanner` 每个区块/收据都单独发一次 HTTP 请求，交易多的链上一个 chunk 就是成千上万次往返。
+    这里按 `batch_size` 拆分批次，一次 POST 发送一批调用，只重试失败的条目。
+    """
+
+    def __init__(self,
+                 endpoint_uri: str,
+                 batch_size: int = 100,
+                 max_retries: int = 3,
+                 retry_seconds: float = 3.0,
+                 headers: dict = None,
+                 timeout: float = 60,
+                 logger: Logger = None,
+                 throttled_handle: Optional[Callable] = None,
+                 rate_controller: RateController = None,
+                 provider_pool=None,
+                 sessions: SessionPool = None,
+                 hedge: Hedge = None):
+        """
+        :param endpoint_uri: JSON-RPC 地址
+        :param batch_size: 单个数组请求中包含的最大调用数
+        :param max_retries: 失败条目的最大重试次数
+        :param retry_seconds: 重试之间的间隔
+        :param headers: 请求头
+        :param timeout: 单次 HTTP 请求超时秒数
+        :param logger: 日志对象
+        :param throttled_handle: 服务端返回 429 时的回调
+        :param rate_controller: 自适应并发与速率控制器, 每个数组请求占用一个名额
+        :param provider_pool: 节点池, 设置后每个数组请求由节点池选择节点, 忽略 endpoint_uri 与 rate_controller
+        :param sessions: 共用的连接池, 为空时使用自己的 session
+        :param hedge: 数组请求的对冲策略, 为空时不对冲; 数组请求的延迟与单个请求不同, 不要与 `BlockScanner` 共用
+        """
+        self.endpoint_uri = endpoint_uri
+        self.batch_size = max(1, batch_size)
+        self.max_retries = max_retries
+        self.retry_seconds = retry_seconds
+        self.headers = headers or { 'Content-Type': 'application/json'}
+        self.timeout = ClientTimeout(total=timeout)
+        self.logger = logger
+        self.throttled_handle = throttled_handle
+        self.rate_controller = rate_controller
+        self.provider_pool = provider_pool
+        self.sessions = sessions
+        self.hedge = hedge
+        self._ids = itertools.count(1)
+        self._session: ClientSession = None
+        self._session_loop = None  # 创建 session 时的事件循环
+
+    def set_endpoint(self, endpoint_uri: str):
+        """切换 JSON-RPC 地址"""
+        self.endpoint_uri = endpoint_uri
+
+    def _get_session(self, uri: str) -> ClientSession:
+        if self.sessions:
+            return self.sessions.get(uri)
+        # session 必须属于当前事件循环
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            self._session = ClientSession(timeout=self.timeout)
+            self._session_loop = loop
+        return self._session
+
+    async def close(self):
+        # 共用的连接池由创建者关闭
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+    async def _post(self, payload: List[dict], endpoint=None) -> List[dict]:
+        uri = endpoint.uri if endpoint else self.endpoint_uri
+        session = self._get_session(uri)
+        async with session.post(uri, data=orjson.dumps(payload), headers=self.headers, timeout=self.timeout, raise_for_status=True) as resp:
+            if endpoint:
+                endpoint.update_quota(resp.headers)
+            body = await resp.read()
+        try:
+            data = orjson.loads(body)
+        except orjson.JSONDecodeError:
+            # orjson 不支持超过 64 位的整数
+            data = json.loads(body)
+        # 有些节点在批次整体出错时返回单个对象
+        if isinstance(data, dict):
+            return [data]
+        return data
+
+    async def _send_batch(self, method: str, params_list: List[list], indexes: List[int]) -> Tuple[Dict[int, Any], List[int]]:
+        """发送一个数组请求, 返回 (成功结果, 失败的下标)"""
+        id_map = {}
+        payload = []
+        for i in indexes:
+            rid = next(self._ids)
+            id_map[rid] = i
+            payload.append({ "jsonrpc": "2.0", "id": rid, "method": method, "params": params_list[i] })
+        results = {}
+        used = []
+
+        async def attempt():
+            # 对冲请求重新选择节点, 避开已经使用的节点
+            endpoint = None
+            slot = request_slot(self.rate_controller)
+            if self.provider_pool:
+                endpoint = self.provider_pool.select(used)
+                used.append(endpoint)
+                slot = self.provider_pool.slot(endpoint)
+            async with slot:
+                return await self._post(payload, endpoint)
+
+        try:
+            responses = await (self.hedge.run(attempt) if self.hedge else attempt())
+        except ClientResponseError as e:
+            if e.status == 429 and self.throttled_handle:
+                self.throttled_handle()
+            if self.logger:
+                self.logger.warning(f"{method} batch of {len(indexes)} failed with HTTP {e.status}")
+            return results, indexes
+        except Exception as e:
+            if self.logger:
+                self.logger.warning(f"{method} batch of {len(indexes)} failed: {e}")
+            return results, indexes
+        for resp in responses:
+            i = id_map.get(resp.get("id"))
+            if i is None:
+                continue
+            # null 结果(如区块还未产生)也当作失败重试
+            if resp.get("error") is None and resp.get("result") is not None:
+                results[i] = resp["result"]
+        failed = [i for i in indexes if i not in results]
+        return results, failed
+
+    async def call(self, method: str, params: list) -> Any:
+        """发送单个调用, 出错时抛出异常"""
+        responses = await self._post([{ "jsonrpc": "2.0", "id": next(self._ids), "method": method, "params": params }])
+        resp = responses[0]
+        if resp.get("error") is not None:
+            raise ValueError(resp["error"])
+        return resp.get("result")
+
+    async def call_many(self, method: str, params_list: List[list]) -> Tuple[Dict[int, Any], List[int]]:
+        """按 batch_size 拆分并发送同一方法的多个调用，只重试失败的条目。
+
+        :param method: JSON-RPC 方法名
+        :param params_list: 每个调用的参数列表
+        :return: tuple(下标 -> 原始结果, 重试后仍失败的下标)
+        """
+        results: Dict[int, Any] = {}
+        pending = list(range(len(params_list)))
+        attempt = 0
+        while len(pending) > 0:
+            batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+            done = await asyncio.gather(*[self._send_batch(method, params_list, b) for b in batches])
+            pending = []
+            for res, failed in done:
+                results.update(res)
+                pending += failed
+            if len(pending) == 0 or attempt >= self.max_retries:
+                break
+            attempt += 1
+            await asyncio.sleep(self.retry_seconds)
+        return results, pending
+
+    async def get_blocks(self, block_numbers: list, full_transactions: bool = True, raw: bool = False) -> Tuple[List[AttributeDict], list]:
+        """批量获取区块
+
+        :param raw: 为 true 时返回 `center.records` 中的轻量记录, 不经过 web3 格式化
+        :return: tuple(按块号排序的区块, 失败的块号)
+        """
+        params = [[hex(b), full_transactions] for b in block_numbers]
+        results, failed = await self.call_many("eth_getBlockByNumber", params)
+        formatter = block_record if raw else format_block
+        blocks = [formatter(results[i]) for i in sorted(results.keys())]
+        blocks.sort(key=lambda o: o.number)
+        return blocks, [block_numbers[i] for i in failed]
+
+    async def get_receipts(self, tx_hashes: list, raw: bool = False) -> Tuple[List[AttributeDict], list]:
+        """批量获取交易收据
+
+        :param raw: 为 true 时返回轻量记录
+        :return: tuple(按块号排序的收据, 失败的交易hash)
+        """
+        params = [[to_hex(HexBytes(h))] for h in tx_hashes]
+        results, failed = await self.call_many("eth_getTransactionReceipt", params)
+        formatter = receipt_record if raw else format_receipt
+        receipts = [formatter(results[i]) for i in sorted(results.keys())]
+        receipts.sort(key=lambda o: o.blockNumber)
+        return receipts, [tx_hashes[i] for i in failed]
+
+    async def get_block_receipts(self, block_numbers: list, raw: bool = False) -> Tuple[Dict[int, List[AttributeDict]], list]:
+        """使用 eth_getBlockReceipts 批量获取整块的收据
+
+        :param raw: 为 true 时返回轻量记录
+        :return: tuple(块号 -> 收据列表, 失败的块号)
+        """
+        params = [[hex(b)] for b in block_numbers]
+        results, failed = await self.call_many("eth_getBlockReceipts", params)
+        formatter = receipt_record if raw else format_receipt
+        receipts = {block_numbers[i]: [formatter(r) for r in results[i]] for i in results.keys()}
+        return receipts, [block_numbers[i] for i in failed]
+
+
+def format_block(raw: dict) -> AttributeDict:
+    """和 web3 的 get_block 结果保持一致(含 geth_poa 中间件的处理)"""
+    return AttributeDict.recursive(block_formatter(geth_poa_cleanup(raw)))
+
+
+def format_receipt(raw: dict) -> AttributeDict:
+    """和 web3 的 get_transaction_receipt 结果保持一致"""
+    return AttributeDict.recursive(receipt_formatter(raw))
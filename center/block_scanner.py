@@ -1,20 +1,85 @@
 import asyncio
-import time
 from typing import List, Tuple, Optional, Callable
 from web3 import AsyncWeb3
-from web3.exceptions import BlockNotFound
+from web3.exceptions import BlockNotFound, TransactionNotFound
 from web3.types import EventData, HexBytes
 from web3.datastructures import AttributeDict
 from web3._utils.filters import construct_event_filter_params
-from web3._utils.events import get_event_data
-from center.events import Events, TRANSFER_EVENT_NAME
+from center.events import Events
 from center.database.logs import getLogs
 from center.base_scanner_state import BaseScannerState
 from center.logger import Logger
 from center.database.block import BlockLog, ReceiptLog, EventInfo
+from center.batch_rpc import BatchRpc, format_receipt
+from center.receipt_strategy import ReceiptStrategy
+from center.bloom import BloomFilter
+from center.rate_controller import RateController, request_slot
+from center.provider_pool import ProviderPool
+from center.hedge import Hedge
+from center.records import Record, block_record, receipt_record
+from center.pipeline import Pipeline
+from center.decode_pool import DecodePool
+from center.parallel_apply import ParallelApply
+from center.writer import BackgroundWriter
+from center.dispatch import DispatchTable
 from center.utils import async_retry
 from aiohttp import ClientResponseError
 
+# 扫描模式
+SCAN_MODE_FULL = "full"  # 下载范围内所有区块与收据
+SCAN_MODE_HYBRID = "hybrid"  # 只有事件处理器的合约用 eth_getLogs, 有 _transfer 处理器的合约下载完整区块
+
+# 节点拒绝 eth_getLogs 查询的错误: 结果超过上限或参数无效, 重试同样的查询不会成功
+INVALID_PARAMS_CODE = -32602
+LIMIT_EXCEEDED_CODE = -32005
+LIMIT_EXCEEDED_MESSAGES = ("more than", "too many", "limit exceeded", "size exceeded", "exceeds", "range is too")
+
+
+def is_rejected_query(e: Exception) -> bool:
+    """eth_getLogs 的错误是否是节点拒绝了查询本身, 而不是暂时的传输错误"""
+    error = e.args[0] if len(e.args) > 0 else None
+    if not isinstance(error, dict):
+        return False
+    if error.get("code") in (INVALID_PARAMS_CODE, LIMIT_EXCEEDED_CODE):
+        return True
+    message = str(error.get("message", "")).lower()
+    return any(m in message for m in LIMIT_EXCEEDED_MESSAGES)
+
+
+def split_log_filter(filters: dict) -> Optional[Tuple[dict, dict]]:
+    """把 eth_getLogs 的过滤条件按地址或 topic 一分为二, 只有一个地址与一个 topic 时返回 None"""
+    address = filters.get("address")
+    if isinstance(address, list) and len(address) > 1:
+        mid = len(address) // 2
+        return dict(filters, address=address[:mid]), dict(filters, address=address[mid:])
+    topics = filters.get("topics") or []
+    if len(topics) > 0 and isinstance(topics[0], list) and len(topics[0]) > 1:
+        mid = len(topics[0]) // 2
+        return dict(filters, topics=[topics[0][:mid]] + topics[1:]), dict(filters, topics=[topics[0][mid:]] + topics[1:])
+    return None
+
+
+class ScanChunk(object):
+    """一段区块范围在扫描各阶段之间传递的数据"""
+
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.address_version = 0  # 获取时跟踪地址集合的版本
+        self.blocks = []
+        # 混合模式下只按这些合约筛选收据, 并额外获取有日志的交易的收据
+        self.receipt_contracts = None
+        self.log_transactions = None
+        # 混合模式下可能重组的范围内, 获取日志前取得的结束区块头, 没有日志的区块也能检查链重组
+        self.head = None
+        self.receipts = []
+        self.block_timestamp = None
+        self.events: List[EventInfo] = []
+        # 应用的事件数, 包括新跟踪地址重新分发的事件; 发现链重组没有应用时为 None
+        self.applied = 0
+        # 区块与收据来自数据库归档, 不需要补齐收据
+        self.archived = False
+
 
 class BlockScanner:
     """扫描区块链中的事件并尽量不要过度滥用 JSON-RPC API。
@@ -36,7 +101,21 @@ class BlockScanner:
                  request_retry_seconds: float = 3.0,
                  contracts: dict = dict(),
                  logger: Logger = None,
-                 switch_provider_handle=None):
+                 switch_provider_handle=None,
+                 batch_rpc: BatchRpc = None,
+                 receipt_strategy: ReceiptStrategy = None,
+                 bloom_filter: bool = True,
+                 scan_mode: str = SCAN_MODE_FULL,
+                 max_request_retries: int = 30,
+                 rate_controller: RateController = None,
+                 provider_pool: ProviderPool = None,
+                 hedge: Hedge = None,
+                 raw_records: bool = False,
+                 pipeline_depth: int = 0,
+                 decode_pool: DecodePool = None,
+                 parallel_apply: ParallelApply = None,
+                 writer: BackgroundWriter = None,
+                 max_reorg_depth: int = 0):
         """
         :param web3: 异步Web3对象
         :param state: 扫描的状态管理对象
@@ -48,6 +127,20 @@ class BlockScanner:
         :param contracts: 配置文件中配置的合约map
         :param logger: 日志对象
         :param switch_provider_handle: 切换web3 api的回调
+        :param batch_rpc: JSON-RPC 批量请求对象, 为空时每个区块/收据单独请求
+        :param receipt_strategy: 收据获取策略, 为空时逐笔获取收据
+        :param bloom_filter: 是否用区块的 logsBloom 跳过不相关区块的收据下载
+        :param scan_mode: full 或 hybrid
+        :param max_request_retries: eth_getLogs 单个区块失败时的最大重试次数
+        :param rate_controller: 自适应并发与速率控制器, 为空时使用固定的并发数与请求间隔
+        :param provider_pool: 节点池, 设置后每个请求按权重从池中选择节点, 使用该节点的 web3 与速率控制器
+        :param hedge: 区块与收据请求的对冲策略, 为空时不对冲
+        :param raw_records: 区块与收据不经过 web3 格式化, 解析为 `center.records` 中的轻量记录并直接归档原始结果
+        :param pipeline_depth: 大于 0 时区块获取、收据获取、解码、应用与检查点分阶段流水线执行, 为每个阶段队列的容量
+        :param decode_pool: 事件日志的解码进程池, 为空时在当前线程解码
+        :param parallel_apply: 乐观并行执行事件处理器, 为空时按顺序逐个执行
+        :param writer: 区块与收据归档的后台写入线程, 设置后事件处理器也在线程中执行; 为空时在事件循环中直接写入
+        :param max_reorg_depth: 大于 0 时应用事件前检查新区块的父哈希, 发现链重组后回滚到分叉点重新扫描, 为最多回滚的块数
         """
         self.IS_RUN = False
         self.logger = logger
@@ -56,6 +149,27 @@ class BlockScanner:
         self.events = events
         self.contracts = contracts
         self.switch_provider_handle = switch_provider_handle
+        self.batch_rpc = batch_rpc
+        self.receipt_strategy = receipt_strategy
+        self.bloom_filter = bloom_filter
+        self.scan_mode = scan_mode
+        self.max_request_retries = max_request_retries
+        self.rate_controller = rate_controller
+        self.provider_pool = provider_pool
+        self.hedge = hedge
+        self.raw_records = raw_records
+        self.pipeline_depth = pipeline_depth
+        self.pipeline: Pipeline = None
+        self.decode_pool = decode_pool
+        self.parallel_apply = parallel_apply
+        self.writer = writer
+        self.max_reorg_depth = max_reorg_depth
+        self.dispatch = DispatchTable(events, state)
+        if state is not None:
+            # 事件处理器添加新地址后增量更新分发表
+            state.subscribe_address(self.dispatch.add_address)
+        # 由速率控制器决定并发时不再按固定间隔休眠
+        self.adaptive_rate = rate_controller is not None or (provider_pool is not None and provider_pool.adaptive)
 
         # JSON-RPC 节流参数
         self.min_scan_chunk_size = 10  # 12秒/块 = 120秒周期
@@ -72,6 +186,63 @@ class BlockScanner:
     def stop(self):
         self.IS_RUN = False
 
+    def stats(self) -> dict:
+        """扫描器的 JSON-RPC 统计"""
+        stats = {}
+        if self.rate_controller:
+            stats['rate_controller'] = self.rate_controller.stats()
+        if self.provider_pool:
+            stats['providers'] = self.provider_pool.stats()
+        if self.hedge:
+            stats['hedge'] = self.hedge.stats()
+        if self.batch_rpc and self.batch_rpc.hedge:
+            stats['batch_hedge'] = self.batch_rpc.hedge.stats()
+        if self.pipeline:
+            stats['pipeline'] = self.pipeline.stats()
+        if self.decode_pool:
+            stats['decode_pool'] = self.decode_pool.stats()
+        if self.parallel_apply:
+            stats['parallel_apply'] = self.parallel_apply.stats()
+        if self.writer:
+            stats['writer'] = self.writer.stats()
+        return stats
+
+    def select_web3(self, exclude: list = None):
+        """选择本次请求使用的 web3 对象
+
+        :param exclude: 使用节点池时尽量不选择的节点
+        :return: tuple(web3, 用于 `async with` 的请求名额)
+        """
+        if self.provider_pool:
+            endpoint = self.provider_pool.select(exclude)
+            return endpoint.web3, self.provider_pool.slot(endpoint)
+        return self.web3, request_slot(self.rate_controller)
+
+    async def hedged_request(self, request: Callable):
+        """执行 request(web3), 启用对冲时慢请求会在另一个节点上重发
+
+        :param request: 接收 web3 对象, 返回 awaitable
+        """
+        used = []
+
+        async def attempt():
+            web3, slot = self.select_web3(used)
+            if self.provider_pool:
+                used.append(slot.endpoint)
+            async with slot:
+                return await request(web3)
+
+        if self.hedge is None:
+            return await attempt()
+        return await self.hedge.run(attempt)
+
+    async def fetch_raw(self, method: str, params: list):
+        """绕过 web3 的结果格式化直接调用 JSON-RPC, 返回原始结果"""
+        resp = await self.hedged_request(lambda web3: web3.provider.make_request(method, params))
+        if resp.get("error") is not None:
+            raise ValueError(resp["error"])
+        return resp.get("result")
+
     def get_suggested_scan_start_block(self):
         """获取我们应该开始扫描新事件的位置。
 
@@ -90,11 +261,17 @@ class BlockScanner:
         """获取关注的以太坊链上最后一个开采的区块。"""
 
         # 不要一直扫描到最后一个区块，因为这个区块可能还没有被开采
-        try:
-            bn = await self.web3.eth.block_number
-            return bn - chain_reorg_safety_blocks
-        except Exception:
-            return 0
+        # 使用节点池时失败的节点会降低权重或被剔除, 换一个节点再试
+        attempts = len(self.provider_pool) if self.provider_pool else 1
+        for _ in range(attempts):
+            try:
+                web3, slot = self.select_web3()
+                async with slot:
+                    bn = await web3.eth.block_number
+                return bn - chain_reorg_safety_blocks
+            except Exception:
+                continue
+        return 0
 
     def get_last_scanned_block(self) -> int:
         return self.state.get_last_scanned_block()
@@ -103,29 +280,106 @@ class BlockScanner:
         """在区块链重组的情况下清除旧数据。"""
         self.state.delete_data(after_block)
 
+    async def check_reorg(self, chunk: ScanChunk) -> Optional[int]:
+        """检查 chunk 的区块是否接在已扫描的链上
+
+        :return: 发生了链重组时返回分叉点, 即与节点一致的最后一个已扫描区块, 否则为 None
+        """
+        if self.max_reorg_depth <= 0:
+            return None
+        blocks = list(chunk.blocks)
+        forked = None
+        if chunk.head is not None:
+            # 混合模式下的区块不连续, 先确认上一个 chunk 结束的区块仍在链上
+            forked = await self.check_previous_head(chunk.start - 1)
+            if chunk.end not in set(block.number for block in blocks):
+                blocks.append(chunk.head)
+        if forked is None and len(blocks) > 0:
+            forked = self.state.check_blocks(blocks)
+        if forked is None:
+            return None
+        fork = await self.find_fork(forked - 1)
+        if fork is None:
+            self.logger.error(f"Chain reorg at block {forked} is deeper than {self.max_reorg_depth} blocks, data is not rolled back")
+        return fork
+
+    async def check_previous_head(self, block_number: int) -> Optional[int]:
+        """已扫描的 block_number 的哈希与节点不一致时返回 block_number + 1, 即第一个需要回滚的区块"""
+        known = self.state.get_block_hash(block_number)
+        if known is None:
+            return None
+        block = await self.hedged_request(lambda web3: web3.eth.get_block(block_number))
+        if HexBytes(block.hash).hex() != known:
+            return block_number + 1
+        return None
+
+    async def find_fork(self, block_number: int) -> Optional[int]:
+        """从 block_number 向前查找记录的哈希与节点一致的区块, 超过 max_reorg_depth 时返回 None"""
+        for number in range(block_number, max(block_number - self.max_reorg_depth, -1), -1):
+            known = self.state.get_block_hash(number)
+            if known is None:
+                continue
+            block = await self.hedged_request(lambda web3: web3.eth.get_block(number))
+            if HexBytes(block.hash).hex() == known:
+                return number
+        return None
+
+    async def rollback(self, fork: int):
+        """链重组后回滚到分叉点, 之前先等待归档写入完成, 避免分叉链的区块在回滚后写入"""
+        if self.writer:
+            await self.writer.flush()
+            restored = await self.writer.run(self.state.delete_data, fork)
+        else:
+            restored = self.state.delete_data(fork)
+        self.logger.warning(f"Chain reorg: rolled back to block {fork}, restored {restored} entities")
+
     async def scan_chunk(self, start_block, end_block) -> Tuple[int, int, int]:
         """读取和处理块号之间的事件。
 
         如果 JSON-RPC 服务器出现问题，则动态减小块的大小。
+        发现链重组时回滚到分叉点, 返回的结束区块为分叉点。
 
         :return: tuple(实际结束区块编号,该区块何时被挖掘,已处理事件)
         """
 
         # 获取指定区块区间的所有事件(包括转账)
-        block_timestamp, all_events = await self.fetch_events(start_block, end_block)
+        chunk = await self.fetch_chunk(start_block, end_block)
+
+        fork = await self.check_reorg(chunk)
+        if fork is not None:
+            await self.rollback(fork)
+            return fork, None, 0
 
         # 开始根据事件生成数据表
-        for event in all_events:
-            self.state.process_event(event, self.contracts, self.new_dynamic_address)
+        applied = await self.apply_events(chunk.events, chunk)
+
+        return end_block, chunk.block_timestamp, applied
+
+    async def archive(self, write: Callable):
+        """归档区块或收据, 有后台写入线程时不等待写入完成"""
+        if self.writer:
+            await self.writer.submit(write)
+        else:
+            write()
 
-        return end_block, block_timestamp, len(all_events)
+    async def end_chunk(self, block_number: int):
+        """保存扫描进度, 之前先等待该 chunk 的归档写入完成"""
+        if self.writer:
+            await self.writer.flush()
+        self.state.end_chunk(block_number)
 
     @async_retry
     async def fetch_block(self, block_number):
         try:
-            result = await self.web3.eth.get_block(block_number, True)
+            if self.raw_records:
+                raw = await self.fetch_raw("eth_getBlockByNumber", [hex(block_number), True])
+                if raw is None:
+                    raise BlockNotFound(f"Block with id: '{block_number}' not found.")
+                result = block_record(raw)
+            else:
+                result = await self.hedged_request(lambda web3: web3.eth.get_block(block_number, True))
             if result:
-                BlockLog.save_logs([BlockLog.create_log(result)])
+                await self.archive(lambda: BlockLog.save_logs([BlockLog.create_log(result)]))
             return result
         except ClientResponseError as e:
             if e.status == 429:
@@ -140,9 +394,15 @@ class BlockScanner:
     @async_retry
     async def fetch_receipt(self, tx_hash):
         try:
-            result = await self.web3.eth.get_transaction_receipt(tx_hash)
+            if self.raw_records:
+                raw = await self.fetch_raw("eth_getTransactionReceipt", [tx_hash.hex()])
+                if raw is None:
+                    raise TransactionNotFound(f"Transaction with hash: '{tx_hash.hex()}' not found.")
+                result = receipt_record(raw)
+            else:
+                result = await self.hedged_request(lambda web3: web3.eth.get_transaction_receipt(tx_hash))
             if result:
-                ReceiptLog.save_logs([ReceiptLog.create_log(result)])
+                await self.archive(lambda: ReceiptLog.save_logs([ReceiptLog.create_log(result)]))
             return result
         except ClientResponseError as e:
             if e.status == 429:
@@ -155,18 +415,29 @@ class BlockScanner:
             return tx_hash
 
     async def batch_fetch_block(self, block_numbers: list):
+        if self.batch_rpc:
+            blocks, errs = await self.batch_rpc.get_blocks(block_numbers, raw=self.raw_records)
+            if len(blocks) > 0:
+                await self.archive(lambda: BlockLog.save_logs([BlockLog.create_log(b) for b in blocks]))
+            return blocks, errs
         tasks = []
         blocks = []
         for b in block_numbers:
             tasks.append(asyncio.create_task(self.fetch_block(b)))
         done, _ = await asyncio.wait(tasks)
         results = [t.result() for t in done]
-        blocks = [b for b in results if isinstance(b, AttributeDict)]
-        errs = [e for e in results if isinstance(e, AttributeDict) == False]
+        blocks = [b for b in results if isinstance(b, (AttributeDict, Record))]
+        errs = [e for e in results if isinstance(e, (AttributeDict, Record)) == False]
         blocks.sort(key=lambda o: o.number)
         return blocks, errs
 
     async def batch_fetch_receipt(self, transactions: list):
+        if self.batch_rpc:
+            tx_hashes = [t if isinstance(t, HexBytes) else t.hash for t in transactions]
+            receipts, errs = await self.batch_rpc.get_receipts(tx_hashes, raw=self.raw_records)
+            if len(receipts) > 0:
+                await self.archive(lambda: ReceiptLog.save_logs([ReceiptLog.create_log(r) for r in receipts]))
+            return receipts, errs
         tasks = []
         receipts = []
         for transaction in transactions:
@@ -176,8 +447,8 @@ class BlockScanner:
                 tasks.append(asyncio.create_task(self.fetch_receipt(transaction.hash)))
         done, _ = await asyncio.wait(tasks)
         results = [t.result() for t in done]
-        receipts = [r for r in results if isinstance(r, AttributeDict)]
-        errs = [e for e in results if isinstance(e, AttributeDict) == False]
+        receipts = [r for r in results if isinstance(r, (AttributeDict, Record))]
+        errs = [e for e in results if isinstance(e, (AttributeDict, Record)) == False]
         receipts.sort(key=lambda o: o.blockNumber)
         return receipts, errs
 
@@ -185,7 +456,20 @@ class BlockScanner:
         transactions = []
         for block in blocks:
             transactions += block.transactions
-        return [transactions[i:i + self.max_scan_chunk_size] for i in range(0, len(transactions), self.max_scan_chunk_size)]
+        return self.group_transactions(transactions)
+
+    def group_transactions(self, transactions):
+        # 由速率控制器决定并发时一次提交全部请求
+        if self.adaptive_rate:
+            return [transactions] if len(transactions) > 0 else []
+        # 批量模式下一组交易拆成 max_scan_chunk_size 个数组请求并发发送
+        size = self.max_scan_chunk_size
+        if self.batch_rpc:
+            size *= self.batch_rpc.batch_size
+        # 节点池中每个节点各自承担 max_scan_chunk_size 个并发
+        if self.provider_pool:
+            size *= len(self.provider_pool)
+        return [transactions[i:i + size] for i in range(0, len(transactions), size)]
 
     def get_block_timestamp(self, blocks):
         return {b.number: b.timestamp for b in blocks}
@@ -193,76 +477,468 @@ class BlockScanner:
     def get_transaction_map(self, transactions):
         return {t.hash.hex(): t for t in transactions}
 
-    async def fetch_events(self, block_number, end_block) -> Tuple[int, List[EventInfo]]:
-        blocks, errs = await self.batch_fetch_block([b for b in range(block_number, end_block + 1)])
+    async def fetch_block_receipts(self, block_numbers: list):
+        """使用 eth_getBlockReceipts 获取整块的收据, 每块一次调用"""
+        if self.batch_rpc:
+            receipt_map, errs = await self.batch_rpc.get_block_receipts(block_numbers, raw=self.raw_records)
+        else:
+            receipt_map = {}
+            errs = []
+            for b in block_numbers:
+                try:
+                    web3, slot = self.select_web3()
+                    async with slot:
+                        resp = await web3.provider.make_request("eth_getBlockReceipts", [hex(b)])
+                    if resp.get("error") is None and resp.get("result") is not None:
+                        formatter = receipt_record if self.raw_records else format_receipt
+                        receipt_map[b] = [formatter(r) for r in resp["result"]]
+                    else:
+                        errs.append(b)
+                except ClientResponseError as e:
+                    if e.status == 429 and self.switch_provider_handle:
+                        self.switch_provider_handle()
+                    errs.append(b)
+                except Exception as e:
+                    self.logger.exception(f"fetch_block_receipts error : {e}")
+                    errs.append(b)
+        receipts = []
+        for b in sorted(receipt_map.keys()):
+            receipts += receipt_map[b]
+        if len(receipts) > 0:
+            await self.archive(lambda: ReceiptLog.save_logs([ReceiptLog.create_log(r) for r in receipts]))
+        return receipts, errs
+
+    def use_block_receipts(self) -> bool:
+        """当前节点是否支持按块获取收据"""
+        if self.receipt_strategy is None:
+            return False
+        # 请求会分散到池中所有节点, 要求每个节点都支持
+        if self.provider_pool:
+            return all(self.receipt_strategy.use_block_receipts(uri) for uri in self.provider_pool.uris)
+        return self.receipt_strategy.use_block_receipts(self.web3.provider.endpoint_uri)
+
+    async def fetch_blocks(self, block_numbers: list):
+        blocks, errs = await self.batch_fetch_block(block_numbers)
         # 请求报错时这里会一直请求, 注意观察性能
         while len(errs) > 0:
             b2, errs = await self.batch_fetch_block(errs)
             blocks += b2
             await asyncio.sleep(self.request_retry_seconds)
+        blocks.sort(key=lambda o: o.number)
+        return blocks
 
-        transactions_group = self.get_transactions_by_blocks(blocks)
-        block_timestamp = self.get_block_timestamp(blocks)
-        timestamp = block_timestamp.get(blocks[0].number)
-        # 获取所有加载的合约，以执行扫描
-        contracts = self.events.getContractNames()
-        eventLogs: List[EventInfo] = []
-        for transactions in transactions_group:
-            transaction_map = self.get_transaction_map(transactions)
-            receipts, errs = await self.batch_fetch_receipt(transactions)
+    def deployed_contracts(self, contracts, end_block: int) -> list:
+        """在 end_block 之前已经部署的合约, 还没有部署的合约不会产生日志与交易"""
+        return [c for c in contracts if self.state.get_deploy_block(c) <= end_block]
+
+    def select_receipts(self, blocks, contracts=None):
+        """用 logsBloom 预先筛选需要下载收据的区块与交易
+
+        :param contracts: 参与筛选的合约, 为空时为全部加载的合约
+        :return: tuple(需要全部收据的区块, 其余区块中 to 为跟踪地址且 input 匹配交易处理器的交易)
+        """
+        if contracts is None:
+            contracts = self.events.getContractNames()
+        if len(blocks) > 0:
+            contracts = self.deployed_contracts(contracts, max(b.number for b in blocks))
+        groups = []
+        transfer_adds = set()
+        for contract in contracts:
+            adds = self.state.get_address(contract)
+            if len(adds) == 0:
+                continue
+            _, topics = self.events.getTopics(contract)
+            groups.append((adds, topics))
+            if len(self.events.getTransactionHandlers(contract)) > 0:
+                transfer_adds.update(adds)
+        matched = BloomFilter(groups).match([b.get('logsBloom') for b in blocks])
+        full_blocks = []
+        transactions = []
+        if len(transfer_adds) > 0:
+            self.dispatch.refresh()
+        for block, hit in zip(blocks, matched):
+            if hit:
+                full_blocks.append(block)
+            elif len(transfer_adds) > 0:
+                # input 不匹配交易处理器的交易不需要收据
+                transactions += [t for t in block.transactions if t.to in transfer_adds and len(self.dispatch.route_transaction(t, decode=False)) > 0]
+        return full_blocks, transactions
+
+    async def fetch_receipts(self, blocks, contracts=None, transactions: list = None):
+        """获取区块中需要处理的交易的收据
+
+        :param contracts: 只按这些合约筛选区块, 为空时为全部加载的合约
+        :param transactions: 额外需要收据的交易
+        """
+        if self.bloom_filter:
+            full_blocks, selected = self.select_receipts(blocks, contracts)
+        else:
+            full_blocks, selected = blocks, []
+        if transactions:
+            full_numbers = set(b.number for b in full_blocks)
+            known = set(t.hash for t in selected)
+            selected += [t for t in transactions if t.blockNumber not in full_numbers and t.hash not in known]
+        transactions = selected
+        receipts = []
+        if self.use_block_receipts():
+            block_numbers = [b.number for b in full_blocks if len(b.transactions) > 0]
+            receipts, errs = await self.fetch_block_receipts(block_numbers)
             while len(errs) > 0:
-                r2, errs = await self.batch_fetch_receipt(errs)
+                r2, errs = await self.fetch_block_receipts(errs)
                 receipts += r2
                 await asyncio.sleep(self.request_retry_seconds)
-            for receipt in receipts:
-                timestamp = block_timestamp.get(receipt.blockNumber)
-                tx = transaction_map.get(receipt.transactionHash.hex())
-                for contract in contracts:
-                    adds = self.state.get_address(contract)
-                    if len(adds) == 0:
-                        continue
-                    # 处理原生转账生成事件
-                    hasTransfer = self.events.getHandle(contract, TRANSFER_EVENT_NAME)
-                    if hasTransfer and tx.to in adds:
-                        ei = EventInfo()
-                        ei.index = -1
-                        ei.eventName = TRANSFER_EVENT_NAME
-                        ei.blockNumber = tx.blockNumber
-                        ei.contract = contract
-                        ei.timestamp = timestamp
-                        # ei.event = evt
-                        ei.receipt = receipt
-                        ei.transaction = tx
-                        eventLogs.append(ei)
-                    # 处理合约事件
-                    for log in receipt.logs:
-                        evt = self.events.getEventData(self.web3, contract, log)
-                        # evt.logIndex 块中日志索引位置的整数，待处理时为空
-                        # 我们无法避免小的链重组,但至少我们必须避免尚未开采的区块
-                        if evt and evt.logIndex is not None and evt.address in adds:
-                            ei = EventInfo()
-                            ei.eventName = evt.event
-                            ei.index = evt.logIndex
-                            ei.blockNumber = evt.blockNumber
-                            ei.contract = contract
-                            ei.timestamp = timestamp
-                            ei.event = evt
-                            ei.receipt = receipt
-                            ei.transaction = tx
-                            eventLogs.append(ei)
-            await asyncio.sleep(self.request_interval_sec)
+        else:
+            for block in full_blocks:
+                transactions += block.transactions
+        return receipts + await self.fetch_transaction_receipts(transactions)
+
+    async def fetch_transaction_receipts(self, transactions: list) -> list:
+        """按交易获取收据"""
+        receipts = []
+        for group in self.group_transactions(transactions):
+            r1, errs = await self.batch_fetch_receipt(group)
+            while len(errs) > 0:
+                r2, errs = await self.batch_fetch_receipt(errs)
+                r1 += r2
+                await asyncio.sleep(self.request_retry_seconds)
+            receipts += r1
+            if not self.adaptive_rate:
+                await asyncio.sleep(self.request_interval_sec)
+        return receipts
+
+    def route_receipt(self, receipt, tx, timestamp: int) -> Tuple[List[EventInfo], list]:
+        """按分发表找出收据中需要处理的原生转账与合约事件
+
+        :return: tuple(事件列表, 需要解码的 (事件, 合约名, 日志))
+        """
+        eventLogs: List[EventInfo] = []
+        jobs = []
+        # 处理原生转账生成事件
+        for contract, handler_name, call in self.dispatch.route_transaction(tx):
+            eventLogs.append(EventInfo(contract, timestamp, call, handler_name, receipt, tx, -1, tx.blockNumber))
+        # 处理合约事件, 先按地址与 topic 筛选, 之后统一解码
+        for log in receipt.logs:
+            # log.logIndex 块中日志索引位置的整数，待处理时为空
+            # 我们无法避免小的链重组,但至少我们必须避免尚未开采的区块
+            if log.logIndex is None:
+                continue
+            for contract, event_name, _ in self.dispatch.route_log(log):
+                ei = EventInfo(contract, timestamp, None, event_name, receipt, tx, log.logIndex, log.blockNumber)
+                eventLogs.append(ei)
+                jobs.append((ei, contract, log))
+        return eventLogs, jobs
 
+    async def build_events(self, receipts, transaction_map: dict, block_timestamp: dict) -> List[EventInfo]:
+        """根据收据生成需要处理的事件"""
+        self.dispatch.refresh()
+        eventLogs: List[EventInfo] = []
+        jobs = []
+        for receipt in receipts:
+            events, receipt_jobs = self.route_receipt(receipt, transaction_map.get(receipt.transactionHash.hex()), block_timestamp.get(receipt.blockNumber))
+            eventLogs += events
+            jobs += receipt_jobs
+        await self.decode_events(jobs)
         eventLogs.sort(key=lambda o: (o.blockNumber, o.index))
-        return timestamp, eventLogs
+        return eventLogs
+
+    async def decode_events(self, jobs: list):
+        """解码 `route_receipt` 返回的日志, 结果写入对应事件的 event"""
+        decoded = await self.decode_logs([(contract, log) for _, contract, log in jobs])
+        for (ei, _, _), evt in zip(jobs, decoded):
+            ei.event = evt
+
+    async def decode_logs(self, jobs: list) -> list:
+        """解码 (合约名, 日志), 配置了解码进程池时在子进程中解码"""
+        if self.decode_pool:
+            return await self.decode_pool.decode(jobs)
+        return self.events.decoders.decode_many(jobs)
+
+    async def fetch_chunk(self, block_number, end_block) -> "ScanChunk":
+        """获取一段区块范围的区块、收据并生成事件"""
+        chunk = ScanChunk(block_number, end_block)
+        await self.fetch_chunk_blocks(chunk)
+        await self.fetch_chunk_receipts(chunk)
+        await self.decode_chunk(chunk)
+        return chunk
 
-    def new_dynamic_address(self, contract: str, address: str):
-        self.state.add_address(contract, address)
+    async def fetch_events(self, block_number, end_block) -> Tuple[int, List[EventInfo]]:
+        chunk = await self.fetch_chunk(block_number, end_block)
+        return chunk.block_timestamp, chunk.events
+
+    async def fetch_chunk_blocks(self, chunk: "ScanChunk"):
+        """获取范围内需要处理的区块, 混合模式下先用 eth_getLogs 确定区块"""
+        chunk.address_version = self.state.get_address_version()
+        if self.scan_mode == SCAN_MODE_HYBRID:
+            await self.fetch_chunk_blocks_hybrid(chunk)
+            return chunk
+        chunk.blocks = await self.fetch_blocks([b for b in range(chunk.start, chunk.end + 1)])
+        return chunk
+
+    async def fetch_chunk_receipts(self, chunk: "ScanChunk"):
+        if len(chunk.blocks) > 0:
+            chunk.receipts = await self.fetch_receipts(chunk.blocks, chunk.receipt_contracts, chunk.log_transactions)
+        return chunk
+
+    async def decode_chunk(self, chunk: "ScanChunk"):
+        """根据区块与收据生成需要处理的事件"""
+        if len(chunk.blocks) == 0:
+            chunk.block_timestamp, chunk.events = None, []
+            return chunk
+        block_timestamp = self.get_block_timestamp(chunk.blocks)
+        transactions = []
+        for block in chunk.blocks:
+            transactions += block.transactions
+        transaction_map = self.get_transaction_map(transactions)
+        chunk.events = await self.build_events(chunk.receipts, transaction_map, block_timestamp)
+        chunk.block_timestamp = block_timestamp.get(chunk.blocks[-1].number)
+        return chunk
+
+    def get_log_filters(self, contracts) -> List[dict]:
+        """eth_getLogs 的过滤条件
+
+        没有 indexed 参数过滤条件的事件合并多个合约的地址与 topic 作为一个过滤条件,
+        声明了过滤条件的事件各自使用一个带 topics[1..3] 的过滤条件。
+        """
+        adds = []
+        topics = []
+        filters = []
+        for contract in contracts:
+            contract_adds = self.state.get_address(contract)
+            topic_filters = self.events.getTopicFilters(contract)
+            _, topic_list = self.events.getTopics(contract)
+            for topic in topic_list:
+                if topic in topic_filters:
+                    filters.append({ "address": contract_adds, "topics": topic_filters[topic].log_topics(topic) })
+                else:
+                    adds += contract_adds
+                    topics.append(topic)
+        if len(topics) > 0:
+            filters.insert(0, { "address": list(set(adds)), "topics": [list(set(topics))] })
+        return filters
+
+    async def fetch_logs(self, start_block: int, end_block: int, filters: dict, retries: int = 0) -> list:
+        """按区块范围调用 eth_getLogs
+
+        节点限流 (429) 时切换节点后重试;
+        节点报告结果太多或请求失败时把范围一分为二分别获取;
+        单个区块被节点拒绝 (结果超过上限或参数无效) 时按地址或 topic 拆分过滤条件, 无法再拆分时直接抛出,
+        其他错误等待后重试。重试超过 `max_request_retries` 次时抛出。
+        """
+        params = dict(filters)
+        params['fromBlock'] = start_block
+        params['toBlock'] = end_block
+        try:
+            web3, slot = self.select_web3()
+            async with slot:
+                logs = await web3.eth.get_logs(params)
+            return [log for log in logs if not log.get('removed', False) and log.logIndex is not None]
+        except Exception as e:
+            if isinstance(e, ClientResponseError) and e.status == 429:
+                if retries >= self.max_request_retries:
+                    raise
+                if self.switch_provider_handle:
+                    self.switch_provider_handle()
+                await asyncio.sleep(self.request_retry_seconds)
+                return await self.fetch_logs(start_block, end_block, filters, retries + 1)
+            if start_block < end_block:
+                mid = start_block + (end_block-start_block) // 2
+                self.logger.warning(f"eth_getLogs {start_block} - {end_block} failed with '{e}', split at {mid}")
+                left = await self.fetch_logs(start_block, mid, filters)
+                right = await self.fetch_logs(mid + 1, end_block, filters)
+                return left + right
+            if is_rejected_query(e):
+                halves = split_log_filter(filters)
+                if halves is None:
+                    raise
+                self.logger.warning(f"eth_getLogs {start_block} rejected with '{e}', split the filter")
+                results = await asyncio.gather(*[self.fetch_logs(start_block, end_block, f) for f in halves])
+                return sorted(results[0] + results[1], key=lambda log: log.logIndex)
+            if retries >= self.max_request_retries:
+                raise
+            self.logger.warning(f"eth_getLogs {start_block} failed with '{e}', retrying in {self.request_retry_seconds} seconds")
+            await asyncio.sleep(self.request_retry_seconds)
+            return await self.fetch_logs(start_block, end_block, filters, retries + 1)
+
+    async def fetch_chunk_blocks_hybrid(self, chunk: "ScanChunk"):
+        """混合扫描模式
+
+        只有 handle* 事件处理器的合约用 eth_getLogs 按范围获取日志, 只下载有日志的区块与交易收据;
+        注册了 _transfer 处理器的合约仍然需要完整的区块与交易。
+        可能重组的范围内先取得结束区块头, 之后的链重组在下一个 chunk 检查上一个结束区块时发现。
+        """
+        block_number, end_block = chunk.start, chunk.end
+        chunk.head = None
+        if self.max_reorg_depth > 0 and self.state.may_reorg(end_block):
+            chunk.head = await self.hedged_request(lambda web3: web3.eth.get_block(end_block))
+        log_contracts = []
+        transfer_contracts = []
+        for contract in self.deployed_contracts(self.events.getContractNames(), end_block):
+            if len(self.state.get_address(contract)) == 0:
+                continue
+            if len(self.events.getTransactionHandlers(contract)) > 0:
+                transfer_contracts.append(contract)
+            elif len(self.events.getTopics(contract)[1]) > 0:
+                log_contracts.append(contract)
+
+        logs = []
+        if len(log_contracts) > 0:
+            results = await asyncio.gather(*[self.fetch_logs(block_number, end_block, f) for f in self.get_log_filters(log_contracts)])
+            logs = [log for result in results for log in result]
+        log_tx_hashes = set(log.transactionHash for log in logs)
+        if len(transfer_contracts) > 0:
+            block_numbers = [b for b in range(block_number, end_block + 1)]
+        else:
+            block_numbers = sorted(set(log.blockNumber for log in logs))
+        chunk.receipt_contracts = transfer_contracts
+        chunk.log_transactions = []
+        if len(block_numbers) == 0:
+            chunk.blocks = []
+            return
+
+        chunk.blocks = await self.fetch_blocks(block_numbers)
+        for block in chunk.blocks:
+            chunk.log_transactions += [t for t in block.transactions if t.hash in log_tx_hashes]
+
+    async def apply_events(self, events: List[EventInfo], chunk: "ScanChunk" = None) -> int:
+        """按日志顺序调用事件处理器, 返回应用的事件数
+
+        事件处理器添加了新的跟踪地址时在该事件之后暂停, 把 chunk 中新地址在该事件之后的日志按新的分发表生成事件,
+        与剩余的事件合并后继续, 同一个 chunk 中新地址的日志不会遗漏。
+        """
+        applied = 0
+        while len(events) > 0:
+            count, created = await self.apply_until_created(events)
+            applied += count
+            last = events[count - 1]
+            events = events[count:]
+            added = [(contract, address) for contract, address in created if self.new_dynamic_address(contract, address, last.blockNumber)]
+            if len(added) > 0 and chunk is not None:
+                rerouted = await self.reroute_chunk(chunk, added, last)
+                if len(rerouted) > 0:
+                    events = sorted(events + rerouted, key=lambda o: (o.blockNumber, o.index))
+        return applied
+
+    async def apply_until_created(self, events: List[EventInfo]) -> Tuple[int, list]:
+        """应用事件, 某个事件添加了还没有跟踪的地址时在它之后停止
+
+        :return: tuple(应用的事件数, 添加的 (合约名, 地址))
+        """
+        created = []
+
+        def new_contract_address(contract: str, address: str) -> bool:
+            if self.state.has_address(contract, address):
+                return False
+            created.append((contract, address))
+            return True
+
+        if self.parallel_apply is None and self.writer is None:
+            for i, event in enumerate(events):
+                self.state.process_event(event, self.contracts, new_contract_address)
+                # 事件处理器是同步的, 每个事件之后让出事件循环, 下载任务的请求可以继续
+                await asyncio.sleep(0)
+                if len(created) > 0:
+                    return i + 1, created
+            return len(events), created
+        # 在线程中执行, 事件循环继续调度下载; 新合约地址回到事件循环线程中再加入, 避免与下载任务同时读写地址列表
+        apply = self.parallel_apply.apply if self.parallel_apply else self.apply_serial
+        loop = asyncio.get_running_loop()
+        count = await loop.run_in_executor(None, apply, events, self.contracts, new_contract_address)
+        return count, created
+
+    def apply_serial(self, events: List[EventInfo], contracts: dict, new_contract_address: Callable) -> int:
+        """顺序应用事件, new_contract_address 返回 True 时在该事件之后停止, 返回应用的事件数"""
+        for i, event in enumerate(events):
+            results = []
+            self.state.process_event(event, contracts, lambda contract, address: results.append(new_contract_address(contract, address)))
+            if any(results):
+                return i + 1
+        return len(events)
+
+    def new_dynamic_address(self, contract: str, address: str, block_number: int = 0) -> bool:
+        return self.state.add_address(contract, address, block_number)
+
+    async def reroute_chunk(self, chunk: "ScanChunk", added: list, after: EventInfo) -> List[EventInfo]:
+        """chunk 中新跟踪地址在 after 之后的日志生成的事件
+
+        :param added: 新跟踪的 (合约名, 地址)
+        """
+        self.dispatch.refresh()
+        await self.fetch_added_receipts(chunk, added, after.blockNumber)
+        contracts = {}
+        for contract, address in added:
+            contracts.setdefault(address, set()).add(contract)
+        position = (after.blockNumber, after.index)
+        block_timestamp = self.get_block_timestamp(chunk.blocks)
+        transaction_map = None
+        events: List[EventInfo] = []
+        jobs = []
+        for receipt in chunk.receipts:
+            if receipt.blockNumber < after.blockNumber:
+                continue
+            for log in receipt.logs:
+                if log.logIndex is None or log.address not in contracts or (log.blockNumber, log.logIndex) <= position:
+                    continue
+                for contract, event_name, _ in self.dispatch.route_log(log):
+                    if contract not in contracts[log.address]:
+                        continue
+                    if transaction_map is None:
+                        transaction_map = self.get_transaction_map([t for b in chunk.blocks for t in b.transactions])
+                    tx = transaction_map.get(receipt.transactionHash.hex())
+                    ei = EventInfo(contract, block_timestamp.get(log.blockNumber), None, event_name, receipt, tx, log.logIndex, log.blockNumber)
+                    events.append(ei)
+                    jobs.append((ei, contract, log))
+        await self.decode_events(jobs)
+        if len(events) > 0:
+            self.logger.debug(f"Rerouted {len(events)} events in {chunk.start} - {chunk.end} for {len(added)} new addresses")
+        return events
+
+    async def fetch_added_receipts(self, chunk: "ScanChunk", added: list, block_number: int):
+        """补齐 chunk 中 block_number 之后可能有新跟踪地址日志的交易收据
+
+        混合模式下 chunk 只有原来的地址有日志的区块, 用 eth_getLogs 查出新地址的日志, 下载缺少的区块与收据;
+        完整模式下按 logsBloom 筛选没有下载收据的区块, 不筛选时下载剩余的全部收据。
+        """
+        if chunk.archived:
+            return
+        fetched = set(r.transactionHash for r in chunk.receipts)
+        if self.scan_mode == SCAN_MODE_HYBRID:
+            tx_hashes = await self.fetch_added_blocks(chunk, added, block_number)
+            transactions = [t for b in chunk.blocks if b.number >= block_number for t in b.transactions if t.hash in tx_hashes and t.hash not in fetched]
+        else:
+            blocks = [b for b in chunk.blocks if b.number >= block_number]
+            if self.bloom_filter:
+                matched = BloomFilter([([address], self.events.getTopics(contract)[1])
+                                       for contract, address in added]).match([b.get('logsBloom') for b in blocks])
+                blocks = [block for block, hit in zip(blocks, matched) if hit]
+            transactions = [t for block in blocks for t in block.transactions if t.hash not in fetched]
+        if len(transactions) > 0:
+            chunk.receipts = chunk.receipts + await self.fetch_transaction_receipts(transactions)
+
+    async def fetch_added_blocks(self, chunk: "ScanChunk", added: list, block_number: int) -> set:
+        """混合模式下用 eth_getLogs 获取新跟踪地址在 block_number 之后的日志, 把 chunk 中缺少的区块加入 chunk
+
+        :return: 这些日志所在的交易哈希
+        """
+        addresses = {}
+        for contract, address in added:
+            addresses.setdefault(contract, []).append(address)
+        filters = []
+        for contract, adds in addresses.items():
+            _, topics = self.events.getTopics(contract)
+            if len(topics) > 0:
+                filters.append({ "address": adds, "topics": [topics] })
+        results = await asyncio.gather(*[self.fetch_logs(block_number, chunk.end, f) for f in filters])
+        logs = [log for result in results for log in result]
+        known = set(b.number for b in chunk.blocks)
+        missing = sorted(set(log.blockNumber for log in logs) - known)
+        if len(missing) > 0:
+            chunk.blocks = sorted(chunk.blocks + await self.fetch_blocks(missing), key=lambda b: b.number)
+        return set(log.transactionHash for log in logs)
 
     async def scan_database(self, total: int, scan_size: int = 1000, progress_callback=Optional[Callable]) -> int:
         processed = 0
         offset = 0
         last_block = 0
-        contracts = self.events.getContractNames()
         while processed < total:
             blocks = BlockLog.getLogs(offset, scan_size)
             for block in blocks:
@@ -270,47 +946,23 @@ class BlockScanner:
                 last_block = block.number
                 tx_map = {t.hash.hex(): t for t in block.transactions}
                 # 获取此块交易的所有receipts
-                receipts = ReceiptLog.get_receipts(tx_map.keys())
+                receipts = [r for r in ReceiptLog.get_receipts(tx_map.keys()) if r.status != 0]
+                self.dispatch.refresh()
+                jobs = []
                 for receipt in receipts:
-                    if receipt.status == 0:
-                        continue
-                    tx = tx_map.get(receipt.transactionHash.hex())
-                    for contract in contracts:
-                        adds = self.state.get_address(contract)
-                        if len(adds) == 0:
-                            continue
-                        hasTransfer = self.events.getHandle(contract, TRANSFER_EVENT_NAME)
-                        if hasTransfer and tx.to in adds:
-                            ei = EventInfo()
-                            ei.index = -1
-                            ei.eventName = TRANSFER_EVENT_NAME
-                            ei.blockNumber = tx.blockNumber
-                            ei.contract = contract
-                            ei.timestamp = block.timestamp
-                            # ei.event = evt
-                            ei.receipt = receipt
-                            ei.transaction = tx
-                            eventLogs.append(ei)
-                        # 处理合约事件
-                        for log in receipt.logs:
-                            evt = self.events.getEventData(self.web3, contract, log)
-                            if evt and evt.logIndex is not None and evt.address in adds:
-                                ei = EventInfo()
-                                ei.eventName = evt.event
-                                ei.index = evt.logIndex
-                                ei.blockNumber = evt.blockNumber
-                                ei.contract = contract
-                                ei.timestamp = block.timestamp
-                                ei.event = evt
-                                ei.receipt = receipt
-                                ei.transaction = tx
-                                eventLogs.append(ei)
+                    events, receipt_jobs = self.route_receipt(receipt, tx_map.get(receipt.transactionHash.hex()), block.timestamp)
+                    eventLogs += events
+                    jobs += receipt_jobs
+                await self.decode_events(jobs)
                 eventLogs.sort(key=lambda o: (o.blockNumber, o.index))
-                # 调用handle处理逻辑
-                for ei in eventLogs:
-                    self.state.process_event(ei, self.contracts)
+                # 调用handle处理逻辑, 事件处理器添加的新地址在同一区块中的日志也会处理
+                chunk = ScanChunk(block.number, block.number)
+                chunk.archived = True
+                chunk.blocks = [block]
+                chunk.receipts = receipts
+                applied = await self.apply_events(eventLogs, chunk)
                 if progress_callback:
-                    progress_callback(block.number, block.timestamp, 1, len(eventLogs))
+                    progress_callback(block.number, block.timestamp, 1, applied)
                 offset += 1
                 processed += 1
         self.state.end_chunk(last_block)
@@ -330,6 +982,8 @@ class BlockScanner:
         assert start_block <= end_block, "start_block:{} end_block:{}".format(start_block, end_block)
 
         self.IS_RUN = True
+        if self.pipeline_depth > 0:
+            return await self.scan_pipeline(start_block, end_block, progress_callback)
         current_block = start_block
         chunk_size = self.max_scan_chunk_size
         total_chunks_scanned = 0
@@ -346,11 +1000,79 @@ class BlockScanner:
             processed_event_count += new_event_count
             # 打印进度
             if progress_callback:
-                progress_callback(start_block, end_block, current_block, block_timestamp, chunk_size - (estimated_end_block-current_end), new_event_count)
+                progress_callback(start_block, end_block, current_block, block_timestamp, max(0, chunk_size - (estimated_end_block-current_end)),
+                                  new_event_count)
             # 设置下一个块开始的位置
             current_block = current_end + 1
             total_chunks_scanned += 1
-            self.state.end_chunk(min(current_end, end_block))
-            # 睡眠500
-            time.sleep(self.request_interval_sec)
+            await self.end_chunk(min(current_end, end_block))
+            # 未启用自适应速率控制时按固定间隔休眠
+            if not self.adaptive_rate:
+                await asyncio.sleep(self.request_interval_sec)
+            if self.provider_pool:
+                await self.provider_pool.recover()
         return processed_event_count, total_chunks_scanned
+
+    async def scan_pipeline(self, start_block, end_block, progress_callback=Optional[Callable]) -> Tuple[int, int]:
+        """流水线方式执行扫描
+
+        区块获取、收据获取、解码、应用与检查点各由一个任务处理, 阶段之间用有界队列连接,
+        第 N 个 chunk 应用事件时第 N+1 个 chunk 已经在下载。chunk 按顺序经过每个阶段, 事件处理器看到的顺序与逐个 chunk 扫描相同;
+        应用前发现事件处理器添加了新的跟踪地址时, 该 chunk 会按新的地址集合重新获取。
+        应用前发现链重组时不再应用之后的 chunk, 流水线结束后回滚到分叉点, 再从分叉点之后重新扫描。
+        """
+        chunk_size = self.max_scan_chunk_size
+        chunks = (ScanChunk(s, min(s + chunk_size - 1, end_block)) for s in range(start_block, end_block + 1, chunk_size))
+        counts = { "events": 0, "chunks": 0 }
+        reorg = { "fork": None }
+
+        async def fetch_blocks(chunk: ScanChunk):
+            await self.fetch_chunk_blocks(chunk)
+            # 未启用自适应速率控制时按固定间隔休眠
+            if not self.adaptive_rate:
+                await asyncio.sleep(self.request_interval_sec)
+            return chunk
+
+        async def apply(chunk: ScanChunk):
+            if reorg["fork"] is None and chunk.address_version != self.state.get_address_version():
+                await self.fetch_chunk_blocks(chunk)
+                await self.fetch_chunk_receipts(chunk)
+                await self.decode_chunk(chunk)
+            if reorg["fork"] is None:
+                reorg["fork"] = await self.check_reorg(chunk)
+            if reorg["fork"] is not None:
+                chunk.applied = None
+                return chunk
+            self.state.start_chunk(chunk.start)
+            chunk.applied = await self.apply_events(chunk.events, chunk)
+            return chunk
+
+        async def checkpoint(chunk: ScanChunk):
+            if chunk.applied is None:
+                return chunk
+            await self.end_chunk(chunk.end)
+            counts["events"] += chunk.applied
+            counts["chunks"] += 1
+            if progress_callback:
+                progress_callback(start_block, end_block, chunk.start, chunk.block_timestamp, chunk.end - chunk.start + 1, chunk.applied)
+            if self.provider_pool:
+                await self.provider_pool.recover()
+            return chunk
+
+        stages = [
+            ("fetch_blocks", fetch_blocks),
+            ("fetch_receipts", self.fetch_chunk_receipts),
+            ("decode", self.decode_chunk),
+            ("apply", apply),
+            ("checkpoint", checkpoint),
+        ]
+        self.pipeline = Pipeline(stages, maxsize=self.pipeline_depth)
+        await self.pipeline.run(chunks, running=lambda: self.IS_RUN and reorg["fork"] is None)
+        if reorg["fork"] is not None:
+            await self.rollback(reorg["fork"])
+            await self.end_chunk(reorg["fork"])
+            # 与逐个 chunk 扫描相同, 从分叉点之后继续扫描到 end_block
+            events, chunks = await self.scan_pipeline(reorg["fork"] + 1, end_block, progress_callback)
+            counts["events"] += events
+            counts["chunks"] += chunks
+        return counts["events"], counts["chunks"]
@@ -0,0 +1,84 @@
+from typing import List, Tuple
+import numpy as np
+from eth_utils import keccak
+from hexbytes import HexBytes
+
+BLOOM_BYTES = 256
+
+
+def bloom_positions(value: bytes) -> List[Tuple[int, int]]:
+    """返回一个值在 logsBloom 中对应的三个位置 (字节下标, 位掩码)
+
+    以太坊 bloom 取 keccak 前 6 个字节, 每 2 个字节的低 11 位作为 2048 位中的一位(从最低位开始计数),
+    logsBloom 是大端存储的 256 字节。
+    """
+    h = keccak(value)
+    positions = []
+    for i in range(0, 6, 2):
+        bit = ((h[i] << 8) | h[i + 1]) & 2047
+        positions.append((BLOOM_BYTES - 1 - bit//8, 1 << (bit % 8)))
+    return positions
+
+
+def to_bloom_bytes(bloom) -> bytes:
+    if bloom is None:
+        return None
+    data = bytes(HexBytes(bloom))
+    if len(data) < BLOOM_BYTES:
+        data = bytes(BLOOM_BYTES - len(data)) + data
+    return data
+
+
+class BloomFilter:
+    """用区块头的 logsBloom 判断区块中是否可能有我们关心的日志。
+
+    每组为 (合约地址列表, 事件 topic 列表), 区块 bloom 同时包含某组中的任一地址和任一 topic 时才可能有该组的日志。
+    bloom 不会漏报, 所以未命中的区块可以跳过收据下载。
+    判断在整个 chunk 的区块上用 NumPy 位运算向量化完成。
+    """
+
+    def __init__(self, groups: List[Tuple[list, list]]):
+        """
+        :param groups: [(地址列表, topic 列表)], 地址与 topic 可以是 hex 字符串或 bytes
+        """
+        byte_idx = []
+        bit_val = []
+        self.groups = []
+        for addresses, topics in groups:
+            if len(addresses) == 0 or len(topics) == 0:
+                continue
+            addr_cols = self._add_items(addresses, byte_idx, bit_val)
+            topic_cols = self._add_items(topics, byte_idx, bit_val)
+            self.groups.append((addr_cols, topic_cols))
+        self.byte_idx = np.array(byte_idx, dtype=np.intp).reshape(-1, 3)
+        self.bit_val = np.array(bit_val, dtype=np.uint8).reshape(-1, 3)
+
+    @staticmethod
+    def _add_items(values, byte_idx, bit_val) -> np.ndarray:
+        start = len(byte_idx)
+        for v in values:
+            positions = bloom_positions(bytes(HexBytes(v)))
+            byte_idx.append([p[0] for p in positions])
+            bit_val.append([p[1] for p in positions])
+        return np.arange(start, len(byte_idx))
+
+    def match(self, blooms: list) -> np.ndarray:
+        """判断每个 bloom 是否可能包含任一组的日志
+
+        :param blooms: 区块的 logsBloom 列表, 为 None 的区块视为命中
+        :return: bool 数组, 与 blooms 一一对应
+        """
+        count = len(blooms)
+        result = np.zeros(count, dtype=bool)
+        if count == 0:
+            return result
+        missing = np.array([b is None for b in blooms], dtype=bool)
+        if len(self.groups) == 0:
+            return missing
+        data = b"".join(to_bloom_bytes(b) if b is not None else bytes(BLOOM_BYTES) for b in blooms)
+        matrix = np.frombuffer(data, dtype=np.uint8).reshape(count, BLOOM_BYTES)
+        # (区块数, 条目数, 3): 每个条目的三个位是否都被置位
+        hits = ((matrix[:, self.byte_idx] & self.bit_val) == self.bit_val).all(axis=2)
+        for addr_cols, topic_cols in self.groups:
+            result |= hits[:, addr_cols].any(axis=1) & hits[:, topic_cols].any(axis=1)
+        return result | missing
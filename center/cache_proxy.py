@@ -0,0 +1,283 @@
+import asyncio
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from urllib.parse import urlsplit
+import orjson
+from aiohttp import ClientResponseError, web
+from center.http_session import SessionPool
+from center.logger import Logger
+
+# 可以缓存的方法, 结果在安全块以下不会再改变
+CACHEABLE_METHODS = ("eth_getBlockByNumber", "eth_getBlockByHash", "eth_getTransactionReceipt", "eth_getBlockReceipts")
+# 都指向本机的主机名
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1", "0.0.0.0")
+
+
+def _is_hash(value) -> bool:
+    return isinstance(value, str) and len(value) == 66 and value.startswith("0x")
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, str) and value.startswith("0x") and not _is_hash(value)
+
+
+def cache_key(method: str, params: list) -> Optional[str]:
+    """调用对应的缓存键, 不可缓存(如 latest 等标签)时返回 None"""
+    if method not in CACHEABLE_METHODS or not isinstance(params, list) or len(params) == 0:
+        return None
+    target = params[0]
+    if method == "eth_getBlockByNumber" and _is_number(target):
+        return f"block:{int(target, 16)}:{bool(params[1]) if len(params) > 1 else False}"
+    if method == "eth_getBlockByHash" and _is_hash(target):
+        return f"blockhash:{target.lower()}:{bool(params[1]) if len(params) > 1 else False}"
+    if method == "eth_getTransactionReceipt" and _is_hash(target):
+        return f"receipt:{target.lower()}"
+    if method == "eth_getBlockReceipts":
+        if _is_hash(target):
+            return f"receiptshash:{target.lower()}"
+        if _is_number(target):
+            return f"receipts:{int(target, 16)}"
+    return None
+
+
+def result_entries(method: str, params: list, result) -> Tuple[Optional[int], List[Tuple[str, bytes]]]:
+    """结果所在的块号与需要写入的缓存条目, 同一结果按块号与块 hash 各存一份"""
+    if result is None:
+        return None, []
+    if method in ("eth_getBlockByNumber", "eth_getBlockByHash"):
+        full = bool(params[1]) if len(params) > 1 else False
+        value = orjson.dumps(result)
+        number = int(result["number"], 16)
+        return number, [(f"block:{number}:{full}", value), (f"blockhash:{result['hash'].lower()}:{full}", value)]
+    if method == "eth_getTransactionReceipt":
+        return int(result["blockNumber"], 16), [(f"receipt:{result['transactionHash'].lower()}", orjson.dumps(result))]
+    if method == "eth_getBlockReceipts":
+        if len(result) == 0:
+            # 空块无法从结果得到块号, 只能按请求的块号缓存
+            if _is_number(params[0]):
+                return int(params[0], 16), [(f"receipts:{int(params[0], 16)}", b"[]")]
+            return None, []
+        number = int(result[0]["blockNumber"], 16)
+        value = orjson.dumps(result)
+        entries = [(f"receipts:{number}", value), (f"receiptshash:{result[0]['blockHash'].lower()}", value)]
+        # 整块的收据同时按交易缓存
+        entries += [(f"receipt:{r['transactionHash'].lower()}", orjson.dumps(r)) for r in result]
+        return number, entries
+    return None, []
+
+
+def check_upstreams(upstreams: List[str], host: str, port: int):
+    """上游地址不能是代理自己, 否则请求会转发回代理, 一直循环"""
+    for uri in upstreams:
+        parts = urlsplit(uri)
+        upstream_port = parts.port or (443 if parts.scheme == "https" else 80)
+        same_host = parts.hostname == host or (parts.hostname in LOCAL_HOSTS and host in LOCAL_HOSTS)
+        if same_host and upstream_port == port:
+            raise ValueError(f"proxy upstream {uri} is the proxy itself ({host}:{port}), set proxy.upstream to the real nodes")
+
+
+class CacheStore:
+    """SQLite 保存的缓存, 多个代理进程可以共用同一个文件
+
+    sqlite3 的调用是阻塞的, 全部在一个后台线程中按顺序执行, 不阻塞代理的事件循环。
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL)")
+        self.db.commit()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache")
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def get_many(self, keys: List[str]) -> dict:
+        if len(keys) == 0:
+            return {}
+        return await self._run(self._get_many, keys)
+
+    def _get_many(self, keys: List[str]) -> dict:
+        rows = self.db.execute(f"SELECT key, value FROM entries WHERE key IN ({','.join('?' * len(keys))})", keys).fetchall()
+        return { k: bytes(v) for k, v in rows }
+
+    async def put_many(self, entries: List[Tuple[str, bytes]]):
+        if len(entries) == 0:
+            return
+        await self._run(self._put_many, entries)
+
+    def _put_many(self, entries: List[Tuple[str, bytes]]):
+        self.db.executemany("INSERT OR IGNORE INTO entries (key, value) VALUES (?, ?)", entries)
+        self.db.commit()
+
+    async def count(self) -> int:
+        return await self._run(self._count)
+
+    def _count(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        self.executor.shutdown()
+        self.db.close()
+
+
+class CacheProxy:
+    """缓存不可变链上数据的 JSON-RPC 代理。
+
+    `chain_reorg_safety_blocks` 以下的区块与收据不会再变化, 代理把它们保存在本地,
+    命中时直接返回保存的原始 JSON, 未命中的调用合并成一个数组请求转发给上游节点。
+    """
+
+    def __init__(self,
+                 upstreams: List[str],
+                 store: CacheStore,
+                 safety_blocks: int = 3,
+                 sessions: SessionPool = None,
+                 head_ttl: float = 1.0,
+                 logger: Logger = None):
+        """
+        :param upstreams: 上游 JSON-RPC 地址, 失败时依次尝试
+        :param store: 缓存存储
+        :param safety_blocks: 链头以下多少块之后才缓存
+        :param sessions: 连接池
+        :param head_ttl: 链头块号的缓存秒数
+        :param logger: 日志对象
+        """
+        self.upstreams = list(upstreams)
+        self.store = store
+        self.safety_blocks = safety_blocks
+        self.sessions = sessions or SessionPool()
+        self.head_ttl = head_ttl
+        self.logger = logger
+        self.upstream_index = 0
+        self._head = 0
+        self._head_time = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+
+    async def forward(self, calls: List[dict]) -> List[dict]:
+        """把调用作为一个数组请求转发给上游, 按顺序返回响应"""
+        payload = [{ "jsonrpc": "2.0", "id": i, "method": c.get("method"), "params": c.get("params", []) } for i, c in enumerate(calls)]
+        error = None
+        for _ in range(len(self.upstreams)):
+            uri = self.upstreams[self.upstream_index]
+            try:
+                session = self.sessions.get(uri)
+                async with session.post(uri, data=orjson.dumps(payload), headers={ 'Content-Type': 'application/json'}, raise_for_status=True) as resp:
+                    data = orjson.loads(await resp.read())
+                if isinstance(data, dict):
+                    data = [dict(data, id=i) for i in range(len(calls))]
+                responses = {r.get("id"): r for r in data}
+                return [responses.get(i, { "jsonrpc": "2.0", "id": i, "error": { "code": -32603, "message": "missing response"} }) for i in range(len(calls))]
+            except Exception as e:
+                error = e
+                if self.logger:
+                    self.logger.warning(f"Upstream {uri} failed: {e}")
+                self.upstream_index = (self.upstream_index + 1) % len(self.upstreams)
+        raise error
+
+    async def safe_head(self) -> int:
+        """可以缓存的最高块号"""
+        if time.monotonic() - self._head_time > self.head_ttl:
+            resp = (await self.forward([{ "method": "eth_blockNumber", "params": [] }]))[0]
+            if resp.get("result") is not None:
+                self._head = int(resp["result"], 16)
+                self._head_time = time.monotonic()
+        return self._head - self.safety_blocks
+
+    async def process(self, calls: List[dict]) -> List[bytes]:
+        """处理一组调用, 返回每个调用序列化后的响应"""
+        keys = [cache_key(c.get("method"), c.get("params", [])) for c in calls]
+        cached = await self.store.get_many([k for k in keys if k is not None])
+        outputs: List[bytes] = [None] * len(calls)
+        misses = []
+        for i, (call, key) in enumerate(zip(calls, keys)):
+            if key is not None and key in cached:
+                self.hits += 1
+                outputs[i] = b'{"jsonrpc":"2.0","id":' + orjson.dumps(call.get("id")) + b',"result":' + cached[key] + b'}'
+            else:
+                misses.append(i)
+        if len(misses) == 0:
+            return outputs
+
+        self.misses += sum(1 for i in misses if keys[i] is not None)
+        responses = await self.forward([calls[i] for i in misses])
+        entries = []
+        safe_head = None
+        for i, resp in zip(misses, responses):
+            resp["id"] = calls[i].get("id")
+            outputs[i] = orjson.dumps(resp)
+            if keys[i] is None or resp.get("error") is not None:
+                continue
+            number, items = result_entries(calls[i]["method"], calls[i].get("params", []), resp.get("result"))
+            if number is None:
+                continue
+            if safe_head is None:
+                safe_head = await self.safe_head()
+            if number <= safe_head:
+                entries += items
+        if len(entries) > 0:
+            await self.store.put_many(entries)
+            self.stored += len(entries)
+        return outputs
+
+    async def handle(self, request: web.Request) -> web.Response:
+        try:
+            payload = orjson.loads(await request.read())
+        except orjson.JSONDecodeError:
+            return web.json_response({ "jsonrpc": "2.0", "id": None, "error": { "code": -32700, "message": "Parse error"} }, status=400)
+        is_batch = isinstance(payload, list)
+        calls = payload if is_batch else [payload]
+        try:
+            outputs = await self.process(calls)
+        except ClientResponseError as e:
+            # 把上游的 429 等状态交给客户端处理
+            return web.Response(status=e.status, text=e.message)
+        except Exception as e:
+            if self.logger:
+                self.logger.exception(f"proxy error: {e}")
+            return web.Response(status=502, text=str(e))
+        body = b"[" + b",".join(outputs) + b"]" if is_batch else outputs[0]
+        return web.Response(body=body, content_type="application/json")
+
+    def stats(self) -> dict:
+        return { "hits": self.hits, "misses": self.misses, "stored": self.stored }
+
+    def create_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/", self.handle)
+
+        async def close_sessions(app):
+            await self.sessions.close()
+
+        app.on_cleanup.append(close_sessions)
+        return app
+
+
+def cache_proxy_run(config):
+    """启动缓存代理, 配置项见 config.example.json 的 proxy 部分
+
+    sync_cfg.chain_api 通常指向代理, 上游节点必须在 proxy.upstream 中单独配置。
+    """
+    proxy_cfg = config.get('proxy', {})
+    sync_cfg = config['sync_cfg']
+    if not proxy_cfg.get('upstream'):
+        raise ValueError("proxy.upstream is required: the JSON-RPC nodes the proxy forwards to")
+    upstreams = proxy_cfg['upstream']
+    if isinstance(upstreams, str):
+        upstreams = [upstreams]
+    host, port = proxy_cfg.get('host', "127.0.0.1"), proxy_cfg.get('port', 8545)
+    check_upstreams(upstreams, host, port)
+    logger = Logger("proxy")
+    store = CacheStore(proxy_cfg.get('cache_path', "./cache/rpc_cache.sqlite"))
+    proxy = CacheProxy(upstreams, store, safety_blocks=proxy_cfg.get('safety_blocks', sync_cfg['chain_reorg_safety_blocks']), logger=logger)
+    web.run_app(proxy.create_app(), host=host, port=port)
+    store.close()
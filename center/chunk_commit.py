@@ -0,0 +1,348 @@
+import copy
+import threading
+from typing import Dict, List, Optional, Tuple
+from mongoengine.connection import DEFAULT_CONNECTION_NAME
+from pymongo import DeleteOne, ReplaceOne
+from center.database import entity_view
+from center.database.checkpoint import ChunkEntry, ScanCheckpoint
+from center.database.entity_view import EntityView, Unsupported, ViewCollection
+
+# 当前线程是否在执行事件处理器
+_local = threading.local()
+# 安装后事件处理器写入的缓冲
+_buffer: "ChunkBuffer" = None
+
+CHECKPOINT_ID = "scanner"
+# 不改写数据的集合方法, 没有还没提交的写入时可以直接在数据库上执行
+READ_METHODS = {
+    "find", "find_one", "count_documents", "estimated_document_count", "distinct", "find_raw_batches", "list_indexes", "index_information", "options"
+}
+
+
+class NotAtomic(BaseException):
+    """chunk 的写入无法原子地提交
+
+    严格模式下事件处理器使用了缓冲不支持的数据库操作, 或重启时发现上次崩溃前有 chunk 的部分写入已经直接写入数据库。
+    继承 BaseException, 不会被事件处理器与 `Events.callHandle` 中的 `except Exception` 吞掉, 扫描会停止。
+    """
+
+
+def id_list(filter) -> Optional[list]:
+    """按主键的过滤条件中的主键列表, 其他过滤条件返回 None"""
+    if not isinstance(filter, dict) or list(filter.keys()) != ["_id"]:
+        return None
+    value = filter["_id"]
+    if isinstance(value, dict):
+        if list(value.keys()) != ["$in"]:
+            return None
+        return list(value["$in"])
+    return [value]
+
+
+def _buffered(name: str):
+    method = getattr(ViewCollection, name)
+
+    def call(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        except Unsupported:
+            return self._direct(name)(*args, **kwargs)
+
+    return call
+
+
+class BufferCollection(ViewCollection):
+    """chunk 写缓冲中的集合
+
+    按主键的读写与实体视图相同, 在缓冲中进行; 缓冲不支持的操作先把缓冲中的写入直接写入数据库, 再在数据库上执行。
+    """
+
+    find = _buffered("find")
+    find_one = _buffered("find_one")
+    find_one_and_replace = _buffered("find_one_and_replace")
+    insert_one = _buffered("insert_one")
+    update_one = _buffered("update_one")
+
+    def with_options(self, **kwargs):
+        return BufferCollection(self._view, self._collection.with_options(**kwargs))
+
+    def _direct(self, name: str):
+        self._view.spill(write=name not in READ_METHODS)
+        return getattr(self._collection, name)
+
+    def __getattr__(self, name):
+        value = getattr(self._collection, name)
+        if callable(value):
+            return self._direct(name)
+        return value
+
+
+class ChunkLog:
+    """chunk 的提交记录
+
+    提交时先把 chunk 中每个实体的最终文档写入 `chunk_log` 集合, 再用一次单文档写入更新 `scan_checkpoint` 中的扫描进度,
+    这次写入就是提交点; 之后把最终文档写入各个集合, 写完后清除记录。
+    提交点之后崩溃时重启会按记录重做, 写入最终文档是幂等的; 提交点之前崩溃时数据库中还没有这个 chunk 的任何写入。
+    """
+
+    def __init__(self, checkpoints=None, entries=None):
+        """
+        :param checkpoints: 保存扫描进度的 pymongo 集合, 为空时使用 `ScanCheckpoint` 的集合
+        :param entries: 保存最终文档的 pymongo 集合, 为空时使用 `ChunkEntry` 的集合
+        """
+        self.checkpoints = checkpoints
+        self.entries = entries
+
+    def _checkpoints(self):
+        if self.checkpoints is None:
+            self.checkpoints = ScanCheckpoint._get_collection()
+        return self.checkpoints
+
+    def _entries(self):
+        if self.entries is None:
+            self.entries = ChunkEntry._get_collection()
+        return self.entries
+
+    def commit(self, block_number: int, images: dict, collections: dict):
+        """提交一个 chunk
+
+        :param images: (集合全名, 主键) -> 最终文档, 删除时为 None
+        :param collections: 集合全名 -> pymongo 集合
+        """
+        entries = [{ "chunk": block_number, "c": name, "i": _id, "d": doc } for (name, _id), doc in images.items()]
+        if len(entries) > 0:
+            self._entries().delete_many({ "chunk": block_number })
+            self._entries().insert_many(entries, ordered=False)
+        # 提交点, 同时清除 `mark_spilled` 的标记
+        checkpoint = { "lastScannedBlock": block_number, "chunk": block_number if len(entries) > 0 else None }
+        self._checkpoints().replace_one({ "_id": CHECKPOINT_ID }, checkpoint, upsert=True)
+        if len(entries) > 0:
+            self._apply(entries, collections)
+            self._checkpoints().update_one({ "_id": CHECKPOINT_ID }, { "$set": { "chunk": None } })
+            self._entries().delete_many({ "chunk": block_number })
+
+    def mark_spilled(self, start_block: int):
+        """从 start_block 开始的 chunk 在提交前有写入直接写入了数据库, 这个 chunk 提交前崩溃时不能重新执行它的事件处理器"""
+        self._checkpoints().update_one({ "_id": CHECKPOINT_ID }, { "$set": { "spilled": start_block } }, upsert=True)
+
+    def _apply(self, entries: List[dict], collections: dict):
+        groups: Dict[str, list] = {}
+        for entry in entries:
+            if entry["d"] is None:
+                op = DeleteOne({ "_id": entry["i"] })
+            else:
+                op = ReplaceOne({ "_id": entry["i"] }, entry["d"], upsert=True)
+            groups.setdefault(entry["c"], []).append(op)
+        for name, ops in groups.items():
+            self._resolve(name, collections).bulk_write(ops, ordered=False)
+
+    def _resolve(self, full_name: str, collections: dict):
+        if full_name in collections:
+            return collections[full_name]
+        db_name, name = full_name.split(".", 1)
+        return self._checkpoints().database.client[db_name][name]
+
+    def recover(self) -> Optional[int]:
+        """重启时重做已提交但没有写完的 chunk, 删除没有提交的记录
+
+        :return: 最后提交的 chunk 的结束区块, 没有提交过时为 None
+        """
+        checkpoint = self._checkpoints().find_one({ "_id": CHECKPOINT_ID })
+        if checkpoint is None:
+            return None
+        if checkpoint.get("spilled") is not None:
+            raise NotAtomic(f"Handlers wrote directly to the database in the chunk from block {checkpoint['spilled']} before a crash, "
+                            f"replaying it from block {checkpoint['lastScannedBlock'] + 1} would apply those writes twice; rescan from start_block")
+        if checkpoint.get("chunk") is not None:
+            self._apply(list(self._entries().find({ "chunk": checkpoint["chunk"] })), {})
+            self._checkpoints().update_one({ "_id": CHECKPOINT_ID }, { "$set": { "chunk": None } })
+        self._entries().delete_many({})
+        return checkpoint["lastScannedBlock"]
+
+    def reset(self):
+        self._checkpoints().delete_many({})
+        self._entries().delete_many({})
+
+
+class ChunkBuffer(EntityView):
+    """一个 chunk 中事件处理器写入的缓冲
+
+    chunk 开始后事件处理器对生成数据的读写都经过缓冲: 按主键读取时缓存数据库中的文档, 写入只改缓冲中的文档,
+    chunk 结束时把改写过的实体的最终文档连同扫描进度一起提交 (见 `ChunkLog`), 崩溃后重启总是从最后提交的区块继续, 不会重复执行事件处理器。
+    同一实体在 chunk 中多次改写只写入一次。
+    流水线扫描时下一个 chunk 可能在上一个提交前开始, 开始时把上一个 chunk 改写过的文档复制一份等待提交, 之后的读写继续使用缓冲中最新的文档。
+
+    事件处理器使用缓冲不支持的数据库操作时, 严格模式下抛出 `NotAtomic` 停止扫描;
+    否则先提交已经结束的 chunk, 当前 chunk 的写入直接写入数据库并在扫描进度中标记, 这个 chunk 提交前崩溃时重启会抛出 `NotAtomic`,
+    而不是重新执行事件处理器把这些写入再应用一次。
+    """
+
+    def __init__(self, log: ChunkLog, logger=None, strict: bool = True):
+        """
+        :param log: chunk 的提交记录
+        :param logger: 日志对象
+        :param strict: 缓冲不支持的数据库操作是否抛出 `NotAtomic`
+        """
+        super().__init__()
+        self.log = log
+        self.logger = logger
+        self.strict = strict
+        self.lock = threading.RLock()
+        self.open = False
+        self.start = None  # 当前 chunk 的开始区块
+        self.sealed: List[Tuple[int, dict]] = []  # 等待提交的 chunk 的 (结束区块, 最终文档), 按 chunk 顺序
+        self.last_committed = None  # 最后提交的结束区块, 之前的 chunk 已经在 spill 时提交
+        self.collections = {}  # 集合全名 -> pymongo 集合
+        self.commits = 0
+        self.committed = 0
+        self.spills = 0
+
+    def begin(self, block_number: int):
+        """从 block_number 开始的 chunk 开始, 上一个 chunk 还没提交时先复制它改写过的文档"""
+        with self.lock:
+            if self.open:
+                self._seal(block_number - 1)
+            self.open = True
+            self.start = block_number
+
+    def _seal(self, end_block: int):
+        self.sealed.append((end_block, { key: copy.deepcopy(self.docs[key]) for key in self.writes }))
+        self.writes = set()
+        self.open = False
+
+    def read_many(self, collection, ids: list) -> list:
+        name = collection.full_name
+        with self.lock:
+            missing = [_id for _id in ids if (name, _id) not in self.docs]
+        if len(missing) > 0:
+            found = {doc["_id"]: doc for doc in collection.find({ "_id": { "$in": missing } })}
+            with self.lock:
+                # 读取期间其他线程可能已经写入缓冲, 以缓冲中的为准
+                for _id in missing:
+                    self.docs.setdefault((name, _id), found.get(_id))
+        with self.lock:
+            return [self.docs[(name, _id)] for _id in ids]
+
+    def write(self, collection, _id, doc: dict):
+        with self.lock:
+            key = (collection.full_name, _id)
+            self.docs[key] = doc
+            self.writes.add(key)
+            self.collections[key[0]] = collection
+
+    def record(self, collection, method: str, args: tuple, kwargs: dict):
+        # 提交最终文档, 不需要重放写操作
+        pass
+
+    def commit(self, block_number: int):
+        """提交最早开始的 chunk, block_number 为它的结束区块"""
+        with self.lock:
+            if self.last_committed is not None and block_number <= self.last_committed:
+                # 已经在 spill 时提交
+                return
+            if len(self.sealed) == 0 and self.open:
+                self._seal(block_number)
+            _, images = self.sealed.pop(0) if len(self.sealed) > 0 else (block_number, {})
+        self._commit(block_number, images)
+        with self.lock:
+            # 已经提交的文档与数据库相同, 只保留还没提交的
+            pending = set(self.writes).union(*[sealed.keys() for _, sealed in self.sealed])
+            self.docs = { key: doc for key, doc in self.docs.items() if key in pending }
+
+    def _commit(self, block_number: int, images: dict):
+        self.log.commit(block_number, images, self.collections)
+        self.last_committed = block_number
+        self.commits += 1
+        self.committed += len(images)
+
+    def spill(self, write: bool = True):
+        """缓冲不支持的数据库操作直接在数据库上执行之前调用
+
+        :param write: 该操作是否改写数据, 只读或不在 chunk 中, 且没有还没提交的写入时不需要处理
+        """
+        with self.lock:
+            if len(self.sealed) == 0 and len(self.writes) == 0 and not (write and self.open):
+                return
+            if self.strict:
+                raise NotAtomic(f"Unsupported database operation in a handler of the chunk from block {self.start}, its writes cannot be committed atomically")
+            self.flush()
+            self.spills += 1
+            if self.logger:
+                self.logger.warning(f"Unsupported database operation in a handler, the chunk from block {self.start} is written before it is committed")
+
+    def flush(self):
+        """提交已经结束的 chunk, 当前 chunk 还没提交的写入标记后直接写入数据库, 之后清空缓存
+
+        当前 chunk 之后的写入也直接写入数据库, 直到下一个 chunk 开始。
+        """
+        with self.lock:
+            for end_block, images in self.sealed:
+                self._commit(end_block, images)
+            self.sealed = []
+            if self.open:
+                self.log.mark_spilled(self.start)
+                self.open = False
+            if len(self.writes) > 0:
+                self.log._apply([{ "c": name, "i": _id, "d": self.docs[(name, _id)] } for name, _id in self.writes], self.collections)
+            self.writes = set()
+            self.docs = {}
+
+    def rewind(self, block_number: int):
+        """链重组回滚后把提交的扫描进度退回 block_number, 之前应当先 `flush`, 当前 chunk 作废"""
+        with self.lock:
+            self.open = False
+            self.log.commit(block_number, {}, {})
+            self.last_committed = block_number
+
+    def reset(self):
+        """从头扫描时清空缓冲与提交记录"""
+        with self.lock:
+            self.docs = {}
+            self.writes = set()
+            self.sealed = []
+            self.open = False
+            self.last_committed = None
+        self.log.reset()
+
+    def bind(self) -> "_Binding":
+        """`with buffer.bind():` 中当前线程取得的生成数据集合经过缓冲"""
+        return _Binding()
+
+    def stats(self) -> dict:
+        return { "commits": self.commits, "committed": self.committed, "spills": self.spills, "cached": len(self.docs) }
+
+
+class _Binding:
+
+    def __enter__(self):
+        self._previous = getattr(_local, "active", False)
+        _local.active = True
+        return self
+
+    def __exit__(self, *exc):
+        _local.active = self._previous
+        return False
+
+
+def get_collection(cls):
+    """chunk 开始后事件处理器取得的生成数据集合经过缓冲, 区块与收据归档等其他数据库不受影响"""
+    active = getattr(_local, "active", False)
+    # 第一次调用时 mongoengine 会缓存真实的集合并创建索引, 这里不能经过缓冲
+    _local.active = False
+    try:
+        collection = entity_view._document_get_collection(cls)
+    finally:
+        _local.active = active
+    if _buffer is None or not _buffer.open or not active:
+        return collection
+    if cls._meta.get("db_alias", DEFAULT_CONNECTION_NAME) != DEFAULT_CONNECTION_NAME:
+        return collection
+    return BufferCollection(_buffer, collection)
+
+
+def install(buffer: ChunkBuffer):
+    global _buffer
+    _buffer = buffer
+    # 安装了链重组日志时由它在外面调用 `get_collection`
+    if entity_view._get_collection is entity_view._document_get_collection:
+        entity_view.set_collection_base(get_collection)
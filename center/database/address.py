@@ -0,0 +1,10 @@
+from mongoengine import *
+
+
+class TrackedAddress(Document):
+    """事件处理器动态添加的跟踪地址, 与生成的数据在同一个数据库中, 重建数据时一起删除"""
+    meta = { "collection": "tracked_addresses", "indexes": ["blockNumber"] }
+    id = StringField(primary_key=True)  # 合约名-地址
+    contract = StringField()
+    address = StringField()
+    blockNumber = IntField(default=0)  # 发现该地址的区块
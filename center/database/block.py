@@ -4,20 +4,44 @@ from center.json import JsonEncoder
 from web3._utils.encoding import FriendlyJsonSerde
 from typing import Any, Dict, List, Union, cast
 from mongoengine.queryset.visitor import Q
-from web3.datastructures import AttributeDict
 from center.json import json_decode
 from web3 import Web3
+from center import records
+
+# 归档格式
+LOG_FORMAT_WEB3 = 0  # web3 格式化后用 JsonEncoder 序列化
+LOG_FORMAT_RAW = 1  # JSON-RPC 原始结果
 
 
 class EventInfo(object):
-    contract: str = None
-    timestamp: int = 0
-    event: EventData = None
-    eventName: str = None
+    """需要处理的一个事件, 每个 chunk 会生成大量事件, 用 __slots__ 减少内存"""
+    __slots__ = ("contract", "timestamp", "event", "eventName", "receipt", "transaction", "index", "blockNumber")
+    contract: str
+    timestamp: int
+    event: EventData
+    eventName: str
     receipt: TxReceipt
     transaction: TxData
-    index: int = 0
-    blockNumber: BlockNumber = 0
+    index: int
+    blockNumber: BlockNumber
+
+    def __init__(self,
+                 contract: str = None,
+                 timestamp: int = 0,
+                 event: EventData = None,
+                 eventName: str = None,
+                 receipt: TxReceipt = None,
+                 transaction: TxData = None,
+                 index: int = 0,
+                 blockNumber: BlockNumber = 0):
+        self.contract = contract
+        self.timestamp = timestamp
+        self.event = event
+        self.eventName = eventName
+        self.receipt = receipt
+        self.transaction = transaction
+        self.index = index
+        self.blockNumber = blockNumber
 
 
 class ReceiptLog(Document):
@@ -25,10 +49,13 @@ class ReceiptLog(Document):
     txHash = StringField(primary_key=True, db_alias="block_logs")
     blockNumber = IntField(default=0)
     receipt = StringField()
+    format = IntField(default=LOG_FORMAT_WEB3)
 
     def get(self):
-        data = json_decode(self.receipt)
-        return cast(TxReceipt, AttributeDict.recursive(data))
+        if self.format == LOG_FORMAT_RAW:
+            return cast(TxReceipt, records.receipt_record(records.loads(self.receipt)))
+        # 嵌套的日志等字段在访问时才包装
+        return cast(TxReceipt, records.RecordView(json_decode(self.receipt)))
 
     @classmethod
     def to_json(cls, obj: TxReceipt):
@@ -36,9 +63,16 @@ class ReceiptLog(Document):
 
     @classmethod
     def create_log(cls, receipt: TxReceipt):
+        if isinstance(receipt, records.Record):
+            return cls.create_raw_log(receipt)
         json = cls.to_json(receipt)
         return cls(txHash=receipt.transactionHash.hex(), blockNumber=receipt.blockNumber, receipt=json)
 
+    @classmethod
+    def create_raw_log(cls, receipt: records.Record):
+        """直接归档 JSON-RPC 原始结果"""
+        return cls(txHash=receipt.transactionHash.hex(), blockNumber=receipt.blockNumber, receipt=records.dumps(receipt.raw), format=LOG_FORMAT_RAW)
+
     @classmethod
     def save_logs(cls, logs: list):
         for log in logs:
@@ -46,6 +80,13 @@ class ReceiptLog(Document):
             if tmp_log is None:
                 log.save()
 
+    @classmethod
+    def delLogsByBlock(cls, start_block: int):
+        """删除大于指定块号的收据
+        :param start_block: 指定块
+        """
+        cls.objects(blockNumber__gt=start_block).delete()
+
     @classmethod
     def get_receipts(cls, tx_hashs):
         datas = list(cls.objects(txHash__in=tx_hashs).all())
@@ -58,10 +99,12 @@ class BlockLog(Document):
     timestamp = IntField(default=0)
     status = IntField(default=0)  #0为未处理块,1为已处理块
     block = StringField()
+    format = IntField(default=LOG_FORMAT_WEB3)
 
     def get(self):
-        data = json_decode(self.block)
-        return cast(BlockData, AttributeDict.recursive(data))
+        if self.format == LOG_FORMAT_RAW:
+            return cast(BlockData, records.block_record(records.loads(self.block)))
+        return cast(BlockData, records.RecordView(json_decode(self.block)))
 
     @classmethod
     def to_json(cls, obj: BlockData):
@@ -69,9 +112,16 @@ class BlockLog(Document):
 
     @classmethod
     def create_log(cls, block: BlockData):
+        if isinstance(block, records.Record):
+            return cls.create_raw_log(block)
         json = cls.to_json(block)
         return cls(timestamp=block.timestamp, blockNumber=block.number, block=json)
 
+    @classmethod
+    def create_raw_log(cls, block: records.Record):
+        """直接归档 JSON-RPC 原始结果"""
+        return cls(timestamp=block.timestamp, blockNumber=block.number, block=records.dumps(block.raw), format=LOG_FORMAT_RAW)
+
     @classmethod
     def save_logs(cls, logs: list):
         for log in logs:
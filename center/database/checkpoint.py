@@ -0,0 +1,18 @@
+from mongoengine import *
+
+
+class ScanCheckpoint(Document):
+    """与生成的数据在同一个数据库中的扫描进度, 和 chunk 的数据一起提交"""
+    meta = { "collection": "scan_checkpoint"}
+    id = StringField(primary_key=True)
+    lastScannedBlock = IntField(default=0)
+    chunk = IntField(null=True)  # 已提交但还没写完的 chunk, 重启时按 `ChunkEntry` 重做
+
+
+class ChunkEntry(Document):
+    """chunk 中一个实体的最终文档, 提交前先写入, 写完数据后删除"""
+    meta = { "collection": "chunk_log", "indexes": ["chunk"] }
+    chunk = IntField()  # chunk 的结束区块
+    c = StringField()  # 集合全名
+    i = DynamicField()  # 主键
+    d = DictField(null=True)  # 最终的文档, 删除时为 None
@@ -0,0 +1,375 @@
+import copy
+import threading
+from types import SimpleNamespace
+from typing import Callable
+from mongoengine import Document
+
+# 当前线程正在使用的视图
+_local = threading.local()
+
+
+class Unsupported(BaseException):
+    """处理器使用了实体视图不支持的数据库操作, 该事件需要直接在数据库上顺序执行
+
+    继承 BaseException, 不会被处理器与 `Events.callHandle` 中的 `except Exception` 吞掉。
+    """
+
+
+def current_view() -> "EntityView":
+    if getattr(_local, "bypass", False):
+        return None
+    return getattr(_local, "view", None)
+
+
+def _split(path: str) -> list:
+    return [int(p) if p.isdigit() else p for p in path.split(".")]
+
+
+def _get_path(doc, path: str):
+    value = doc
+    for key in _split(path):
+        if isinstance(value, dict):
+            value = value.get(key)
+        elif isinstance(value, list) and isinstance(key, int) and key < len(value):
+            value = value[key]
+        else:
+            return None
+    return value
+
+
+def _set_path(doc, path: str, value):
+    keys = _split(path)
+    target = doc
+    for key in keys[:-1]:
+        if isinstance(target, dict):
+            target = target.setdefault(key, {})
+        elif isinstance(target, list) and isinstance(key, int) and key < len(target):
+            target = target[key]
+        else:
+            raise Unsupported(f"$set {path}")
+    if isinstance(target, dict):
+        target[keys[-1]] = value
+    elif isinstance(target, list) and isinstance(keys[-1], int) and keys[-1] < len(target):
+        target[keys[-1]] = value
+    else:
+        raise Unsupported(f"$set {path}")
+
+
+def _unset_path(doc, path: str):
+    keys = _split(path)
+    parent = _get_path(doc, ".".join(str(k) for k in keys[:-1])) if len(keys) > 1 else doc
+    if isinstance(parent, dict):
+        parent.pop(keys[-1], None)
+    elif isinstance(parent, list) and isinstance(keys[-1], int) and keys[-1] < len(parent):
+        parent[keys[-1]] = None
+
+
+def apply_update(doc: dict, update: dict):
+    """在内存中的文档上执行 MongoDB 的更新操作符, 只支持 mongoengine 会生成的几种"""
+    for op, fields in update.items():
+        for path, value in fields.items():
+            if op == "$set":
+                _set_path(doc, path, copy.deepcopy(value))
+            elif op == "$unset":
+                _unset_path(doc, path)
+            elif op == "$inc":
+                _set_path(doc, path, (_get_path(doc, path) or 0) + value)
+            elif op in ("$push", "$addToSet"):
+                if isinstance(value, dict) and any(k.startswith("$") for k in value.keys()):
+                    if set(value.keys()) != {"$each"}:
+                        raise Unsupported(f"{op} modifiers {list(value.keys())}")
+                    values = list(value["$each"])
+                else:
+                    values = [value]
+                items = list(_get_path(doc, path) or [])
+                for v in values:
+                    if op == "$push" or v not in items:
+                        items.append(copy.deepcopy(v))
+                _set_path(doc, path, items)
+            elif op == "$pull":
+                if isinstance(value, dict):
+                    raise Unsupported("$pull with condition")
+                _set_path(doc, path, [v for v in (_get_path(doc, path) or []) if v != value])
+            else:
+                raise Unsupported(op)
+
+
+def is_commutative(update: dict) -> bool:
+    """只有 $inc 的更新, 按任意顺序执行的结果相同"""
+    return len(update) > 0 and set(update.keys()) == {"$inc"}
+
+
+def _id_filter(filter) -> list:
+    """只支持按主键查询: {'_id': x} 或 {'_id': {'$in': [...]}}, 返回主键列表"""
+    if not isinstance(filter, dict) or list(filter.keys()) != ["_id"]:
+        raise Unsupported(f"filter {filter}")
+    value = filter["_id"]
+    if isinstance(value, dict):
+        if list(value.keys()) != ["$in"]:
+            raise Unsupported(f"filter {filter}")
+        return list(value["$in"])
+    return [value]
+
+
+class ViewCursor:
+    """按主键查询的结果, 提供 mongoengine 用到的 pymongo Cursor 接口"""
+
+    def __init__(self, docs: list):
+        self.docs = docs
+        self._skip = 0
+        self._limit = 0
+        self._position = 0
+
+    def _results(self) -> list:
+        docs = self.docs[self._skip:]
+        return docs[:self._limit] if self._limit else docs
+
+    def limit(self, limit: int):
+        self._limit = limit
+        return self
+
+    def skip(self, skip: int):
+        self._skip = skip
+        return self
+
+    def sort(self, *args, **kwargs):
+        if len(self.docs) > 1:
+            raise Unsupported("sort")
+        return self
+
+    def hint(self, *args, **kwargs):
+        return self
+
+    def batch_size(self, *args, **kwargs):
+        return self
+
+    def comment(self, *args, **kwargs):
+        return self
+
+    def collation(self, *args, **kwargs):
+        return self
+
+    def clone(self):
+        cursor = ViewCursor(self.docs)
+        cursor._skip, cursor._limit = self._skip, self._limit
+        return cursor
+
+    def close(self):
+        pass
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            cursor = self.clone()
+            cursor.docs = self._results()[key]
+            cursor._skip, cursor._limit = 0, 0
+            return cursor
+        return self._results()[key]
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        results = self._results()
+        if self._position >= len(results):
+            raise StopIteration
+        self._position += 1
+        return results[self._position - 1]
+
+    def __getattr__(self, name):
+        raise Unsupported(f"cursor.{name}")
+
+
+class ViewCollection:
+    """视图中的集合, 读取经过视图记录读集, 写入只记录在视图中, 提交时才写入数据库"""
+
+    def __init__(self, view: "EntityView", collection):
+        self._view = view
+        self._collection = collection
+        self.name = collection.name
+        self.full_name = collection.full_name
+        self.database = collection.database
+        self.codec_options = collection.codec_options
+        self.read_preference = collection.read_preference
+        self.read_concern = collection.read_concern
+        self.write_concern = collection.write_concern
+
+    def with_options(self, **kwargs):
+        return ViewCollection(self._view, self._collection.with_options(**kwargs))
+
+    def find(self, filter=None, *args, **kwargs):
+        if args or kwargs:
+            raise Unsupported(f"find {args} {kwargs}")
+        ids = _id_filter(filter)
+        docs = self._view.read_many(self._collection, ids)
+        return ViewCursor([copy.deepcopy(d) for d in docs if d is not None])
+
+    def find_one(self, filter=None, *args, **kwargs):
+        for doc in self.find(filter, *args, **kwargs):
+            return doc
+        return None
+
+    def find_one_and_replace(self, filter, replacement, **kwargs):
+        if kwargs:
+            raise Unsupported(f"find_one_and_replace {kwargs}")
+        _id = _id_filter(filter)[0]
+        old = self._view.read(self._collection, _id)
+        self._view.record(self._collection, "find_one_and_replace", (filter, replacement), {})
+        if old is not None:
+            doc = copy.deepcopy(dict(replacement))
+            doc["_id"] = _id
+            self._view.write(self._collection, _id, doc)
+        return copy.deepcopy(old)
+
+    def insert_one(self, document, **kwargs):
+        if kwargs or "_id" not in document:
+            raise Unsupported(f"insert_one {kwargs}")
+        _id = document["_id"]
+        if self._view.read(self._collection, _id) is not None:
+            raise Unsupported("insert_one duplicate key")
+        self._view.record(self._collection, "insert_one", (document, ), {})
+        self._view.write(self._collection, _id, copy.deepcopy(dict(document)))
+        return SimpleNamespace(inserted_id=_id, acknowledged=True)
+
+    def update_one(self, filter, update, upsert=False, array_filters=None, **kwargs):
+        if kwargs or array_filters:
+            raise Unsupported(f"update_one {kwargs} {array_filters}")
+        _id = _id_filter(filter)[0]
+        key = (self._collection.full_name, _id)
+        # 没有读过的实体上只做 $inc 时不依赖它当前的值, 不记入读集, 与其他事件对它的改写不冲突
+        blind = is_commutative(update) and key not in self._view.reads
+        old = self._view.read(self._collection, _id)
+        if blind:
+            self._view.reads.discard(key)
+        self._view.record(self._collection, "update_one", (filter, update), { "upsert": upsert, "array_filters": array_filters })
+        if old is None and not upsert:
+            return SimpleNamespace(raw_result={
+                "n": 0,
+                "nModified": 0,
+                "updatedExisting": False,
+                "ok": 1.0
+            },
+                                   matched_count=0,
+                                   modified_count=0,
+                                   upserted_id=None)
+        doc = copy.deepcopy(old) if old is not None else { "_id": _id }
+        apply_update(doc, update)
+        self._view.write(self._collection, _id, doc)
+        raw_result = { "n": 1, "nModified": 1 if old is not None else 0, "updatedExisting": old is not None, "ok": 1.0 }
+        if old is None:
+            raw_result["upserted"] = _id
+        return SimpleNamespace(raw_result=raw_result,
+                               matched_count=1 if old is not None else 0,
+                               modified_count=raw_result["nModified"],
+                               upserted_id=None if old is not None else _id,
+                               acknowledged=True)
+
+    def __getattr__(self, name):
+        raise Unsupported(f"collection.{name}")
+
+
+class ViewDatabase:
+    """视图中的数据库, 只提供按集合名取集合与 DBRef 解引用"""
+
+    def __init__(self, view: "EntityView", db):
+        self._view = view
+        self._db = db
+        self.name = db.name
+        self.client = db.client
+
+    def __getitem__(self, name):
+        return ViewCollection(self._view, self._db[name])
+
+    def dereference(self, dbref, **kwargs):
+        return self[dbref.collection].find_one({ "_id": dbref.id })
+
+    def __getattr__(self, name):
+        raise Unsupported(f"database.{name}")
+
+
+class EntityView:
+    """一个事件处理器执行期间看到的数据库视图。
+
+    在 `with view:` 中当前线程的 mongoengine 文档读写都经过视图: 按主键读取的文档记入读集,
+    写操作只在视图中生效并按顺序记录下来, `commit` 时再原样写入数据库, 与直接执行的结果相同。
+    实体以 (集合全名, 主键) 标识, 写入前会先读取, 写集是读集的子集;
+    例外是没有读过的实体上只有 $inc 的更新 (如 `update_one(inc__count=1)`), 它只记入写集, 多个事件累加同一个计数不算冲突。
+    """
+
+    def __init__(self):
+        self.docs = {}  # (集合全名, 主键) -> 当前视图中的文档, 不存在时为 None
+        self.reads = set()
+        self.writes = set()
+        self.ops = []  # (集合, 方法, 参数, 关键字参数)
+
+    def read(self, collection, _id):
+        return self.read_many(collection, [_id])[0]
+
+    def read_many(self, collection, ids: list) -> list:
+        keys = [(collection.full_name, _id) for _id in ids]
+        missing = [_id for key, _id in zip(keys, ids) if key not in self.docs]
+        if len(missing) > 0:
+            found = {doc["_id"]: doc for doc in collection.find({ "_id": { "$in": missing } })}
+            for _id in missing:
+                self.docs[(collection.full_name, _id)] = found.get(_id)
+        self.reads.update(keys)
+        return [self.docs[key] for key in keys]
+
+    def write(self, collection, _id, doc: dict):
+        key = (collection.full_name, _id)
+        self.docs[key] = doc
+        self.writes.add(key)
+
+    def record(self, collection, method: str, args: tuple, kwargs: dict):
+        self.ops.append((collection, method, copy.deepcopy(args), kwargs))
+
+    def commit(self):
+        """把视图中的写操作按顺序写入数据库"""
+        for collection, method, args, kwargs in self.ops:
+            getattr(collection, method)(*args, **kwargs)
+
+    def __enter__(self):
+        self._previous = getattr(_local, "view", None)
+        _local.view = self
+        return self
+
+    def __exit__(self, *exc):
+        _local.view = self._previous
+        return False
+
+
+_get_collection = Document._get_collection.__func__
+_get_db = Document._get_db.__func__
+# mongoengine 原来的实现, `_get_collection` 可以被 `set_collection_base` 换成在它外面包装的函数
+_document_get_collection = _get_collection
+
+
+def _view_get_collection(cls):
+    # 第一次调用时 mongoengine 会缓存真实的集合并创建索引, 这里不能经过视图
+    bypass = getattr(_local, "bypass", False)
+    _local.bypass = True
+    try:
+        collection = _get_collection(cls)
+    finally:
+        _local.bypass = bypass
+    view = current_view()
+    return ViewCollection(view, collection) if view else collection
+
+
+def _view_get_db(cls):
+    db = _get_db(cls)
+    view = current_view()
+    return ViewDatabase(view, db) if view else db
+
+
+def set_collection_base(get_collection: Callable):
+    """替换视图下面取得集合的函数, 例如链重组日志与 chunk 写缓冲在真实集合外面的包装; 没有安装视图时直接替换 mongoengine 的实现"""
+    global _get_collection
+    _get_collection = get_collection
+    if Document._get_collection.__func__ is not _view_get_collection:
+        Document._get_collection = classmethod(get_collection)
+
+
+def install():
+    """让 mongoengine 文档在视图中读写, 没有视图的线程不受影响"""
+    Document._get_collection = classmethod(_view_get_collection)
+    Document._get_db = classmethod(_view_get_db)
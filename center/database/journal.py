@@ -0,0 +1,9 @@
+from mongoengine import *
+
+
+class JournalBlock(Document):
+    """一个区块内事件处理器改写的实体在改写前的值, 链重组时按它回滚"""
+    meta = { "collection": "reorg_journal"}
+    blockNumber = IntField(primary_key=True)
+    hash = StringField()
+    entities = ListField()  # [{"c": 集合全名, "i": 主键, "d": 改写前的文档, 之前不存在时为 None}]
@@ -0,0 +1,96 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+from eth_utils import event_abi_to_log_topic
+from web3 import AsyncWeb3
+from web3.types import EventData, LogReceipt
+from center.decoder import DecoderRegistry
+from center.utils import Utils, ROOT_PATH
+
+# 子进程中预先编译的 (合约名, topic) -> 事件解码器
+_worker_decoders: DecoderRegistry = None
+
+
+def load_event_abis() -> dict:
+    """加载 center/abi 中所有合约的事件 abi, 键为 (合约名, topic)"""
+    abis = {}
+    for filename in os.listdir(ROOT_PATH + "/abi"):
+        if not filename.endswith(".json"):
+            continue
+        name = os.path.splitext(filename)[0]
+        for item in Utils.loadAbi(name):
+            if item.get("type") == "event":
+                abis[(name, bytes(event_abi_to_log_topic(item)))] = item
+    return abis
+
+
+def _init_worker():
+    global _worker_decoders
+    _worker_decoders = DecoderRegistry(AsyncWeb3().codec)
+    for (contract, _), abi in load_event_abis().items():
+        _worker_decoders.register(contract, abi)
+
+
+def _decode_batch(jobs: List[Tuple[str, List[bytes], bytes]]) -> list:
+    """解码一批日志, 只返回事件参数, 其余字段由主进程从原日志补全"""
+    return [_worker_decoders.decoders[(contract, topics[0])].decode_args(topics, data) for contract, topics, data in jobs]
+
+
+class DecodePool:
+    """在子进程中解码事件日志。
+
+    eth_abi 解码是 CPU 密集的, 在事件循环线程中解码大量日志时下载任务得不到调度。
+    日志按批发送到 `ProcessPoolExecutor`, 子进程启动时为 center/abi 中所有的事件编译解码器,
+    只返回解码后的参数, 主进程用同一事件的解码器按原日志组装成与 `get_event_data` 相同的 EventData。
+    进程池在扫描中途才创建, 这时数据库客户端、写入线程与线程池都已经在运行, 子进程用 spawn 启动而不是 fork,
+    不会继承 fork 时被其他线程持有的锁。
+    """
+
+    def __init__(self, decoders: DecoderRegistry, max_workers: int = None, batch_size: int = 500, min_batch: int = 200):
+        """
+        :param decoders: 当前进程的事件解码器, 即 Events.decoders
+        :param max_workers: 子进程数, 默认为 CPU 核数
+        :param batch_size: 每次发送给子进程的日志数
+        :param min_batch: 日志少于此数时直接在当前进程解码, 避免进程间通信的开销
+        """
+        self.decoders = decoders
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.min_batch = min_batch
+        self.executor: ProcessPoolExecutor = None
+        self.decoded = 0
+        self.batches = 0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker)
+        return self.executor
+
+    async def decode(self, jobs: List[Tuple[str, LogReceipt]]) -> List[EventData]:
+        """解码日志, 返回值与 jobs 一一对应
+
+        :param jobs: (合约名, 日志)
+        """
+        if len(jobs) < self.min_batch:
+            return self.decoders.decode_many(jobs)
+        payload = [(contract, [bytes(t) for t in log["topics"]], bytes(log["data"])) for contract, log in jobs]
+        batches = [payload[i:i + self.batch_size] for i in range(0, len(payload), self.batch_size)]
+        loop = asyncio.get_running_loop()
+        executor = self._executor()
+        results = await asyncio.gather(*[loop.run_in_executor(executor, _decode_batch, batch) for batch in batches])
+        self.batches += len(batches)
+        events = []
+        for args, (contract, log) in zip((args for batch in results for args in batch), jobs):
+            events.append(self.decoders.get(contract, log).decode(log, args))
+        self.decoded += len(events)
+        return events
+
+    def stats(self) -> dict:
+        return { "decoded": self.decoded, "batches": self.batches }
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,219 @@
+from typing import List, Tuple
+from eth_abi import encode
+from eth_abi.decoding import TupleDecoder
+from eth_utils import event_abi_to_log_topic, function_abi_to_4byte_selector, keccak, to_checksum_address
+from hexbytes import HexBytes
+from web3._utils.abi import (exclude_indexed_event_inputs, get_abi_input_names, get_indexed_event_inputs, get_normalized_abi_arg_type, map_abi_data, named_tree,
+                             normalize_event_input_types)
+from web3._utils.events import get_event_abi_types_for_decoding
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+from web3.datastructures import AttributeDict
+from web3.exceptions import InvalidEventABI, LogTopicError, MismatchedABI
+from web3.types import EventData, LogReceipt
+
+
+def _normalizer(type_str: str):
+    """返回值的规范化函数, 与 `get_event_data` 中的 BASE_RETURN_NORMALIZERS 相同, 不需要时为 None"""
+    if type_str == "address":
+        return to_checksum_address
+    if "address" in type_str or "(" in type_str:
+        return lambda value: map_abi_data(BASE_RETURN_NORMALIZERS, [type_str], [value])[0]
+    return None
+
+
+class EventDecoder:
+    """一个事件的解码器
+
+    创建时预先拆分 indexed 与非 indexed 参数, 取得各参数类型的 eth_abi 解码器与规范化函数,
+    每条日志只做解码本身。结果与 `web3._utils.events.get_event_data` 相同。
+    """
+
+    def __init__(self, codec, abi: dict):
+        """
+        :param codec: abi codec, 即 web3.codec
+        :param abi: 事件 abi
+        """
+        self.abi = abi
+        self.name = abi['name']
+        self.anonymous = abi.get('anonymous', False)
+        self.topic = bytes(event_abi_to_log_topic(abi))
+        self.stream_class = codec.stream_class
+        registry = codec._registry
+
+        topic_inputs = normalize_event_input_types(get_indexed_event_inputs(abi))
+        topic_types = get_event_abi_types_for_decoding(topic_inputs)
+        self.topic_names = get_abi_input_names({ "inputs": get_indexed_event_inputs(abi) })
+        self.topic_decoders = [(registry.get_decoder(t), _normalizer(t)) for t in topic_types]
+
+        data_abi = exclude_indexed_event_inputs(abi)
+        self.data_inputs = normalize_event_input_types(data_abi)
+        data_types = get_event_abi_types_for_decoding(self.data_inputs)
+        self.data_names = get_abi_input_names({ "inputs": data_abi })
+        self.data_decoder = TupleDecoder(decoders=[registry.get_decoder(t) for t in data_types])
+        self.data_normalizers = [_normalizer(t) for t in data_types]
+        # 有 tuple 参数时按 abi 组装成嵌套的字典
+        self.named = any(i['type'].startswith("tuple") for i in self.data_inputs)
+
+        duplicate_names = set(self.topic_names).intersection(self.data_names)
+        if duplicate_names:
+            raise InvalidEventABI(f"The following argument names are duplicated between event inputs: '{', '.join(duplicate_names)}'")
+
+    def decode_args(self, topics: list, data: bytes) -> dict:
+        """解码事件参数, topics 为日志的全部 topic"""
+        if not self.anonymous:
+            if len(topics) == 0:
+                raise MismatchedABI("Expected non-anonymous event to have 1 or more topics")
+            if bytes(topics[0]) != self.topic:
+                raise MismatchedABI("The event signature did not match the provided ABI")
+            topics = topics[1:]
+        if len(topics) != len(self.topic_decoders):
+            raise LogTopicError(f"Expected {len(self.topic_decoders)} log topics.  Got {len(topics)}")
+
+        args = {}
+        for name, (decoder, normalizer), topic in zip(self.topic_names, self.topic_decoders, topics):
+            value = decoder(self.stream_class(bytes(topic)))
+            args[name] = normalizer(value) if normalizer else value
+
+        values = self.data_decoder(self.stream_class(bytes(HexBytes(data))))
+        values = [normalizer(v) if normalizer else v for normalizer, v in zip(self.data_normalizers, values)]
+        if self.named:
+            args.update(named_tree(self.data_inputs, values))
+        else:
+            args.update(zip(self.data_names, values))
+        return args
+
+    def decode(self, log: LogReceipt, args: dict = None) -> EventData:
+        """解码日志, 返回与 `get_event_data` 相同的 EventData
+
+        :param args: 已经解码好的参数, 例如子进程返回的结果
+        """
+        if args is None:
+            args = self.decode_args(log['topics'], log['data'])
+        event = {
+            "args": args,
+            "event": self.name,
+            "logIndex": log['logIndex'],
+            "transactionIndex": log['transactionIndex'],
+            "transactionHash": log['transactionHash'],
+            "address": log['address'],
+            "blockHash": log['blockHash'],
+            "blockNumber": log['blockNumber'],
+        }
+        if isinstance(log, dict):
+            return event
+        # AttributeDict 与 `center.records` 的记录返回 AttributeDict, 事件处理器依赖属性访问
+        return AttributeDict.recursive(event)
+
+
+class DecoderRegistry:
+    """按 (合约名, topic0) 注册的事件解码器, 每个事件只编译一次"""
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.decoders = {}
+
+    def register(self, contract: str, abi: dict) -> EventDecoder:
+        decoder = EventDecoder(self.codec, abi)
+        self.decoders[(contract, decoder.topic)] = decoder
+        return decoder
+
+    def get(self, contract: str, log: LogReceipt) -> EventDecoder:
+        """日志对应的解码器, 没有时返回 None"""
+        if len(log['topics']) == 0:
+            return None
+        return self.decoders.get((contract, bytes(log['topics'][0])))
+
+    def decode_many(self, jobs: List[Tuple[str, LogReceipt]]) -> List[EventData]:
+        """解码一批 (合约名, 日志), 例如一个 chunk 的全部收据日志, 返回值与 jobs 一一对应"""
+        return [self.decoders[(contract, bytes(log['topics'][0]))].decode(log) for contract, log in jobs]
+
+
+class TopicFilter:
+    """事件处理器声明的 indexed 参数过滤条件, 直接与日志的原始 topics 比较"""
+
+    def __init__(self, abi: dict, arguments: dict):
+        """
+        :param abi: 事件 abi
+        :param arguments: indexed 参数名 -> 允许的值列表, 见 `center.decorator.topic_filter`
+        """
+        indexed = normalize_event_input_types(get_indexed_event_inputs(abi))
+        positions = {}
+        for i, item in enumerate(indexed):
+            positions[item['name']] = (i if abi.get('anonymous', False) else i + 1, item['type'])
+        conditions = []
+        for name, values in arguments.items():
+            if name not in positions:
+                raise ValueError(f"{abi['name']} has no indexed argument '{name}'")
+            position, type_str = positions[name]
+            conditions.append((position, frozenset(self.encode_topic(type_str, v) for v in values)))
+        self.conditions = tuple(sorted(conditions, key=lambda c: c[0]))
+
+    @staticmethod
+    def encode_topic(type_str: str, value) -> bytes:
+        """indexed 参数值在 topics 中的 32 字节编码, 动态类型为值的 keccak"""
+        if type_str == "string":
+            return bytes(keccak(text=value))
+        if type_str == "bytes":
+            return bytes(keccak(HexBytes(value)))
+        if "[" in type_str or "(" in type_str:
+            raise ValueError(f"topic filter on '{type_str}' is not supported")
+        return encode([type_str], [value])
+
+    def match(self, topics: list) -> bool:
+        for position, values in self.conditions:
+            if position >= len(topics) or bytes(topics[position]) not in values:
+                return False
+        return True
+
+    def log_topics(self, topic: str) -> list:
+        """eth_getLogs 的 topics 过滤条件, 不限制的位置为 None"""
+        topics = [[topic]]
+        for position, values in self.conditions:
+            while len(topics) < position:
+                topics.append(None)
+            topics.append(["0x" + v.hex() for v in sorted(values)])
+        return topics
+
+
+class CalldataMatcher:
+    """交易处理器声明的 input 匹配条件, 见 `center.decorator.calldata`"""
+
+    def __init__(self, codec, abi: list, selector: str = None, prefix=None, function: str = None):
+        """
+        :param codec: abi codec, 即 web3.codec
+        :param abi: 合约 abi, 按函数名匹配时使用
+        """
+        self.function = None
+        if function:
+            fn_abi = [item for item in abi if item.get('type') == "function" and item.get('name') == function]
+            if len(fn_abi) != 1:
+                raise ValueError(f"function '{function}' not found or overloaded in contract abi")
+            self.function = fn_abi[0]
+            self.prefix = function_abi_to_4byte_selector(self.function)
+            self.inputs = normalize_event_input_types(self.function.get('inputs', []))
+            types = [get_normalized_abi_arg_type(i) for i in self.inputs]
+            self.names = get_abi_input_names(self.function)
+            self.stream_class = codec.stream_class
+            self.decoder = TupleDecoder(decoders=[codec._registry.get_decoder(t) for t in types])
+            self.normalizers = [_normalizer(t) for t in types]
+            self.named = any(i['type'].startswith("tuple") for i in self.inputs)
+        elif selector:
+            self.prefix = bytes(HexBytes(selector))
+            if len(self.prefix) != 4:
+                raise ValueError(f"selector must be 4 bytes: {selector}")
+        elif prefix:
+            self.prefix = prefix.encode() if isinstance(prefix, str) else bytes(prefix)
+        else:
+            self.prefix = b""
+
+    def match(self, data: bytes) -> bool:
+        return data.startswith(self.prefix)
+
+    def decode(self, data: bytes) -> AttributeDict:
+        """解码函数调用的参数, 不是按函数名匹配时返回 None"""
+        if self.function is None:
+            return None
+        values = self.decoder(self.stream_class(data[4:]))
+        values = [normalizer(v) if normalizer else v for normalizer, v in zip(self.normalizers, values)]
+        args = named_tree(self.inputs, values) if self.named else dict(zip(self.names, values))
+        return AttributeDict.recursive({ "function": self.function['name'], "args": args })
@@ -4,6 +4,7 @@ def new_contract(contract_name: str = None, param_name: str = None):
     :param contract_name: 被新创建的合约名, 同abi文件名
     :param param_name: 被新创建的合约地址在事件参数args中的字段名
     """
+
     def decorator(f):
 
         def wrapper(*args, **kw):
@@ -16,6 +17,39 @@ def new_contract(contract_name: str = None, param_name: str = None):
                 return None
             return f(*args, **kw)
 
+        # 保留 topic_filter 声明的过滤条件
+        if hasattr(f, "topic_filters"):
+            wrapper.topic_filters = f.topic_filters
         return wrapper
 
-    return decorator
\ No newline at end of file
+    return decorator
+
+
+def calldata(selector: str = None, prefix=None, function: str = None):
+    """
+    交易处理器的装饰器, 只处理 input 匹配的交易, 扫描时在生成事件之前直接比较原始的 input
+    用于 _transfer 以及名字以 _transfer 开头的交易处理器, 三个参数选一个
+    :param selector: 4 字节的函数选择器, 例如 "0xa9059cbb"
+    :param prefix: input 的前缀, 字符串按 utf-8 编码, 例如 "data:application/json,"
+    :param function: 合约 abi 中的函数名, 匹配它的选择器, 解码后的参数放在 eventInfo.event.args
+    """
+
+    def decorator(f):
+        f.calldata = { "selector": selector, "prefix": prefix, "function": function }
+        return f
+
+    return decorator
+
+
+def topic_filter(**arguments):
+    """
+    事件处理器的装饰器, 只处理 indexed 参数为指定值的事件
+    扫描时在解码之前按日志的 topics 过滤, 使用 eth_getLogs 时作为 topic 过滤条件
+    :param arguments: indexed 参数名=允许的值, 多个值用列表, 例如 subject=["0x..."]
+    """
+
+    def decorator(f):
+        f.topic_filters = { k: list(v) if isinstance(v, (list, tuple, set)) else [v] for k, v in arguments.items() }
+        return f
+
+    return decorator
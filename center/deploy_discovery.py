@@ -0,0 +1,63 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional
+from center.logger import Logger
+
+
+class DeployDiscovery:
+    """用 `eth_getCode` 二分查找合约的部署区块。
+
+    合约部署之前地址上没有代码, 部署之后一直有代码, 在 [low, high] 之间二分查找第一个有代码的区块,
+    每个合约只需要 log2(high - low) 次调用。历史状态需要归档节点, 查询失败时返回 low, 即不跳过任何区块。
+    """
+
+    def __init__(self, get_code: Callable[[str, int], Awaitable[bytes]], logger: Logger = None):
+        """
+        :param get_code: 返回地址在某个区块时代码的协程函数
+        :param logger: 日志对象
+        """
+        self.get_code = get_code
+        self.logger = logger
+
+    async def has_code(self, address: str, block_number: int) -> bool:
+        return len(await self.get_code(address, block_number)) > 0
+
+    async def find(self, address: str, low: int, high: int) -> Optional[int]:
+        """address 在 [low, high] 中第一个有代码的区块
+
+        :return: 在 low 已经部署时为 low, 在 high 还没有代码(未部署或已销毁)时为 None
+        """
+        if not await self.has_code(address, high):
+            return None
+        if await self.has_code(address, low):
+            return low
+        # 不变式: low 没有代码, high 有代码
+        while high - low > 1:
+            mid = (low+high) // 2
+            if await self.has_code(address, mid):
+                high = mid
+            else:
+                low = mid
+        return high
+
+    async def discover(self, contracts: Dict[str, str], low: int, high: int) -> Dict[str, int]:
+        """并发查找每个合约的部署区块
+
+        :param contracts: 合约名到地址
+        :return: 合约名到可以开始扫描的区块, 无法确定时为 low
+        """
+
+        async def find(name, address):
+            try:
+                block = await self.find(address, low, high)
+            except Exception as e:
+                if self.logger:
+                    self.logger.warning(f"Discover deployment block of {name} {address} failed: {e}")
+                return low
+            if block is None:
+                if self.logger:
+                    self.logger.warning(f"{name} {address} has no code at block {high}, scanning from {low}")
+                return low
+            return block
+
+        blocks = await asyncio.gather(*[find(name, address) for name, address in contracts.items()])
+        return dict(zip(contracts.keys(), blocks))
@@ -1,17 +1,29 @@
 import grpc
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from center.rpc.donut_bot_pb2_grpc import DonutBotStub
 from center.rpc.donut_bot_pb2 import PushMessageRequest
 
 
 class DiscordBot:
 
-    def __init__(self, config, logger) -> None:
+    def __init__(self, config, logger, max_pending: int = 100) -> None:
         self.config = config
         self.logger = logger
+        # gRPC 调用是阻塞的, 在后台线程中发送, 不阻塞扫描的事件循环
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="discord")
+        self.slots = threading.BoundedSemaphore(max_pending)
 
     def push_message(self, msg: str, channel: str = None):
         if not channel:
             channel = self.config['channels']['monitor']
+        # 消息积压时丢弃, 不让机器人服务的故障拖住扫描
+        if not self.slots.acquire(blocking=False):
+            self.logger.error(f"push_message dropped, too many pending messages: {channel} {msg}")
+            return
+        self.executor.submit(self._push, channel, msg)
+
+    def _push(self, channel: str, msg: str):
         try:
             with grpc.insecure_channel(self.config['bot_server']) as grpc_channel:
                 client = DonutBotStub(grpc_channel)
@@ -20,4 +32,6 @@ class DiscordBot:
                 if res.code != 0:
                     self.logger.error(f"push_message error: {res.msg}")
         except Exception as e:
-            self.logger.error(f"push_message error: {e} Data: {channel} {msg}")
\ No newline at end of file
+            self.logger.error(f"push_message error: {e} Data: {channel} {msg}")
+        finally:
+            self.slots.release()
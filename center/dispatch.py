@@ -0,0 +1,117 @@
+from typing import List, Tuple
+from hexbytes import HexBytes
+from center.base_scanner_state import BaseScannerState
+from center.decoder import EventDecoder
+from web3.datastructures import AttributeDict
+from center.events import Events
+
+# (合约名, 事件名, 事件解码器)
+Route = Tuple[str, str, EventDecoder]
+
+
+def _calldata(data) -> bytes:
+    """交易 input 的原始字节, 从数据库恢复的交易中 input 可能是十六进制字符串"""
+    if isinstance(data, bytes):
+        return data
+    if isinstance(data, str):
+        return bytes(HexBytes(data))
+    return b""
+
+
+class DispatchTable:
+    """日志与原生转账的分发表。
+
+    按跟踪地址预先建立 (地址, topic0) -> [(合约名, 事件名, 事件解码器)] 与 地址 -> [(合约名, 交易处理器名, input 匹配条件)] 两张表,
+    每条日志或交易只需一次字典查找, 与跟踪地址无关的日志在解析 abi 之前就被丢弃,
+    input 不匹配交易处理器声明的函数选择器或前缀的交易在生成事件之前就被丢弃。
+    跟踪地址的版本变化时重建, 同一地址属于多个合约时路由按合约的加载顺序排列, 与逐个合约匹配的结果相同。
+    订阅了扫描状态的新地址通知时, 新地址的路由增量加入, 不需要重建。
+    处理器用 `topic_filter` 声明了 indexed 参数的过滤条件时, 路由前直接比较日志的原始 topics。
+    """
+
+    def __init__(self, events: Events, state: BaseScannerState):
+        self.events = events
+        self.state = state
+        self.version = None
+        self.logs = {}
+        self.transfers = {}
+        self.rebuilds = 0
+        self.increments = 0
+        self.order = { name: i for i, name in enumerate(events.getContractNames()) }
+
+    def refresh(self) -> "DispatchTable":
+        """跟踪地址变化后重建分发表"""
+        version = self.state.get_address_version()
+        if version == self.version:
+            return self
+        self.logs = {}
+        self.transfers = {}
+        for contract in self.events.getContractNames():
+            adds = self.state.get_address(contract)
+            if len(adds) > 0:
+                self._add_routes(contract, adds)
+        self.version = version
+        self.rebuilds += 1
+        return self
+
+    def _add_routes(self, contract: str, adds: list):
+        for name, matcher in self.events.getTransactionHandlers(contract).items():
+            for address in adds:
+                self.transfers.setdefault(address, []).append((contract, name, matcher))
+        topic_dict, _ = self.events.getTopics(contract)
+        topic_filters = self.events.getTopicFilters(contract)
+        routes = []
+        for topic, event_name in topic_dict.items():
+            key = bytes(HexBytes(topic))
+            routes.append((key, ((contract, event_name, self.events.decoders.decoders[(contract, key)]), topic_filters.get(topic))))
+        for address in adds:
+            for key, route in routes:
+                self.logs.setdefault((address, key), []).append(route)
+
+    def add_address(self, contract: str, address: str, version: int):
+        """新地址通知, 分发表是添加前的版本时增量加入路由, 否则留给 `refresh` 重建"""
+        if self.version is None or self.version != version - 1:
+            return
+        self._add_routes(contract, [address])
+        # 同一地址属于多个合约时保持合约的加载顺序
+        self.transfers.get(address, []).sort(key=lambda r: self.order[r[0]])
+        for topic in self.events.getTopics(contract)[0]:
+            self.logs[(address, bytes(HexBytes(topic)))].sort(key=lambda r: self.order[r[0][0]])
+        self.version = version
+        self.increments += 1
+
+    def route_log(self, log) -> List[Route]:
+        """日志对应的事件处理路由, 没有时返回空列表"""
+        topics = log['topics']
+        if len(topics) == 0:
+            return []
+        routes = self.logs.get((log['address'], bytes(topics[0])))
+        if routes is None:
+            return []
+        return [route for route, topic_filter in routes if topic_filter is None or topic_filter.match(topics)]
+
+    def route_transaction(self, tx, decode: bool = True) -> List[Tuple[str, str, AttributeDict]]:
+        """交易对应的交易处理器
+
+        :param decode: 是否解码按函数名匹配的调用参数
+        :return: [(合约名, 交易处理器名, 解码后的调用, 没有时为 None)]
+        """
+        if tx.to is None:
+            return []
+        routes = self.transfers.get(tx.to)
+        if routes is None:
+            return []
+        data = None
+        result = []
+        for contract, name, matcher in routes:
+            if matcher is None:
+                result.append((contract, name, None))
+                continue
+            if data is None:
+                data = _calldata(tx.input)
+            if matcher.match(data):
+                result.append((contract, name, matcher.decode(data) if decode else None))
+        return result
+
+    def stats(self) -> dict:
+        return { "routes": len(self.logs), "transfer_addresses": len(self.transfers), "rebuilds": self.rebuilds, "increments": self.increments }
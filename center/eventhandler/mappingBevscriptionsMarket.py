@@ -1,6 +1,6 @@
 from center.database.models import *
 from center.database.block import EventInfo
-from center.decorator import new_contract
+from center.decorator import new_contract, calldata
 from center.eventhandler.base import getDonut, createId, getUser, getIndex, getHex, getAddress, hexStrToString
 import json
 import sys
@@ -13,10 +13,16 @@ import re
 MarketContract = '0xcEB135147D213B671e39EF6dC188661fb7d86e14'
 BatchPurchaseContract = '0x28c06d07559e79b020816c57d4302A701dac7440'
 
+
+@calldata(prefix='data:application/json,')
 def _transfer(eventInfo: EventInfo, **kv):
     """这里只处理用户的list操作
         即用户发送transfer交易，附带inputdata，用户list铭文
         其他的操作均在事件处理handler中处理
+
+        注意：加上 calldata 过滤后，不以 'data:application/json,' 开头的交易不再进入这里，
+        不再为其写入 ListTransaction，Market 的 Account 也改为在第一次 list 时才创建（Account.index 会变化）。
+        旧数据库需要重新同步（paver run sync -I，或 -I -L 从本地区块重放）才能与新规则一致。
     """
     transaction = eventInfo.transaction
     hash = transaction.hash.hex()
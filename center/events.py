@@ -3,12 +3,12 @@ import importlib
 import os
 from typing import Tuple
 from center.decorator import new_contract
+from center.decoder import CalldataMatcher, DecoderRegistry, EventDecoder, TopicFilter
 from center.logger import Logger
 from center.utils import Utils, ROOT_PATH
 from center.database.block import EventInfo
 from web3.types import LogReceipt, EventData
 from eth_utils import encode_hex, event_abi_to_log_topic
-from web3._utils.events import get_event_data
 
 TRANSFER_EVENT_NAME = "_transfer"
 
@@ -31,7 +31,15 @@ class Events:
             if not filename.endswith(".json"):
                 continue
             name = os.path.splitext(filename)[0]
-            self.contracts[name] = { "handlers": {}, "topic_list": [], "entry": None, "topic_dict": None }
+            self.contracts[name] = {
+                "handlers": {},
+                "topic_list": [],
+                "entry": None,
+                "topic_dict": None,
+                "filters": {},
+                "topic_filters": {},
+                "transactions": {}
+            }
             self.contracts[name]['entry'] = self.web3.eth.contract(abi=Utils.loadAbi(name))
             count += 1
         self.logger.warning(f"Load {count} contract abi file in total.")
@@ -45,36 +53,56 @@ class Events:
             mod = importlib.__import__("center.eventhandler." + name, fromlist=["*"])
             contract = name.lstrip("mapping")
             handlers = {}
+            filters = {}
+            transactions = {}
             for f in dir(mod):
                 if f.startswith("handle"):
                     event = f.lstrip("handle")
                     func = getattr(mod, f)
+                    if hasattr(func, "topic_filters"):
+                        filters[event] = func.topic_filters
                     if not str(func).startswith("<function new_contract."):
                         func = new_contract()(func)  #添加函数装饰,处理 check_create_contract
                     handlers[event] = func
                     events_count += 1
-                elif f == TRANSFER_EVENT_NAME:
+                elif f == TRANSFER_EVENT_NAME or (f.startswith(TRANSFER_EVENT_NAME) and hasattr(getattr(mod, f), "calldata")):
+                    # 交易处理器, 用 calldata 装饰器声明了 input 匹配条件时只处理匹配的交易
                     func = getattr(mod, f)
-                    handlers[TRANSFER_EVENT_NAME] = func
+                    handlers[f] = func
+                    transactions[f] = self._compile_calldata(contract, func)
                     events_count += 1
 
             self.contracts[contract]['handlers'] = handlers
+            self.contracts[contract]['filters'] = filters
+            self.contracts[contract]['transactions'] = transactions
         self.logger.warning(f"Load {events_count} contract event handle in total.")
 
+    def _compile_calldata(self, contract_name, func) -> CalldataMatcher:
+        if not hasattr(func, "calldata"):
+            return None
+        return CalldataMatcher(self.web3.codec, self.getContract(contract_name).abi, **func.calldata)
+
     def _init_topic(self):
+        # 每个有处理器的事件预先编译一个解码器
+        self.decoders = DecoderRegistry(self.web3.codec)
         for contract_name, contract in self.contracts.items():
             topic_list = []
             topic_dict = {}
+            topic_filters = {}
             for event_name in contract['handlers'].keys():
-                if event_name == TRANSFER_EVENT_NAME:
+                if event_name in contract['transactions']:
                     continue
                 event = self.getEvent(contract_name, event_name)
                 abi = event._get_event_abi()
                 topic = encode_hex(event_abi_to_log_topic(abi))  # type: ignore
+                self.decoders.register(contract_name, abi)
                 topic_list.append(topic)
                 topic_dict[topic] = event_name
+                if event_name in contract['filters']:
+                    topic_filters[topic] = TopicFilter(abi, contract['filters'][event_name])
             contract['topic_list'] = topic_list
             contract['topic_dict'] = topic_dict
+            contract['topic_filters'] = topic_filters
 
     def getTopics(self, contract_name) -> Tuple[dict, list]:
         # print("self.contracts[contract_name]:", self.contracts[contract_name])
@@ -82,6 +110,14 @@ class Events:
         topic_dict = self.contracts[contract_name]['topic_dict']
         return topic_dict, topic_list
 
+    def getTopicFilters(self, contract_name) -> dict:
+        """合约中声明了 indexed 参数过滤条件的事件, topic -> TopicFilter"""
+        return self.contracts[contract_name]['topic_filters']
+
+    def getTransactionHandlers(self, contract_name) -> dict:
+        """合约的交易处理器, 处理器名 -> input 匹配条件, 没有声明条件时为 None"""
+        return self.contracts[contract_name]['transactions']
+
     def getContractNames(self) -> list:
         """获取所有加载的合约名"""
         return self.contracts.keys()
@@ -92,16 +128,28 @@ class Events:
     def getEvent(self, contract_name, event_name):
         return self.getContract(contract_name).events[event_name]
 
-    def getEventData(self, web3, contract_name, log_entry: LogReceipt) -> EventData:
+    def getEventAbi(self, contract_name, log_entry: LogReceipt) -> dict:
+        """日志对应的有处理器的事件 abi, 没有时返回 None"""
         topic_dict, _ = self.getTopics(contract_name)
         # print("topic_dict:", topic_dict, contract_name)
+        if len(log_entry['topics']) == 0:
+            return None
         topic_key = log_entry['topics'][0].hex()
         if topic_key not in topic_dict:
             return None
         event_name = topic_dict[topic_key]
         event = self.getEvent(contract_name, event_name)
-        abi = event._get_event_abi()
-        return get_event_data(web3.codec, abi, log_entry)
+        return event._get_event_abi()
+
+    def getDecoder(self, contract_name, log_entry: LogReceipt) -> EventDecoder:
+        """日志对应的有处理器的事件解码器, 没有时返回 None"""
+        return self.decoders.get(contract_name, log_entry)
+
+    def getEventData(self, web3, contract_name, log_entry: LogReceipt) -> EventData:
+        decoder = self.getDecoder(contract_name, log_entry)
+        if decoder is None:
+            return None
+        return decoder.decode(log_entry)
 
     def getHandle(self, contract, event_name):
         try:
@@ -0,0 +1,103 @@
+import asyncio
+import collections
+import time
+from typing import Awaitable, Callable
+
+
+class Hedge:
+    """对冲请求: 请求超过最近延迟的某个百分位还没有返回时, 再发一个相同的请求, 使用先返回的结果。
+
+    一个 chunk 要等所有区块/收据都返回, 个别几十秒才返回的请求决定了整个 chunk 的耗时,
+    对冲后 chunk 的耗时取决于典型延迟而不是最差延迟, 代价是少量重复请求。
+    """
+
+    def __init__(self, percentile: float = 0.95, window: int = 200, min_samples: int = 20, min_delay: float = 0.05):
+        """
+        :param percentile: 触发对冲的延迟百分位, 0 ~ 1
+        :param window: 统计延迟的最近请求数
+        :param min_samples: 样本数不足时不对冲
+        :param min_delay: 最小对冲等待秒数
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._latencies = collections.deque(maxlen=window)
+        self.requests = 0
+        self.hedges = 0
+        self.wins = 0  # 对冲请求先返回的次数
+        self.wasted = 0  # 被丢弃的重复请求数
+
+    def record(self, latency: float):
+        self._latencies.append(latency)
+
+    def delay(self) -> float:
+        """对冲前的等待秒数, 样本不足时返回 None"""
+        if len(self._latencies) < self.min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * self.percentile))
+        return max(self.min_delay, latencies[index])
+
+    async def _timed(self, attempt: Callable[[], Awaitable]):
+        start = time.monotonic()
+        try:
+            return await attempt()
+        finally:
+            # 出错与对冲成功后被取消的慢请求也记录已经等待的时间, 否则样本中缺少超过对冲延迟的请求, 对冲延迟越来越低
+            self.record(time.monotonic() - start)
+
+    async def run(self, attempt: Callable[[], Awaitable]):
+        """执行请求, 超过对冲延迟时再执行一次 attempt, 返回最先成功的结果
+
+        :param attempt: 每次调用发出一个请求, 由它自己选择节点
+        """
+        self.requests += 1
+        first = asyncio.ensure_future(self._timed(attempt))
+        tasks = [first]
+        try:
+            delay = self.delay()
+            if delay is None:
+                return await first
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if first in done:
+                return first.result()
+
+            self.hedges += 1
+            second = asyncio.ensure_future(self._timed(attempt))
+            tasks.append(second)
+            pending = { first, second }
+            error = None
+            while len(pending) > 0:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        # 优先抛出原请求的异常, 429 等处理逻辑依赖它
+                        if error is None or task is first:
+                            error = task.exception()
+                        continue
+                    self.wasted += len(pending)
+                    if task is second:
+                        self.wins += 1
+                    # 两个请求同时成功时丢弃一个
+                    if len(done) > 1 and all(t.exception() is None for t in done):
+                        self.wasted += 1
+                    return task.result()
+            raise error
+        finally:
+            # 返回、出错或调用方被取消时都不留下还在进行的请求
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()
+
+    def stats(self) -> dict:
+        delay = self.delay()
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_rate": round(self.hedges / self.requests, 3) if self.requests > 0 else 0.0,
+            "wins": self.wins,
+            "wasted": self.wasted,
+            "delay": round(delay, 3) if delay is not None else None,
+        }
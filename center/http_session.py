@@ -0,0 +1,92 @@
+import asyncio
+import orjson
+from typing import Any, Callable, Dict
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from web3 import AsyncWeb3
+from web3.types import RPCEndpoint, RPCResponse
+
+
+class SessionPool:
+    """每个 JSON-RPC 地址一个长期存在的 aiohttp 连接池。
+
+    web3、`BatchRpc` 与节点探测共用这里的 session, 切换节点只是换用另一个地址的 session,
+    已经建立的 keep-alive 连接、TLS 会话与 DNS 缓存都会保留。
+    """
+
+    def __init__(self,
+                 limit: int = 100,
+                 limit_per_host: int = 0,
+                 keepalive_timeout: float = 30,
+                 ttl_dns_cache: int = 300,
+                 timeout: float = 60,
+                 connect_timeout: float = 10):
+        """
+        :param limit: 每个地址的最大连接数, 0 为不限制
+        :param limit_per_host: 同一主机的最大连接数, 0 为不限制
+        :param keepalive_timeout: 空闲连接保留秒数
+        :param ttl_dns_cache: DNS 缓存秒数
+        :param timeout: 单次请求的总超时秒数
+        :param connect_timeout: 建立连接的超时秒数
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+        self.timeout = ClientTimeout(total=timeout, connect=connect_timeout)
+        self._sessions: Dict[str, ClientSession] = {}
+        self._loops: Dict[str, asyncio.AbstractEventLoop] = {}  # 地址 -> 创建 session 时的事件循环
+
+    def get(self, endpoint_uri: str) -> ClientSession:
+        """返回地址对应的 session, 不存在、已关闭或不属于当前事件循环时重新创建"""
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(endpoint_uri)
+        if session is None or session.closed or self._loops.get(endpoint_uri) is not loop:
+            connector = TCPConnector(limit=self.limit,
+                                     limit_per_host=self.limit_per_host,
+                                     keepalive_timeout=self.keepalive_timeout,
+                                     ttl_dns_cache=self.ttl_dns_cache)
+            session = ClientSession(connector=connector, timeout=self.timeout)
+            self._sessions[endpoint_uri] = session
+            self._loops[endpoint_uri] = loop
+        return session
+
+    async def close(self):
+        for endpoint_uri, session in self._sessions.items():
+            if not session.closed and not self._loops[endpoint_uri].is_closed():
+                await session.close()
+        self._sessions.clear()
+        self._loops.clear()
+
+
+class PooledHTTPProvider(AsyncWeb3.AsyncHTTPProvider):
+    """使用 `SessionPool` 中连接池的 AsyncHTTPProvider
+
+    web3 自带的 session 缓存在事件循环变化时会换成默认配置的 session, 这里直接从连接池取。
+    """
+
+    def __init__(self, endpoint_uri: str, sessions: SessionPool, request_kwargs: Any = None, headers_callback: Callable = None):
+        """
+        :param endpoint_uri: JSON-RPC 地址
+        :param sessions: 连接池
+        :param request_kwargs: 传给 `ClientSession.post` 的参数
+        :param headers_callback: 收到响应时以响应头调用, 节点池用它读取剩余额度
+        """
+        super().__init__(endpoint_uri, request_kwargs)
+        self.sessions = sessions
+        self.headers_callback = headers_callback
+
+    async def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        request_data = self.encode_rpc_request(method, params)
+        session = self.sessions.get(self.endpoint_uri)
+        async with session.post(self.endpoint_uri, data=request_data, raise_for_status=True, **self.get_request_kwargs()) as resp:
+            if self.headers_callback:
+                self.headers_callback(resp.headers)
+            raw_response = await resp.read()
+        return self.decode_rpc_response(raw_response)
+
+    def decode_rpc_response(self, raw_response: bytes) -> RPCResponse:
+        try:
+            return orjson.loads(raw_response)
+        except orjson.JSONDecodeError:
+            # orjson 不支持超过 64 位的整数
+            return super().decode_rpc_response(raw_response)
@@ -11,6 +11,7 @@ from center import metadata
 from center.server import donut_run
 from center.syncsvr import SyncSvr
 from center.flask import flask_run
+from center.cache_proxy import cache_proxy_run
 
 from center.scan_block import ScanBlock
 
@@ -34,7 +35,7 @@ URL: <{url}>
 
     arg_parser = argparse.ArgumentParser(prog=argv[0], formatter_class=argparse.RawDescriptionHelpFormatter, description=metadata.description, epilog=epilog)
     arg_parser.add_argument('--config', type=argparse.FileType('r'), help='config file for center')
-    arg_parser.add_argument('command', choices=['grpc', 'sync', 'flask'], nargs='?', help='the command to run')
+    arg_parser.add_argument('command', choices=['grpc', 'sync', 'flask', 'proxy'], nargs='?', help='the command to run')
     arg_parser.add_argument('-V', '--version', action='version', version='{0} {1}'.format(metadata.project, metadata.version))
     arg_parser.add_argument('-I', '--init', action='store_true', help='Whether to sync initial data?')
     arg_parser.add_argument('-L', '--local', action='store_true', help='Restoring data from local database')
@@ -62,6 +63,8 @@ URL: <{url}>
     elif args.command == "flask":
         flask_run(config_info)
         pass
+    elif args.command == "proxy":
+        cache_proxy_run(config_info)
     else:
         print(epilog)
     return 0
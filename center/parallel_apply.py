@@ -0,0 +1,129 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+from center.base_scanner_state import BaseScannerState
+from center.database import entity_view
+from center.database.block import EventInfo
+from center.database.entity_view import EntityView, Unsupported
+from center.logger import Logger
+
+
+class ParallelApply:
+    """乐观并行执行一个 chunk 的事件处理器。
+
+    所有事件先在线程池中各自的 `EntityView` 里执行, 记录读写的实体, 写入暂不落库;
+    然后按日志顺序提交: 读过的实体被更早的事件改写过时, 在已提交的状态上重新执行, 否则直接按顺序重放它的写操作。
+    每个事件看到的数据与顺序执行时相同, 最终结果与顺序执行一致。
+    处理器用到视图不支持的数据库操作时, 该事件直接在数据库上执行, 之后的事件全部重新执行。
+
+    事件处理器都读写同一个全局实体 (如 `getDonut`、`getIndex` 的计数) 时几乎每个事件都要重新执行, 比顺序执行多做一倍的工作;
+    累加计数改用 `update_one(inc__x=1)` 这样的 $inc 更新不算冲突。一个 chunk 中重新执行的比例超过 max_conflict_rate 时,
+    之后的 chunk 直接顺序执行, 每 probe_interval 个 chunk 再并行执行一次检查冲突是否减少。
+    """
+
+    def __init__(self, state: BaseScannerState, workers: int = 4, max_conflict_rate: float = 0.5, probe_interval: int = 10, logger: Logger = None):
+        """
+        :param state: 扫描状态, 通过它的 `process_event` 调用事件处理器
+        :param workers: 并行执行的线程数
+        :param max_conflict_rate: 重新执行的比例超过此值时改为顺序执行
+        :param probe_interval: 顺序执行时每隔多少个 chunk 并行执行一次
+        :param logger: 日志对象
+        """
+        entity_view.install()
+        self.state = state
+        self.workers = workers
+        self.max_conflict_rate = max_conflict_rate
+        self.probe_interval = max(1, probe_interval)
+        self.logger = logger
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="handler")
+        self.conflict_rate = 0.0  # 最近一次并行执行的 chunk 中重新执行的比例
+        self._skipped = 0  # 上次并行执行之后顺序执行的 chunk 数
+        self.events = 0
+        self.reexecuted = 0
+        self.serial = 0
+        self.serial_chunks = 0
+
+    def _execute(self, event: EventInfo, contracts: dict):
+        """在新的视图中执行事件处理器, 返回 (视图, 新合约回调参数, 是否不支持)"""
+        view = EntityView()
+        created = []
+        with view:
+            try:
+                self.state.process_event(event, contracts, lambda contract, address: created.append((contract, address)))
+            except Unsupported as e:
+                if self.logger:
+                    self.logger.debug(f"{event.contract}.{event.eventName} at {event.blockNumber} runs serially: {e}")
+                return view, created, True
+        return view, created, False
+
+    def apply(self, events: List[EventInfo], contracts: dict = None, new_contract_address: Callable = None) -> int:
+        """按日志顺序应用一个 chunk 的事件
+
+        new_contract_address 返回 True (添加了新的跟踪地址) 时在该事件之后停止, 之后事件的执行结果丢弃,
+        由调用方按新的地址集合重新分发后再应用。
+        :return: 应用的事件数
+        """
+        if len(events) < 2 or self._serial_chunk():
+            for i, event in enumerate(events):
+                if self._process(event, contracts, new_contract_address):
+                    return self._applied(i + 1)
+            return self._applied(len(events))
+        futures = [self.executor.submit(self._execute, event, contracts) for event in events]
+        reexecuted = self.reexecuted
+        written = set()
+        unknown_writes = False
+        try:
+            for i, (event, future) in enumerate(zip(events, futures)):
+                view, created, unsupported = future.result()
+                if unsupported or unknown_writes or len(view.reads & written) > 0:
+                    # 读到的实体被更早的事件改写过, 在已提交的状态上重新执行
+                    self.reexecuted += 1
+                    view, created, unsupported = self._execute(event, contracts)
+                    if unsupported:
+                        self.serial += 1
+                        # 不知道它写了哪些实体
+                        unknown_writes = True
+                        if self._process(event, contracts, new_contract_address):
+                            return self._applied(i + 1)
+                        continue
+                view.commit()
+                written |= view.writes
+                if new_contract_address and any([new_contract_address(contract, address) for contract, address in created]):
+                    return self._applied(i + 1, reexecuted)
+            return self._applied(len(events), reexecuted)
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _serial_chunk(self) -> bool:
+        """最近一次并行执行的冲突太多时顺序执行这个 chunk"""
+        if self.conflict_rate <= self.max_conflict_rate or self._skipped >= self.probe_interval:
+            self._skipped = 0
+            return False
+        self._skipped += 1
+        self.serial_chunks += 1
+        return True
+
+    def _process(self, event: EventInfo, contracts: dict, new_contract_address: Callable) -> bool:
+        """直接在数据库上执行事件处理器, 返回是否添加了新的跟踪地址"""
+        results = []
+        self.state.process_event(event, contracts, lambda contract, address: results.append(new_contract_address and new_contract_address(contract, address)))
+        return any(results)
+
+    def _applied(self, count: int, reexecuted: int = None) -> int:
+        """记录应用的事件数, 并行执行时 reexecuted 为开始前的重新执行数"""
+        self.events += count
+        if reexecuted is not None:
+            self.conflict_rate = (self.reexecuted - reexecuted) / count
+        return count
+
+    def stats(self) -> dict:
+        return {
+            "events": self.events,
+            "reexecuted": self.reexecuted,
+            "serial": self.serial,
+            "serial_chunks": self.serial_chunks,
+            "reexecute_rate": round(self.reexecuted / self.events, 3) if self.events > 0 else 0.0,
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,102 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Iterable, List, Tuple
+
+# 队列中表示输入结束的标记
+_END = object()
+
+
+class Stage:
+    """流水线中的一个阶段, 由一个任务按顺序处理输入队列中的数据"""
+
+    def __init__(self, name: str, handle: Callable[[Any], Awaitable], maxsize: int):
+        self.name = name
+        self.handle = handle
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.items = 0
+        self.busy = 0.0  # 处理数据的总秒数
+        self.blocked = 0.0  # 下游队列已满时等待的总秒数
+        self.max_depth = 0
+
+    def stats(self, elapsed: float) -> dict:
+        return {
+            "items": self.items,
+            "queue": self.queue.qsize(),
+            "max_queue": self.max_depth,
+            "busy": round(self.busy, 3),
+            "blocked": round(self.blocked, 3),
+            "utilization": round(self.busy / elapsed, 3) if elapsed > 0 else 0.0,
+        }
+
+
+class Pipeline:
+    """用有界 asyncio 队列连接的多阶段流水线。
+
+    每个阶段一个任务, 数据按输入顺序依次经过所有阶段, 队列满时上游阶段等待, 形成反压。
+    某个阶段出错时取消其余阶段并抛出该异常。
+    """
+
+    def __init__(self, stages: List[Tuple[str, Callable[[Any], Awaitable]]], maxsize: int = 1):
+        """
+        :param stages: (阶段名, 处理函数), 处理函数的返回值交给下一个阶段
+        :param maxsize: 每个阶段输入队列的容量
+        """
+        self.stages = [Stage(name, handle, maxsize) for name, handle in stages]
+        self.started = None
+        self.finished = None
+
+    async def _feed(self, items: Iterable, running: Callable[[], bool]):
+        first = self.stages[0]
+        for item in items:
+            if running is not None and not running():
+                break
+            await first.queue.put(item)
+            first.max_depth = max(first.max_depth, first.queue.qsize())
+        await first.queue.put(_END)
+
+    async def _work(self, index: int):
+        stage = self.stages[index]
+        following = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            item = await stage.queue.get()
+            if item is not _END:
+                start = time.monotonic()
+                item = await stage.handle(item)
+                stage.busy += time.monotonic() - start
+                stage.items += 1
+            if following is None:
+                if item is _END:
+                    return
+                continue
+            start = time.monotonic()
+            await following.queue.put(item)
+            stage.blocked += time.monotonic() - start
+            following.max_depth = max(following.max_depth, following.queue.qsize())
+            if item is _END:
+                return
+
+    async def run(self, items: Iterable, running: Callable[[], bool] = None):
+        """把 items 依次送入流水线, 等待全部处理完成
+
+        :param running: 每次送入数据前调用, 返回 False 时不再送入新数据, 已送入的数据仍会处理完
+        """
+        self.started = time.monotonic()
+        self.finished = None
+        tasks = [asyncio.create_task(self._feed(items, running))]
+        tasks += [asyncio.create_task(self._work(i)) for i in range(len(self.stages))]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception() is not None:
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.finished = time.monotonic()
+
+    def stats(self) -> dict:
+        if self.started is None:
+            return {}
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return {stage.name: stage.stats(elapsed) for stage in self.stages}
@@ -0,0 +1,254 @@
+import asyncio
+import random
+import time
+from typing import Callable, List
+from aiohttp import ClientResponseError
+from web3 import AsyncWeb3
+from center.http_session import PooledHTTPProvider
+from center.logger import Logger
+from center.rate_controller import RateController, request_slot
+
+# 节点返回的剩余额度响应头
+QUOTA_REMAINING_HEADERS = ("x-ratelimit-remaining", "x-ratelimit-remaining-requests", "ratelimit-remaining")
+QUOTA_LIMIT_HEADERS = ("x-ratelimit-limit", "x-ratelimit-limit-requests", "ratelimit-limit")
+
+
+class Endpoint:
+    """节点池中的一个 JSON-RPC 节点及其健康统计"""
+
+    def __init__(self, uri: str, web3: AsyncWeb3, rate_controller: RateController = None):
+        self.uri = uri
+        self.web3 = web3
+        self.rate_controller = rate_controller
+        self.latency = None  # 延迟的指数移动平均
+        self.error_rate = 0.0  # 错误率的指数移动平均
+        self.quota_remaining = None
+        self.quota_limit = None
+        self.failures = 0  # 连续失败次数
+        self.ejections = 0  # 连续被剔除的次数, 用于退避
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+
+    @property
+    def healthy(self) -> bool:
+        return self.ejected_until == 0
+
+    def weight(self, default_latency: float = 0.5) -> float:
+        """选择权重: 延迟越低、错误率越低、剩余额度越多权重越大
+
+        :param default_latency: 还没有延迟样本时使用的延迟
+        """
+        latency = self.latency if self.latency is not None else default_latency
+        # 50ms 以内的差异不影响分配
+        w = (1 - self.error_rate)**2 / max(latency, 0.05)
+        if self.quota_remaining is not None and self.quota_limit:
+            w *= max(0.05, min(1.0, self.quota_remaining / self.quota_limit))
+        elif self.quota_remaining == 0:
+            w *= 0.05
+        return max(w, 1e-6)
+
+    def update_quota(self, headers):
+        """从响应头读取节点的剩余额度"""
+        if headers is None:
+            return
+        for name in QUOTA_REMAINING_HEADERS:
+            value = headers.get(name)
+            if value is not None:
+                try:
+                    self.quota_remaining = float(value)
+                except ValueError:
+                    pass
+                break
+        for name in QUOTA_LIMIT_HEADERS:
+            value = headers.get(name)
+            if value is not None:
+                try:
+                    self.quota_limit = float(value)
+                except ValueError:
+                    pass
+                break
+
+    def stats(self) -> dict:
+        stats = {
+            "healthy": self.healthy,
+            "weight": round(self.weight(), 3),
+            "latency": round(self.latency, 3) if self.latency is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "requests": self.requests,
+            "errors": self.errors,
+            "throttled": self.throttled,
+        }
+        if self.quota_remaining is not None:
+            stats["quota_remaining"] = self.quota_remaining
+        if self.rate_controller:
+            stats["rate_controller"] = self.rate_controller.stats()
+        return stats
+
+
+class ProviderPool:
+    """同时使用所有配置的 JSON-RPC 节点。
+
+    每个请求按节点的延迟、错误率与剩余额度加权随机选择节点；
+    429 或连续失败的节点会被剔除一段时间(指数退避), 到期后用 eth_blockNumber 探测恢复。
+    """
+
+    def __init__(self,
+                 endpoints: List[str],
+                 web3_factory: Callable[[str], AsyncWeb3],
+                 rate_controller_factory: Callable[[], RateController] = None,
+                 max_failures: int = 5,
+                 eject_seconds: float = 30,
+                 max_eject_seconds: float = 600,
+                 alpha: float = 0.2,
+                 logger: Logger = None):
+        """
+        :param endpoints: JSON-RPC 地址列表
+        :param web3_factory: 根据地址创建 AsyncWeb3 对象
+        :param rate_controller_factory: 为每个节点创建独立的速率控制器, 为空时不做自适应控制
+        :param max_failures: 连续失败多少次后剔除节点
+        :param eject_seconds: 首次剔除的时长
+        :param max_eject_seconds: 剔除时长上限
+        :param alpha: 延迟与错误率指数移动平均的系数
+        :param logger: 日志对象
+        """
+        self.endpoints = [Endpoint(uri, web3_factory(uri), rate_controller_factory() if rate_controller_factory else None) for uri in endpoints]
+        for endpoint in self.endpoints:
+            # 单个 web3 调用的响应头同样更新剩余额度, 数组请求在 `BatchRpc` 中更新
+            provider = getattr(endpoint.web3, "provider", None)
+            if isinstance(provider, PooledHTTPProvider):
+                provider.headers_callback = endpoint.update_quota
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self.alpha = alpha
+        self.logger = logger
+        self._probing = False
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    @property
+    def adaptive(self) -> bool:
+        """是否由速率控制器决定并发"""
+        return any(e.rate_controller is not None for e in self.endpoints)
+
+    @property
+    def uris(self) -> List[str]:
+        return [e.uri for e in self.endpoints]
+
+    def healthy_endpoints(self) -> List[Endpoint]:
+        return [e for e in self.endpoints if e.healthy]
+
+    def select(self, exclude: List[Endpoint] = None) -> Endpoint:
+        """按权重随机选择一个健康节点, 全部被剔除时选择最早恢复的节点"""
+        candidates = [e for e in self.healthy_endpoints() if exclude is None or e not in exclude]
+        if len(candidates) == 0:
+            candidates = self.healthy_endpoints()
+        if len(candidates) == 0:
+            return min(self.endpoints, key=lambda e: e.ejected_until)
+        if len(candidates) == 1:
+            return candidates[0]
+        # 没有样本的节点按已知的最低延迟计算, 保证它们能被尝试
+        known = [e.latency for e in candidates if e.latency is not None]
+        default_latency = min(known) if len(known) > 0 else 0.5
+        return random.choices(candidates, weights=[e.weight(default_latency) for e in candidates])[0]
+
+    def report(self, endpoint: Endpoint, latency: float, ok: bool = True, throttled: bool = False):
+        """记录一次请求结果"""
+        endpoint.requests += 1
+        if ok:
+            endpoint.latency = latency if endpoint.latency is None else endpoint.latency + self.alpha * (latency - endpoint.latency)
+            endpoint.error_rate -= self.alpha * endpoint.error_rate
+            endpoint.failures = 0
+            return
+        endpoint.errors += 1
+        endpoint.error_rate += self.alpha * (1 - endpoint.error_rate)
+        endpoint.failures += 1
+        if throttled:
+            endpoint.throttled += 1
+            self.eject(endpoint, "throttled")
+        elif endpoint.failures >= self.max_failures:
+            self.eject(endpoint, f"{endpoint.failures} consecutive failures")
+
+    def eject(self, endpoint: Endpoint, reason: str = ""):
+        """剔除节点, 连续剔除时时长加倍"""
+        if not endpoint.healthy:
+            return
+        # 至少保留一个节点
+        if len(self.healthy_endpoints()) <= 1:
+            return
+        seconds = min(self.max_eject_seconds, self.eject_seconds * 2**endpoint.ejections)
+        endpoint.ejections += 1
+        endpoint.ejected_until = time.monotonic() + seconds
+        if self.logger:
+            self.logger.warning(f"Provider {endpoint.uri} ejected for {seconds} seconds: {reason}")
+
+    def restore(self, endpoint: Endpoint, latency: float = None):
+        endpoint.ejected_until = 0.0
+        endpoint.ejections = 0
+        endpoint.failures = 0
+        endpoint.error_rate = 0.0
+        if latency is not None:
+            endpoint.latency = latency
+        if self.logger:
+            self.logger.warning(f"Provider {endpoint.uri} recovered")
+
+    async def recover(self):
+        """探测剔除时间已到的节点, 成功则恢复, 失败则继续剔除"""
+        if self._probing:
+            return
+        now = time.monotonic()
+        expired = [e for e in self.endpoints if not e.healthy and e.ejected_until <= now]
+        if len(expired) == 0:
+            return
+        self._probing = True
+        try:
+            await asyncio.gather(*[self._probe(e) for e in expired])
+        finally:
+            self._probing = False
+
+    async def _probe(self, endpoint: Endpoint):
+        start = time.monotonic()
+        try:
+            await endpoint.web3.eth.block_number
+        except Exception as e:
+            seconds = min(self.max_eject_seconds, self.eject_seconds * 2**endpoint.ejections)
+            endpoint.ejections += 1
+            endpoint.ejected_until = time.monotonic() + seconds
+            if self.logger:
+                self.logger.warning(f"Provider {endpoint.uri} probe failed: {e}, ejected for {seconds} seconds")
+            return
+        self.restore(endpoint, time.monotonic() - start)
+
+    def slot(self, endpoint: Endpoint) -> "PoolSlot":
+        """用于 `async with` 的请求名额, 占用节点自己的速率控制器并记录结果"""
+        return PoolSlot(self, endpoint)
+
+    def stats(self) -> dict:
+        return {e.uri: e.stats() for e in self.endpoints}
+
+
+class PoolSlot:
+
+    def __init__(self, pool: ProviderPool, endpoint: Endpoint):
+        self.pool = pool
+        self.endpoint = endpoint
+        self.inner = request_slot(endpoint.rate_controller)
+        self.start = 0
+
+    async def __aenter__(self):
+        await self.inner.__aenter__()
+        self.start = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        latency = time.monotonic() - self.start
+        if exc_type is None:
+            self.pool.report(self.endpoint, latency)
+        elif isinstance(exc, ClientResponseError) and exc.status == 429:
+            self.pool.report(self.endpoint, latency, ok=False, throttled=True)
+        elif not isinstance(exc, asyncio.CancelledError):
+            self.pool.report(self.endpoint, latency, ok=False)
+        return await self.inner.__aexit__(exc_type, exc, tb)
@@ -0,0 +1,215 @@
+import asyncio
+import collections
+import time
+from aiohttp import ClientResponseError, ServerTimeoutError
+
+
+class RateController:
+    """AIMD 方式自适应调整 JSON-RPC 的并发数与请求速率。
+
+    并发由一个可变上限的信号量控制，速率由令牌桶控制。
+    延迟和错误率健康时每完成一轮(当前并发数个)请求，并发加一、速率按比例增加；
+    遇到 429 或超时时并发与速率按 `decrease_factor` 成倍下降，一个冷却周期内只下降一次。
+    """
+
+    def __init__(self,
+                 initial_concurrency: int = 10,
+                 min_concurrency: int = 1,
+                 max_concurrency: int = 200,
+                 initial_rate: float = 20.0,
+                 min_rate: float = 1.0,
+                 max_rate: float = 1000.0,
+                 target_latency: float = 2.0,
+                 max_error_rate: float = 0.05,
+                 decrease_factor: float = 0.5,
+                 window: int = 100):
+        """
+        :param initial_concurrency: 初始并发数
+        :param min_concurrency: 最小并发数
+        :param max_concurrency: 最大并发数
+        :param initial_rate: 初始速率(请求/秒)
+        :param min_rate: 最小速率
+        :param max_rate: 最大速率
+        :param target_latency: 目标延迟秒数, 超过时不再增加并发
+        :param max_error_rate: 最近窗口内允许的最大错误率
+        :param decrease_factor: 429/超时时的乘性下降系数
+        :param window: 统计延迟与错误率的最近请求数
+        """
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.decrease_factor = decrease_factor
+        self.concurrency = float(min(max(initial_concurrency, min_concurrency), max_concurrency))
+        self.rate = float(min(max(initial_rate, min_rate), max_rate))
+        self.tokens = 1.0
+        self.last_refill = time.monotonic()
+        self.last_decrease = 0.0
+        self.in_flight = 0
+        self.successes_since_increase = 0
+        self._waiters = collections.deque()
+        self._recent = collections.deque(maxlen=window)  # (延迟, 是否成功)
+        self.total_requests = 0
+        self.total_errors = 0
+        self.total_throttled = 0
+        self.total_timeouts = 0
+        self.total_decreases = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    async def _take_token(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    async def acquire(self):
+        """等待并发名额与速率令牌"""
+        while self.in_flight >= int(self.concurrency):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+        try:
+            await self._take_token()
+        except BaseException:
+            self.in_flight -= 1
+            self._wake()
+            raise
+
+    def _wake(self):
+        free = int(self.concurrency) - self.in_flight
+        while free > 0 and len(self._waiters) > 0:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def release(self, latency: float, ok: bool = True, throttled: bool = False, timeout: bool = False):
+        """一个请求完成, 根据结果调整并发与速率
+
+        :param latency: 请求耗时秒数
+        :param ok: 是否成功
+        :param throttled: 是否被节点限流(429)
+        :param timeout: 是否超时
+        """
+        self.in_flight = max(0, self.in_flight - 1)
+        self.total_requests += 1
+        self._recent.append((latency, ok))
+        if throttled or timeout:
+            self.total_throttled += 1 if throttled else 0
+            self.total_timeouts += 1 if timeout else 0
+            self.total_errors += 1
+            self._decrease()
+        elif not ok:
+            self.total_errors += 1
+            if self.error_rate() > self.max_error_rate:
+                self._decrease()
+        elif latency <= self.target_latency and self.error_rate() <= self.max_error_rate:
+            self.successes_since_increase += 1
+            # 每完成一轮请求线性增加
+            if self.successes_since_increase >= int(self.concurrency):
+                self.successes_since_increase = 0
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+                self.rate = min(self.max_rate, self.rate * (1 + 1 / self.concurrency))
+        self._wake()
+
+    def cancel(self):
+        """请求被取消, 只归还并发名额, 不计入统计"""
+        self.in_flight = max(0, self.in_flight - 1)
+        self._wake()
+
+    def _decrease(self):
+        now = time.monotonic()
+        # 同一批失败只下降一次
+        if now - self.last_decrease < self.target_latency:
+            return
+        self.last_decrease = now
+        self.total_decreases += 1
+        self.successes_since_increase = 0
+        self.concurrency = max(self.min_concurrency, self.concurrency * self.decrease_factor)
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+
+    def error_rate(self) -> float:
+        if len(self._recent) == 0:
+            return 0.0
+        return sum(1 for _, ok in self._recent if not ok) / len(self._recent)
+
+    def average_latency(self) -> float:
+        if len(self._recent) == 0:
+            return 0.0
+        return sum(latency for latency, _ in self._recent) / len(self._recent)
+
+    def slot(self) -> "RateSlot":
+        """用于 `async with` 的请求名额, 退出时根据异常类型自动调用 release"""
+        return RateSlot(self)
+
+    def stats(self) -> dict:
+        """当前的限制与统计"""
+        return {
+            "concurrency": int(self.concurrency),
+            "rate": round(self.rate, 2),
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "average_latency": round(self.average_latency(), 3),
+            "error_rate": round(self.error_rate(), 3),
+            "requests": self.total_requests,
+            "errors": self.total_errors,
+            "throttled": self.total_throttled,
+            "timeouts": self.total_timeouts,
+            "decreases": self.total_decreases,
+        }
+
+
+class RateSlot:
+
+    def __init__(self, controller: RateController):
+        self.controller = controller
+        self.start = 0
+
+    async def __aenter__(self):
+        await self.controller.acquire()
+        self.start = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        latency = time.monotonic() - self.start
+        if exc_type is None:
+            self.controller.release(latency)
+        elif isinstance(exc, ClientResponseError) and exc.status == 429:
+            self.controller.release(latency, ok=False, throttled=True)
+        elif isinstance(exc, (asyncio.TimeoutError, ServerTimeoutError)):
+            self.controller.release(latency, ok=False, timeout=True)
+        elif isinstance(exc, asyncio.CancelledError):
+            self.controller.cancel()
+        else:
+            self.controller.release(latency, ok=False)
+        return False
+
+
+class NoopSlot:
+    """未启用自适应控制时使用的空名额"""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+def request_slot(controller: RateController = None):
+    """返回控制器的请求名额, 控制器为空时不做任何限制"""
+    if controller is None:
+        return NoopSlot()
+    return controller.slot()
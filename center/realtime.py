@@ -0,0 +1,150 @@
+import asyncio
+import json
+import time
+from typing import Awaitable, Callable
+import websockets
+from center.logger import Logger
+
+
+class HeadTracker:
+    """跟踪链头区块号, 用于实时同步。
+
+    配置了 WebSocket 地址时订阅 `newHeads`, 新块一公布就唤醒等待者;
+    连接断开期间按观察到的出块时间自适应轮询 `eth_blockNumber`, 并在后台不断重连。
+    """
+
+    def __init__(self,
+                 ws_uri: str = None,
+                 poll: Callable[[], Awaitable[int]] = None,
+                 block_time: float = 3.0,
+                 min_poll_interval: float = 0.2,
+                 reconnect_seconds: float = 5.0,
+                 alpha: float = 0.2,
+                 logger: Logger = None):
+        """
+        :param ws_uri: WebSocket JSON-RPC 地址, 为空时只轮询
+        :param poll: 返回最新块号的协程函数
+        :param block_time: 初始的出块时间估计(秒)
+        :param min_poll_interval: 最小轮询间隔
+        :param reconnect_seconds: WebSocket 断开后的重连间隔
+        :param alpha: 出块时间指数移动平均的系数
+        :param logger: 日志对象
+        """
+        self.ws_uri = ws_uri
+        self.poll = poll
+        self.block_time = block_time
+        self.min_poll_interval = min_poll_interval
+        self.reconnect_seconds = reconnect_seconds
+        self.alpha = alpha
+        self.logger = logger
+        self.head = 0
+        self.head_time = time.monotonic()
+        self.connected = False
+        self.running = False
+        self._event = asyncio.Event()
+        self._task: asyncio.Task = None
+        self.notifications = 0
+        self.polls = 0
+        self.empty_polls = 0
+
+    def observe(self, number: int):
+        """记录一个新的链头, 同时更新出块时间估计"""
+        if number <= self.head:
+            return False
+        now = time.monotonic()
+        if self.head > 0:
+            interval = (now - self.head_time) / (number - self.head)
+            self.block_time += self.alpha * (interval - self.block_time)
+        self.head = number
+        self.head_time = now
+        self._event.set()
+        return True
+
+    async def start(self):
+        self.running = True
+        self._event = asyncio.Event()
+        await self._poll_once()
+        if self.ws_uri and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._subscribe())
+
+    def stop(self):
+        self.running = False
+        self._event.set()
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    async def _subscribe(self):
+        while self.running:
+            try:
+                async with websockets.connect(self.ws_uri) as ws:
+                    await ws.send(json.dumps({ "jsonrpc": "2.0", "id": 1, "method": "eth_subscribe", "params": ["newHeads"] }))
+                    reply = json.loads(await ws.recv())
+                    if reply.get("error") is not None:
+                        raise ValueError(reply["error"])
+                    subscription = reply.get("result")
+                    self.connected = True
+                    if self.logger:
+                        self.logger.warning(f"Subscribed to newHeads on {self.ws_uri}")
+                    async for message in ws:
+                        params = json.loads(message).get("params", {})
+                        if params.get("subscription") != subscription:
+                            continue
+                        self.notifications += 1
+                        self.observe(int(params["result"]["number"], 16))
+                raise ConnectionError("connection closed")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.connected and self.logger:
+                    self.logger.warning(f"newHeads subscription on {self.ws_uri} dropped: {e}, falling back to polling")
+                self.connected = False
+                # 唤醒等待者, 让它们改为轮询
+                self._event.set()
+            finally:
+                self.connected = False
+            await asyncio.sleep(self.reconnect_seconds)
+
+    async def _poll_once(self):
+        if self.poll is None:
+            return
+        self.polls += 1
+        try:
+            if not self.observe(await self.poll()):
+                self.empty_polls += 1
+        except Exception as e:
+            if self.logger:
+                self.logger.warning(f"Poll block number failed: {e}")
+
+    def poll_delay(self) -> float:
+        """按出块时间估计下一个块出现的时间, 已经超时则以四分之一出块时间再试"""
+        expected = self.head_time + self.block_time - time.monotonic()
+        if expected <= 0:
+            expected = self.block_time / 4
+        return max(self.min_poll_interval, expected)
+
+    async def wait_for(self, number: int) -> int:
+        """等待链头达到 number, 返回当前链头"""
+        while self.running and self.head < number:
+            if self.connected:
+                self._event.clear()
+                if self.head >= number:
+                    break
+                try:
+                    # 长时间没有通知时也主动查一次, 防止连接假死
+                    await asyncio.wait_for(self._event.wait(), timeout=max(self.block_time * 4, 1))
+                except asyncio.TimeoutError:
+                    await self._poll_once()
+            else:
+                await asyncio.sleep(self.poll_delay())
+                await self._poll_once()
+        return self.head
+
+    def stats(self) -> dict:
+        return {
+            "head": self.head,
+            "block_time": round(self.block_time, 3),
+            "connected": self.connected,
+            "notifications": self.notifications,
+            "polls": self.polls,
+            "empty_polls": self.empty_polls,
+        }
@@ -0,0 +1,65 @@
+from typing import Dict, List
+from center.batch_rpc import BatchRpc
+from center.logger import Logger
+from center.http_session import SessionPool
+
+# 收据获取方式
+STRATEGY_AUTO = "auto"  # 启动时探测节点是否支持 eth_getBlockReceipts
+STRATEGY_BLOCK = "block"  # 总是使用 eth_getBlockReceipts, 每块一次调用
+STRATEGY_TRANSACTION = "transaction"  # 总是逐笔调用 eth_getTransactionReceipt
+
+
+class ReceiptStrategy:
+    """决定每个 JSON-RPC 节点用哪种方式获取收据。
+
+    很多节点支持 `eth_getBlockReceipts`, 一次调用就能返回整块的收据。
+    启动时对 `chain_api` 中的每个节点做一次探测，支持的节点按块获取，其余节点退回逐笔获取。
+    """
+
+    def __init__(self, endpoints: List[str], mode: str = STRATEGY_AUTO, headers: dict = None, logger: Logger = None, sessions: SessionPool = None):
+        """
+        :param endpoints: 配置的 JSON-RPC 地址列表
+        :param mode: auto, block 或 transaction
+        :param headers: 探测请求使用的请求头
+        :param logger: 日志对象
+        :param sessions: 共用的连接池
+        """
+        self.endpoints = list(endpoints)
+        self.mode = mode
+        self.headers = headers
+        self.logger = logger
+        self.sessions = sessions
+        self.capabilities: Dict[str, bool] = {}
+        self.probed = False
+
+    async def probe_endpoint(self, endpoint: str) -> bool:
+        """用最新块调用一次 eth_getBlockReceipts, 返回列表即认为支持"""
+        rpc = BatchRpc(endpoint, headers=self.headers, timeout=30, sessions=self.sessions)
+        try:
+            head = int(await rpc.call("eth_blockNumber", []), 16)
+            result = await rpc.call("eth_getBlockReceipts", [hex(head)])
+            return isinstance(result, list) and all(isinstance(r, dict) and "transactionHash" in r for r in result)
+        except Exception as e:
+            if self.logger:
+                self.logger.warning(f"{endpoint} does not support eth_getBlockReceipts: {e}")
+            return False
+        finally:
+            await rpc.close()
+
+    async def probe(self):
+        """探测所有节点的能力, 只在 auto 模式下执行一次"""
+        if self.probed or self.mode != STRATEGY_AUTO:
+            return
+        for endpoint in self.endpoints:
+            self.capabilities[endpoint] = await self.probe_endpoint(endpoint)
+            if self.logger:
+                self.logger.warning(f"Receipt strategy for {endpoint}: {'block' if self.capabilities[endpoint] else 'transaction'}")
+        self.probed = True
+
+    def use_block_receipts(self, endpoint: str) -> bool:
+        """当前节点是否使用 eth_getBlockReceipts"""
+        if self.mode == STRATEGY_BLOCK:
+            return True
+        if self.mode == STRATEGY_TRANSACTION:
+            return False
+        return self.capabilities.get(endpoint, False)
@@ -0,0 +1,227 @@
+from abc import ABC, abstractmethod
+from functools import lru_cache
+import orjson
+from eth_utils import to_checksum_address
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+
+
+class _Fields(ABC):
+    """按字段名用属性或下标访问的只读记录, 和 web3 的 AttributeDict 用法相同, 子类实现 `keys`"""
+    __slots__ = ()
+
+    @abstractmethod
+    def keys(self):
+        """记录的字段名"""
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __contains__(self, name):
+        return name in self.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self.items())!r})"
+
+
+class Record(_Fields):
+    """轻量的区块/交易/收据/日志记录
+
+    只包含扫描器与事件处理器用到的字段, 不经过 web3 的结果格式化。`raw` 为 JSON-RPC 返回的原始结果, 用于直接归档。
+    字段保存在 __slots__ 中, 第一次访问时才从 `raw` 解码, 没有用到的字段 (例如收据的 logs、交易的 input) 不会解码。
+    """
+    __slots__ = ("raw", )
+    # 字段名 -> 原始值的解码函数, 原始值不存在时传入 None
+    FIELDS = {}
+
+    def __init__(self, raw: dict):
+        self.raw = raw
+
+    def __getattr__(self, name):
+        # 只在 slot 还没有值时调用
+        try:
+            decode = self.FIELDS[name]
+        except KeyError:
+            raise AttributeError(name) from None
+        value = decode(self.raw.get(name))
+        object.__setattr__(self, name, value)
+        return value
+
+    def __setattr__(self, name, value):
+        if name != "raw":
+            raise AttributeError(f"{type(self).__name__} is read only")
+        object.__setattr__(self, name, value)
+
+    def __reduce__(self):
+        # 进程间只传递原始结果
+        return (type(self), (self.raw, ))
+
+    def keys(self):
+        return self.FIELDS.keys()
+
+
+@lru_cache(maxsize=65536)
+def _address(value: str) -> str:
+    return to_checksum_address(value)
+
+
+def _optional_address(value: str) -> str:
+    return _address(value) if value else None
+
+
+def _int(value) -> int:
+    if value is None:
+        return None
+    return int(value, 16) if isinstance(value, str) else value
+
+
+def _bytes(value) -> HexBytes:
+    if value is None:
+        return None
+    return HexBytes(value)
+
+
+def _access_list(value) -> list:
+    if value is None:
+        return None
+    return [AttributeDict({ "address": _address(item["address"]), "storageKeys": [HexBytes(k) for k in item["storageKeys"]] }) for item in value]
+
+
+class LogRecord(Record):
+    FIELDS = {
+        "address": _address,
+        "topics": lambda value: [HexBytes(t) for t in value],
+        "data": HexBytes,
+        "logIndex": _int,
+        "blockNumber": _int,
+        "blockHash": _bytes,
+        "transactionHash": _bytes,
+        "transactionIndex": _int,
+        "removed": bool,
+    }
+    __slots__ = tuple(FIELDS)
+
+
+class TransactionRecord(Record):
+    FIELDS = {
+        "hash": _bytes,
+        "from": _optional_address,
+        "to": _optional_address,
+        "input": _bytes,
+        "value": _int,
+        "blockNumber": _int,
+        "blockHash": _bytes,
+        "transactionIndex": _int,
+        "accessList": _access_list,
+    }
+    __slots__ = tuple(FIELDS)
+
+
+class ReceiptRecord(Record):
+    FIELDS = {
+        "transactionHash": _bytes,
+        "transactionIndex": _int,
+        "blockNumber": _int,
+        "blockHash": _bytes,
+        "from": _optional_address,
+        "to": _optional_address,
+        "contractAddress": _optional_address,
+        "status": _int,
+        "logs": lambda value: [LogRecord(log) for log in value or []],
+    }
+    __slots__ = tuple(FIELDS)
+
+
+class BlockRecord(Record):
+    FIELDS = {
+        "number": _int,
+        "hash": _bytes,
+        "parentHash": _bytes,
+        "timestamp": _int,
+        "logsBloom": _bytes,
+        "transactions": lambda value: [TransactionRecord(t) if isinstance(t, dict) else HexBytes(t) for t in value or []],
+    }
+    __slots__ = tuple(FIELDS)
+
+
+def log_record(raw: dict) -> LogRecord:
+    return LogRecord(raw)
+
+
+def transaction_record(raw: dict) -> TransactionRecord:
+    return TransactionRecord(raw)
+
+
+def receipt_record(raw: dict) -> ReceiptRecord:
+    return ReceiptRecord(raw)
+
+
+def block_record(raw: dict) -> BlockRecord:
+    return BlockRecord(raw)
+
+
+class RecordView(_Fields):
+    """数据库中 web3 格式归档的只读视图
+
+    代替 `AttributeDict.recursive`, 嵌套的字典与列表在第一次访问时才包装成视图。
+    """
+    __slots__ = ("_data", )
+
+    def __init__(self, data: dict):
+        self._data = data
+
+    def __getattr__(self, name):
+        try:
+            data = self.__getattribute__("_data")
+            value = data[name]
+        except KeyError:
+            raise AttributeError(name) from None
+        if isinstance(value, dict):
+            value = data[name] = RecordView(value)
+        elif isinstance(value, list) and len(value) > 0 and isinstance(value[0], (dict, list)):
+            value = data[name] = [_view(v) for v in value]
+        return value
+
+    def __reduce__(self):
+        return (RecordView, (self._data, ))
+
+    def keys(self):
+        return self._data.keys()
+
+
+def _view(value):
+    if isinstance(value, dict):
+        return RecordView(value)
+    if isinstance(value, list):
+        return [_view(v) for v in value]
+    return value
+
+
+def dumps(raw: dict) -> str:
+    """原始结果序列化为归档用的 JSON 字符串"""
+    return orjson.dumps(raw).decode()
+
+
+def loads(data):
+    return orjson.loads(data)
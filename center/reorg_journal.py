@@ -0,0 +1,315 @@
+import threading
+from typing import Dict, List, Optional
+from hexbytes import HexBytes
+from pymongo import InsertOne
+from center import chunk_commit
+from center.chunk_commit import id_list
+from center.database import entity_view
+from center.database.block import BlockLog
+from center.database.journal import JournalBlock
+
+# 当前线程正在处理的事件所在的区块
+_local = threading.local()
+# 安装后记录改写前的值的日志
+_journal: "ReorgJournal" = None
+
+
+def block_hash(value) -> Optional[str]:
+    """区块哈希统一为 0x 开头的十六进制字符串"""
+    if value is None:
+        return None
+    return HexBytes(value).hex()
+
+
+class JournalCollection:
+    """写入前记录改写前的值的集合, 读操作与其他属性直接交给 pymongo 集合"""
+
+    def __init__(self, journal: "ReorgJournal", collection, block_number: int):
+        self._journal = journal
+        self._collection = collection
+        self._block = block_number
+
+    def with_options(self, **kwargs):
+        return JournalCollection(self._journal, self._collection.with_options(**kwargs), self._block)
+
+    def _before(self, filter):
+        self._journal.capture(self._block, self._collection, filter)
+
+    def _created(self, ids: list):
+        self._journal.created(self._block, self._collection, ids)
+
+    def _upserted(self, result):
+        if getattr(result, "upserted_id", None) is not None:
+            self._created([result.upserted_id])
+        return result
+
+    def _found_upserted(self, filter, kwargs: dict):
+        if kwargs.get("upsert"):
+            self._created([doc["_id"] for doc in self._collection.find(filter, { "_id": 1 })])
+
+    def insert_one(self, document, *args, **kwargs):
+        result = self._collection.insert_one(document, *args, **kwargs)
+        self._created([result.inserted_id])
+        return result
+
+    def insert_many(self, documents, *args, **kwargs):
+        documents = list(documents)
+        ids = [d["_id"] for d in documents if "_id" in d]
+        if len(ids) > 0:
+            # 主键重复插入失败的文档保留原来的值
+            self._before({ "_id": { "$in": ids } })
+        try:
+            return self._collection.insert_many(documents, *args, **kwargs)
+        finally:
+            self._created([d["_id"] for d in documents if "_id" in d])
+
+    def update_one(self, filter, update, *args, **kwargs):
+        self._before(filter)
+        return self._upserted(self._collection.update_one(filter, update, *args, **kwargs))
+
+    def update_many(self, filter, update, *args, **kwargs):
+        self._before(filter)
+        return self._upserted(self._collection.update_many(filter, update, *args, **kwargs))
+
+    def replace_one(self, filter, replacement, *args, **kwargs):
+        self._before(filter)
+        return self._upserted(self._collection.replace_one(filter, replacement, *args, **kwargs))
+
+    def delete_one(self, filter, *args, **kwargs):
+        self._before(filter)
+        return self._collection.delete_one(filter, *args, **kwargs)
+
+    def delete_many(self, filter, *args, **kwargs):
+        self._before(filter)
+        return self._collection.delete_many(filter, *args, **kwargs)
+
+    def find_one_and_replace(self, filter, replacement, *args, **kwargs):
+        self._before(filter)
+        result = self._collection.find_one_and_replace(filter, replacement, *args, **kwargs)
+        self._found_upserted(filter, kwargs)
+        return result
+
+    def find_one_and_update(self, filter, update, *args, **kwargs):
+        self._before(filter)
+        result = self._collection.find_one_and_update(filter, update, *args, **kwargs)
+        self._found_upserted(filter, kwargs)
+        return result
+
+    def find_one_and_delete(self, filter, *args, **kwargs):
+        self._before(filter)
+        return self._collection.find_one_and_delete(filter, *args, **kwargs)
+
+    def bulk_write(self, requests, *args, **kwargs):
+        requests = list(requests)
+        ids, inserted = [], []
+        for request in requests:
+            if isinstance(request, InsertOne):
+                if "_id" in request._doc:
+                    inserted.append(request._doc["_id"])
+                continue
+            filter_ids = id_list(request._filter)
+            if filter_ids is None:
+                self._before(request._filter)
+            else:
+                ids.extend(filter_ids)
+        if len(ids) + len(inserted) > 0:
+            # 主键重复插入失败的文档保留原来的值
+            self._before({ "_id": { "$in": ids + inserted } })
+        try:
+            result = self._collection.bulk_write(requests, *args, **kwargs)
+        finally:
+            self._created(inserted)
+        if result.acknowledged:
+            self._created(list(result.upserted_ids.values()))
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+class ReorgJournal:
+    """链重组日志
+
+    事件处理器在某个区块中第一次改写一个实体 (集合全名, 主键) 之前, 先读出它当前的文档记录下来, 之前不存在时记录 None,
+    chunk 结束时每个区块一条写入 `reorg_journal` 集合, 只保留离链头 `blocks` 个区块以内的记录。
+    同时记录这些区块的哈希, 新区块的父哈希与记录的不一致时说明发生了链重组,
+    回滚时从最新的区块开始逐块恢复记录的文档, 之后只需要从分叉点重新扫描受影响的区块。
+    """
+
+    def __init__(self, blocks: int, collection=None):
+        """
+        :param blocks: 保留记录的区块数, 即最多能回滚的深度
+        :param collection: 保存记录的 pymongo 集合, 为空时使用 `JournalBlock` 的集合
+        """
+        self.blocks = blocks
+        self.collection = collection
+        self.head = None  # 链头块号, 未知时不记录
+        self.entries: Dict[int, List[dict]] = {}  # 区块 -> 还没写入的记录
+        self.keys: Dict[int, set] = {}  # 区块 -> 已经记录的 (集合全名, 主键)
+        self.hashes: Dict[int, str] = {}
+        self.collections = {}  # 集合全名 -> pymongo 集合, 回滚时使用
+        self.lock = threading.Lock()
+        self.captured = 0
+        self.restored = 0
+        self.rollbacks = 0
+
+    def _collection(self):
+        if self.collection is None:
+            self.collection = JournalBlock._get_collection()
+        return self.collection
+
+    def set_head(self, head: int):
+        self.head = head
+
+    def tracks(self, block_number: int) -> bool:
+        """该区块是否在保留范围内, 需要记录改写前的值"""
+        return self.head is not None and block_number > self.head - self.blocks
+
+    def reset(self):
+        """从头扫描时删除全部记录"""
+        with self.lock:
+            self.entries = {}
+            self.keys = {}
+        self.hashes = {}
+        self._collection().delete_many({})
+
+    def bind(self, block_number: int) -> "_Binding":
+        """`with journal.bind(区块):` 中当前线程取得的文档集合记录改写前的值"""
+        return _Binding(block_number)
+
+    def capture(self, block_number: int, collection, filter):
+        """记录 filter 匹配的文档在该区块中第一次改写前的值"""
+        name = collection.full_name
+        ids = id_list(filter)
+        with self.lock:
+            keys = self.keys.setdefault(block_number, set())
+            # 同一区块中已经记录过的实体不需要再读
+            if ids is not None and all((name, _id) in keys for _id in ids):
+                return
+        docs = list(collection.find(filter))
+        with self.lock:
+            self.collections[name] = collection
+            for doc in docs:
+                self._record(block_number, keys, name, doc["_id"], doc)
+
+    def created(self, block_number: int, collection, ids: list):
+        """记录新插入的文档, 回滚时删除"""
+        name = collection.full_name
+        with self.lock:
+            self.collections[name] = collection
+            keys = self.keys.setdefault(block_number, set())
+            for _id in ids:
+                self._record(block_number, keys, name, _id, None)
+
+    def _record(self, block_number: int, keys: set, name: str, _id, doc: Optional[dict]):
+        if (name, _id) in keys:
+            return
+        keys.add((name, _id))
+        self.entries.setdefault(block_number, []).append({ "c": name, "i": _id, "d": doc })
+        self.captured += 1
+
+    def check(self, blocks: list) -> Optional[int]:
+        """检查保留范围内区块的父哈希与记录的是否一致, 一致时记录这些区块的哈希
+
+        :return: 第一个父哈希不一致的块号, 没有发现重组时为 None
+        """
+        for block in sorted(blocks, key=lambda b: b.number):
+            if not self.tracks(block.number):
+                continue
+            parent = self.get_hash(block.number - 1)
+            if parent is not None and parent != block_hash(block.parentHash):
+                return block.number
+            self.hashes[block.number] = block_hash(block.hash)
+        return None
+
+    def get_hash(self, block_number: int) -> Optional[str]:
+        """记录的区块哈希, 没有时从归档的区块中读取"""
+        if block_number in self.hashes:
+            return self.hashes[block_number]
+        log = BlockLog.objects(blockNumber=block_number).first()
+        if log is None:
+            return None
+        return block_hash(log.get().hash)
+
+    def flush(self):
+        """写入还没保存的记录, 删除超出保留范围的记录"""
+        with self.lock:
+            entries, self.entries = self.entries, {}
+            self.keys = {}
+        collection = self._collection()
+        for block_number in sorted(entries.keys()):
+            update = { "$set": { "hash": self.hashes.get(block_number) }, "$push": { "entities": { "$each": entries[block_number] } } }
+            collection.update_one({ "_id": block_number }, update, upsert=True)
+        if self.head is not None:
+            floor = self.head - self.blocks
+            self.hashes = { n: h for n, h in self.hashes.items() if n > floor }
+            collection.delete_many({ "_id": { "$lte": floor } })
+
+    def rollback(self, fork_block: int) -> int:
+        """恢复 fork_block 之后所有区块中改写过的实体, 返回恢复的实体数"""
+        self.flush()
+        collection = self._collection()
+        restored = 0
+        for journal in sorted(collection.find({ "_id": { "$gt": fork_block } }), key=lambda d: d["_id"], reverse=True):
+            # 同一区块中较早的记录是更早的值, 最后恢复
+            for entity in reversed(journal.get("entities", [])):
+                target = self._resolve(entity["c"])
+                if entity["d"] is None:
+                    target.delete_one({ "_id": entity["i"] })
+                else:
+                    target.replace_one({ "_id": entity["i"] }, entity["d"], upsert=True)
+                restored += 1
+        collection.delete_many({ "_id": { "$gt": fork_block } })
+        self.hashes = { n: h for n, h in self.hashes.items() if n <= fork_block }
+        self.restored += restored
+        self.rollbacks += 1
+        return restored
+
+    def discard(self, block_number: int):
+        """删除 block_number 之后的记录, 这些区块的数据没有提交, 重启后会重新扫描"""
+        self._collection().delete_many({ "_id": { "$gt": block_number } })
+        self.hashes = { n: h for n, h in self.hashes.items() if n <= block_number }
+
+    def _resolve(self, full_name: str):
+        """集合全名对应的 pymongo 集合, 重启后没有用过的集合从记录的客户端取得"""
+        if full_name not in self.collections:
+            db_name, name = full_name.split(".", 1)
+            self.collections[full_name] = self._collection().database.client[db_name][name]
+        return self.collections[full_name]
+
+    def stats(self) -> dict:
+        return { "captured": self.captured, "restored": self.restored, "rollbacks": self.rollbacks, "blocks": len(self.hashes) }
+
+
+class _Binding:
+
+    def __init__(self, block_number: int):
+        self.block_number = block_number
+
+    def __enter__(self):
+        self._previous = getattr(_local, "block", None)
+        _local.block = self.block_number
+        return self
+
+    def __exit__(self, *exc):
+        _local.block = self._previous
+        return False
+
+
+def _journal_get_collection(cls):
+    # chunk 写缓冲没有启用时就是 mongoengine 原来的实现
+    collection = chunk_commit.get_collection(cls)
+    block_number = getattr(_local, "block", None)
+    if _journal is None or block_number is None:
+        return collection
+    return JournalCollection(_journal, collection, block_number)
+
+
+def install(journal: ReorgJournal):
+    """让 mongoengine 文档在 `bind` 的区块中记录改写前的值
+
+    实体视图提交时也经过这里取得的集合, 与 `entity_view.install` 的先后顺序无关。
+    """
+    global _journal
+    _journal = journal
+    entity_view.set_collection_base(_journal_get_collection)
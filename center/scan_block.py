@@ -9,9 +9,26 @@ from center.events import Events
 from center.database.block import BlockLog
 from tqdm import tqdm
 import datetime
-from center.block_scanner import BlockScanner
+from center.block_scanner import BlockScanner, SCAN_MODE_FULL
+from center.batch_rpc import BatchRpc
+from center.receipt_strategy import ReceiptStrategy, STRATEGY_AUTO
+from center.rate_controller import RateController
+from center.provider_pool import ProviderPool
+from center.hedge import Hedge
+from center.http_session import SessionPool, PooledHTTPProvider
+from center.realtime import HeadTracker
+from center.deploy_discovery import DeployDiscovery
+from center.backfill import Backfill
+from center.decode_pool import DecodePool
+from center.parallel_apply import ParallelApply
+from center.writer import BackgroundWriter
 from aiohttp import ClientResponseError
 
+REQUEST_HEADERS = {
+    'Content-Type': 'application/json',
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/107.0.0.0 Safari/537.36',
+}
+
 
 def print_log(msg):
     print(f"\033[1;31;47m\t[{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())}] {msg}\033[0m")
@@ -35,24 +52,117 @@ class ScanBlock:
         self.init_mode = mode
         self.api_index = 0
         self.last_switch_provider_timestamp = None
+        self._init_sessions()
         self._init_web3()
+        self._init_provider_pool()
+        self._init_rate_controller()
+        self._init_batch_rpc()
+        self.receipt_strategy = ReceiptStrategy(self.config['chain_api'],
+                                                mode=self.config.get('receipt_strategy', STRATEGY_AUTO),
+                                                headers=REQUEST_HEADERS,
+                                                logger=self.logger,
+                                                sessions=self.sessions)
         self.monitor = DiscordBot(self.public_config['discord'], self.logger)
         self.events = Events(self.web3, self.logger)
         self.state = ScannerState(config, self.events, logger=self.logger)
         self._init_scanner()
+        self._init_head_tracker()
+
+    def _init_sessions(self):
+        """所有 JSON-RPC 调用共用的连接池, 每个节点一个"""
+        self.sessions = SessionPool(limit=self.config.get('http_pool_size', 100),
+                                    keepalive_timeout=self.config.get('http_keepalive_sec', 30),
+                                    ttl_dns_cache=self.config.get('http_dns_cache_sec', 300),
+                                    timeout=self.config.get('http_timeout_sec', 60),
+                                    connect_timeout=self.config.get('http_connect_timeout_sec', 10))
+        self._web3s = {}
+
+    def _create_web3(self, endpoint_uri: str) -> AsyncWeb3:
+        """每个节点只创建一次 web3 对象, 切换节点时复用"""
+        if endpoint_uri not in self._web3s:
+            provider = PooledHTTPProvider(endpoint_uri, self.sessions, request_kwargs={ 'headers': REQUEST_HEADERS })
+            provider.middlewares.clear()
+            web3 = AsyncWeb3(provider)
+            web3.middleware_onion.inject(async_geth_poa_middleware, layer=0)
+            self._web3s[endpoint_uri] = web3
+        return self._web3s[endpoint_uri]
 
     def _init_web3(self):
-        self.provider = AsyncWeb3.AsyncHTTPProvider(
-            self.config['chain_api'][self.api_index],
-            request_kwargs={
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/107.0.0.0 Safari/537.36',
-                }
-            })
-        self.provider.middlewares.clear()
-        self.web3 = AsyncWeb3(self.provider)
-        self.web3.middleware_onion.inject(async_geth_poa_middleware, layer=0)
+        self.web3 = self._create_web3(self.config['chain_api'][self.api_index])
+        self.provider = self.web3.provider
+
+    def _create_rate_controller(self) -> RateController:
+        """adaptive_rate 为 true 时由 AIMD 控制器决定 JSON-RPC 并发数与速率"""
+        if not self.config.get('adaptive_rate', False):
+            return None
+        initial_concurrency = self.config['max_chunk_scan_size']
+        return RateController(initial_concurrency=initial_concurrency,
+                              max_concurrency=self.config.get('max_concurrency', 200),
+                              initial_rate=initial_concurrency / max(self.config['request_interval_sec'], 0.01),
+                              max_rate=self.config.get('max_request_rate', 1000),
+                              target_latency=self.config.get('target_latency_sec', 2.0))
+
+    def _init_rate_controller(self):
+        # 节点池中每个节点有自己的速率控制器
+        self.rate_controller = None
+        if self.provider_pool is None:
+            self.rate_controller = self._create_rate_controller()
+
+    def _init_provider_pool(self):
+        """provider_pool 为 true 且配置了多个节点时同时使用所有节点"""
+        self.provider_pool = None
+        if self.config.get('provider_pool', False) and len(self.config['chain_api']) > 1:
+            self.provider_pool = ProviderPool(self.config['chain_api'],
+                                              web3_factory=self._create_web3,
+                                              rate_controller_factory=self._create_rate_controller,
+                                              max_failures=self.config.get('provider_max_failures', 5),
+                                              eject_seconds=self.config.get('provider_eject_seconds', 30),
+                                              logger=self.logger)
+
+    def _init_batch_rpc(self):
+        """rpc_batch_size 大于 0 时使用 JSON-RPC 批量请求获取区块与收据"""
+        self.batch_rpc = None
+        batch_size = self.config.get('rpc_batch_size', 0)
+        if batch_size > 0:
+            self.batch_rpc = BatchRpc(self.config['chain_api'][self.api_index],
+                                      batch_size=batch_size,
+                                      max_retries=self.config.get('max_request_retries', 3),
+                                      retry_seconds=self.config['request_retry_seconds'],
+                                      headers=REQUEST_HEADERS,
+                                      logger=self.logger,
+                                      throttled_handle=self.switch_provider,
+                                      rate_controller=self.rate_controller,
+                                      provider_pool=self.provider_pool,
+                                      sessions=self.sessions,
+                                      hedge=self._create_hedge())
+
+    def _create_hedge(self) -> Hedge:
+        """hedge_percentile 大于 0 时对慢的区块/收据请求发送对冲请求"""
+        percentile = self.config.get('hedge_percentile', 0)
+        if percentile <= 0:
+            return None
+        return Hedge(percentile=percentile, min_samples=self.config.get('hedge_min_samples', 20))
+
+    def _create_decode_pool(self) -> DecodePool:
+        """decode_workers 大于 0 时在子进程中解码事件日志"""
+        workers = self.config.get('decode_workers', 0)
+        if workers <= 0:
+            return None
+        return DecodePool(self.events.decoders, max_workers=workers, batch_size=self.config.get('decode_batch_size', 500))
+
+    def _create_parallel_apply(self) -> ParallelApply:
+        """parallel_handlers 大于 1 时乐观并行执行事件处理器"""
+        workers = self.config.get('parallel_handlers', 0)
+        if workers <= 1:
+            return None
+        return ParallelApply(self.state, workers=workers, logger=self.logger)
+
+    def _create_writer(self) -> BackgroundWriter:
+        """write_queue_size 大于 0 时区块与收据归档和事件处理器都不在事件循环中执行"""
+        max_pending = self.config.get('write_queue_size', 0)
+        if max_pending <= 0:
+            return None
+        return BackgroundWriter(max_pending=max_pending, logger=self.logger)
 
     def _init_scanner(self):
         self.scanner = BlockScanner(
@@ -61,21 +171,58 @@ class ScanBlock:
             state=self.state,
             events=self.events,
             switch_provider_handle=self.switch_provider,
+            batch_rpc=self.batch_rpc,
+            receipt_strategy=self.receipt_strategy,
+            bloom_filter=self.config.get('bloom_filter', True),
+            scan_mode=self.config.get('scan_mode', SCAN_MODE_FULL),
+            max_request_retries=self.config.get('max_request_retries', 30),
+            rate_controller=self.rate_controller,
+            provider_pool=self.provider_pool,
+            hedge=self._create_hedge(),
+            raw_records=self.config.get('raw_records', False),
+            pipeline_depth=self.config.get('pipeline_depth', 0),
+            decode_pool=self._create_decode_pool(),
+            parallel_apply=self._create_parallel_apply(),
+            writer=self._create_writer(),
+            max_reorg_depth=self.config.get('reorg_journal_blocks', 0),
             contracts=self.public_config['contracts'],
             request_interval_sec=self.config['request_interval_sec'],
             request_retry_seconds=self.config['request_retry_seconds'],
             # 从 JSON-RPC 请求时的最大块数，并且我们不太可能超过 JSON-RPC 服务器的响应大小限制
             max_chunk_scan_size=self.config['max_chunk_scan_size'])
 
+    def _create_backfill(self, blocks_to_scan: int) -> Backfill:
+        """backfill_workers 大于 1 且待扫描的区块超过一个分片时并行下载多个分片"""
+        workers = self.config.get('backfill_workers', 0)
+        shard_size = self.config.get('backfill_shard_size', self.config['max_chunk_scan_size'])
+        if workers <= 1 or blocks_to_scan <= shard_size:
+            return None
+        return Backfill(self.scanner, shard_size=shard_size, workers=workers, logger=self.logger)
+
+    def _init_head_tracker(self):
+        """配置了 ws_api 时实时同步订阅 newHeads, 否则按 realtime_scan_interval_sec 轮询"""
+        self.head_tracker = None
+        if self.config.get('ws_api'):
+            self.head_tracker = HeadTracker(self.config['ws_api'],
+                                            poll=lambda: self.scanner.get_suggested_scan_end_block(0),
+                                            block_time=self.config.get('block_time_sec', 3.0),
+                                            reconnect_seconds=self.config.get('ws_reconnect_sec', 5.0),
+                                            logger=self.logger)
+
     def Stop(self):
         if self.scanner:
             self.scanner.stop()
+        if self.head_tracker:
+            self.head_tracker.stop()
         self.RUN_SYNC = False
         print_log("Stopping the sync service...")
 
     def switch_provider(self):
         """自动切换api
         """
+        # 节点池在请求时已经记录 429 并剔除对应节点
+        if self.provider_pool:
+            return
         now = int(time.time())
         if self.last_switch_provider_timestamp is None or now - self.last_switch_provider_timestamp > 2:
             self.last_switch_provider_timestamp = now
@@ -88,17 +235,27 @@ class ScanBlock:
             self._init_web3()
             self.events.web3 = self.web3
             self.scanner.web3 = self.web3
+            if self.batch_rpc:
+                self.batch_rpc.set_endpoint(self.config['chain_api'][self.api_index])
             self.post_msg(f"⚠️ API has been switched: {self.config['chain_api'][self.api_index]}")
 
     def post_msg(self, msg):
         self.monitor.push_message(msg)
 
-    async def scan(self):
+    async def scan(self, head: int = None):
+        """扫描到最新的安全块
+
+        :param head: 已知的链头块号, 为空时向节点查询
+        """
         chain_reorg_safety_blocks = self.config['chain_reorg_safety_blocks']
         # 假定所有已扫的块都是安全块，这里不在清除数据
         # self.scanner.delete_potentially_forked_block_data(self.state.get_last_scanned_block() - chain_reorg_safety_blocks)
         start_block = self.state.get_last_scanned_block() + 1
-        end_block = await self.scanner.get_suggested_scan_end_block(chain_reorg_safety_blocks)
+        if head is None:
+            end_block = await self.scanner.get_suggested_scan_end_block(chain_reorg_safety_blocks)
+        else:
+            end_block = head - chain_reorg_safety_blocks
+        self.state.set_chain_head(end_block + chain_reorg_safety_blocks)
         blocks_to_scan = end_block - start_block + 1
         if blocks_to_scan < 1:
             self.logger.warning(f"Waiting for JSON-RPC API new block to sync {start_block}")
@@ -120,11 +277,37 @@ class ScanBlock:
                 progress_bar.update(chunk_size)
 
             # 运行扫描
-            processed_count, total_chunks_scanned = await self.scanner.scan(start_block, end_block, progress_callback=_update_progress)
+            backfill = self._create_backfill(blocks_to_scan)
+            if backfill:
+                processed_count, total_chunks_scanned = await backfill.run(start_block, end_block, progress_callback=_update_progress)
+            else:
+                processed_count, total_chunks_scanned = await self.scanner.scan(start_block, end_block, progress_callback=_update_progress)
 
         self.state.save()
         duration = time.time() - start
         print_log(f"Scanned total {processed_count} events, in {duration} seconds, total {min(blocks_to_scan, total_chunks_scanned)} chunk scans performed")
+        stats = self.scanner.stats()
+        if len(stats) > 0:
+            self.logger.debug(f"Scanner stats: {stats}")
+
+    async def discover_deploy_blocks(self):
+        """deploy_discovery 为 true 时查找配置中每个合约的部署区块, 全量扫描从最早的部署区块开始"""
+        if not self.config.get('deploy_discovery', False) or self.state.has_deploy_blocks():
+            return
+        head = await self.scanner.get_suggested_scan_end_block(0)
+        low = self.state.get_last_scanned_block() + 1
+        if head <= low:
+            return
+
+        async def get_code(address, block_number):
+            web3, slot = self.scanner.select_web3()
+            async with slot:
+                return await web3.eth.get_code(address, block_identifier=block_number)
+
+        discovery = DeployDiscovery(get_code, logger=self.logger)
+        blocks = await discovery.discover(self.public_config['contracts'], low, head)
+        self.state.set_deploy_blocks(blocks)
+        print_log(f"Contract deployment blocks: {blocks}, scanning from {self.state.get_last_scanned_block() + 1}")
 
     async def database_scan(self):
         blocks_to_scan = BlockLog.getLogCount()
@@ -151,12 +334,14 @@ class ScanBlock:
         """从配置的块开始在链上扫描
         """
         self.IS_CONTINUOUS = True
+        await self.receipt_strategy.probe()
         if clean:
             self.state.reset()
             self.state.cleanCache()  #清除状态缓存
             self.state.dropData()  #删除数据
             self.state.dropLogs()  #删除日志
         try:
+            await self.discover_deploy_blocks()
             await self.scan()
         except ClientResponseError as e:
             if e.status == 429:
@@ -186,21 +371,45 @@ class ScanBlock:
         try:
             if False == self.IS_CONTINUOUS:
                 self.state.restore()
+            await self.receipt_strategy.probe()
+            if self.head_tracker:
+                await self.head_tracker.start()
             while (self.RUN_SYNC):
-                await self.scan()
-                await asyncio.sleep(self.config['realtime_scan_interval_sec'])
+                if self.head_tracker is None:
+                    await self.scan()
+                    await asyncio.sleep(self.config['realtime_scan_interval_sec'])
+                    continue
+                await self.scan(self.head_tracker.head)
+                # 等到下一个安全块出现
+                await self.head_tracker.wait_for(self.state.get_last_scanned_block() + 1 + self.config['chain_reorg_safety_blocks'])
         except Exception as e:
             msg = f"increment scan error: {e}"
             self.logger.exception(msg)
             self.post_msg(msg)
 
+    async def run(self):
+        try:
+            if self.init_mode == 0:
+                print_log("init data...")
+                await self.init_sync_scan()
+            elif self.init_mode == 1:
+                print_log("init data from database...")
+                await self.init_database_scan()
+            print_log("init data complete.")
+            print_log("Start incremental sync...")
+            await self.increment_sync_scan()
+        finally:
+            if self.head_tracker:
+                self.head_tracker.stop()
+            if self.scanner.decode_pool:
+                self.scanner.decode_pool.close()
+            if self.scanner.parallel_apply:
+                self.scanner.parallel_apply.close()
+            if self.scanner.writer:
+                await self.scanner.writer.flush()
+                self.scanner.writer.close()
+            await self.sessions.close()
+
     def Run(self):
-        if self.init_mode == 0:
-            print_log("init data...")
-            asyncio.run(self.init_sync_scan())
-        elif self.init_mode == 1:
-            print_log("init data from database...")
-            asyncio.run(self.init_database_scan())
-        print_log("init data complete.")
-        print_log("Start incremental sync...")
-        asyncio.run(self.increment_sync_scan())
+        # 全程使用同一个事件循环, 连接池中的连接才能一直复用
+        asyncio.run(self.run())
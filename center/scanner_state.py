@@ -1,13 +1,18 @@
 import json
 import os
 import time
+from contextlib import ExitStack
 from typing import Callable, List, Optional
 from center.base_scanner_state import BaseScannerState
 import mongoengine
 from center.events import Events
 from center.logger import Logger
 from center.database.logs import delLogsByBlock
-from center.database.block import BlockLog, EventInfo
+from center.database.block import BlockLog, EventInfo, ReceiptLog
+from center.address_registry import AddressRegistry
+from center import chunk_commit, reorg_journal
+from center.chunk_commit import ChunkBuffer, ChunkLog
+from center.reorg_journal import ReorgJournal
 from web3.types import TxData
 
 
@@ -27,6 +32,20 @@ class ScannerState(BaseScannerState):
         self.db_config = config['mongo']
         self.contracts_config = config['contracts']
         self._init_db()
+        # 跟踪的合约地址, 动态添加的地址保存在数据库中
+        self.registry = AddressRegistry()
+        # 离链头 reorg_journal_blocks 个区块以内记录事件处理器改写前的值, 发生链重组时回滚
+        self.journal = None
+        journal_blocks = self.config.get('reorg_journal_blocks', 0)
+        if journal_blocks > 0:
+            self.journal = ReorgJournal(journal_blocks)
+            reorg_journal.install(self.journal)
+        # 事件处理器的写入缓冲到 chunk 结束, 与扫描进度一起提交, 崩溃后从最后提交的区块继续
+        self.chunk_buffer = None
+        if self.config.get('atomic_chunks', False):
+            # 严格模式下事件处理器使用缓冲不支持的数据库操作时停止扫描
+            self.chunk_buffer = ChunkBuffer(ChunkLog(), logger, strict=self.config.get('atomic_chunks_strict', True))
+            chunk_commit.install(self.chunk_buffer)
 
     def _init_db(self):
         """连接mongoengine"""
@@ -35,23 +54,43 @@ class ScannerState(BaseScannerState):
 
     def reset(self):
         """重设无扫描的初始状态"""
-        addr = {}
-        for k, v in self.contracts_config.items():
-            addr[k] = [v]
-        self.state = { "last_scanned_block": self.config['start_block'] - 1, "address": addr }
+        self.state = { "last_scanned_block": self.config['start_block'] - 1 }
+        self.registry.reset(self.contracts_config)
+        if self.journal:
+            self.journal.reset()
+        if self.chunk_buffer:
+            self.chunk_buffer.reset()
         # self.state = {"last_scanned_block": 0}
 
     def restore(self):
-        """从文件恢复上次扫描状态"""
+        """从文件恢复上次扫描状态, 启用 atomic_chunks 时以数据库中最后提交的区块为准"""
+        committed = self.chunk_buffer.log.recover() if self.chunk_buffer else None
         try:
             self.state = json.load(open(self.cache_file, "rt"))
-            self.logger.warning(f"Restored the state, previously {self.state['last_scanned_block']} blocks have been scanned")
         except (IOError, json.decoder.JSONDecodeError):
-            self.logger.exception("State starting from scratch")
-            self.reset()
+            if committed is None:
+                self.logger.exception("State starting from scratch")
+                self.reset()
+                return
+            # 状态文件丢失时从数据库中的扫描进度继续
+            self.state = {}
+        if committed is not None:
+            self.state['last_scanned_block'] = committed
+            # 之后的区块没有提交, 会重新扫描, 它们的链重组记录作废
+            if self.journal:
+                self.journal.discard(committed)
+        self.registry.load(self.contracts_config, self.state['last_scanned_block'])
+        # 旧版本的状态文件中保存了地址列表
+        for contract, adds in self.state.pop('address', {}).items():
+            for address in adds:
+                self.registry.add(contract, address, self.state['last_scanned_block'])
+        self.logger.warning(f"Restored the state, previously {self.state['last_scanned_block']} blocks have been scanned")
 
     def save(self):
         """将到目前为止扫描的状态保存在缓存文件中"""
+        self.registry.flush()
+        if self.journal:
+            self.journal.flush()
         with open(self.cache_file, "wt") as f:
             json.dump(self.state, f)
         self.last_save = time.time()
@@ -78,39 +117,92 @@ class ScannerState(BaseScannerState):
     # 下面实现的 EventScannerState 方法
     #
 
-    def add_address(self, contract: str, address: str = None):
-        """添加新的要跟踪的合约地址"""
-        # TODO: 可以保存到数据中
+    def add_address(self, contract: str, address: str = None, block_number: int = 0) -> bool:
+        """添加新的要跟踪的合约地址, chunk 结束时写入数据库"""
         if contract and address:
-            if contract not in self.state['address'].keys():
-                self.state['address'][contract] = [address]
-            else:
-                self.state['address'][contract].append(address)
-                self.state['address'][contract] = list(set(self.state['address'][contract]))
-            self.save()
+            return self.registry.add(contract, address, block_number)
+        return False
 
     def get_address(self, contract: str):
         """返回动态跟踪的合约地址"""
-        if contract not in self.state['address'].keys():
-            return []
-        return list(self.state['address'][contract])
+        return self.registry.get(contract)
+
+    def has_address(self, contract: str, address: str) -> bool:
+        return self.registry.has(contract, address)
+
+    def subscribe_address(self, listener: Callable):
+        self.registry.subscribe(listener)
+
+    def set_deploy_blocks(self, blocks: dict):
+        """记录各合约的部署区块, 还没有扫描到任何合约的部署区块时直接从最早的部署区块开始"""
+        self.state['deploy_block'] = blocks
+        if len(blocks) > 0:
+            self.state['last_scanned_block'] = max(self.state['last_scanned_block'], min(blocks.values()) - 1)
+        self.save()
+
+    def get_address_version(self) -> int:
+        return self.registry.version
+
+    def get_deploy_block(self, contract: str) -> int:
+        return self.state.get('deploy_block', {}).get(contract, 0)
+
+    def has_deploy_blocks(self) -> bool:
+        return 'deploy_block' in self.state
 
     def get_last_scanned_block(self):
         """存储的最后一个块的编号"""
         return self.state["last_scanned_block"]
 
     def delete_data(self, since_block):
-        """从扫描数据中删除可能重组的块"""
-        # 通过事件状态更新数据库
-        pass
+        """链重组后回滚到 since_block: 恢复之后的区块中事件处理器改写过的实体,
+        删除之后发现的跟踪地址与归档的区块和收据, 从 since_block 之后重新扫描
+
+        :return: 恢复的实体数
+        """
+        if self.chunk_buffer:
+            # 还没提交的写入先写入数据库, 由链重组日志一起恢复
+            self.chunk_buffer.flush()
+        restored = self.journal.rollback(since_block) if self.journal else 0
+        self.registry.rollback(since_block)
+        BlockLog.delLogsByBlock(since_block)
+        ReceiptLog.delLogsByBlock(since_block)
+        self.state["last_scanned_block"] = min(self.state["last_scanned_block"], since_block)
+        if self.chunk_buffer:
+            self.chunk_buffer.rewind(self.state["last_scanned_block"])
+        self.save()
+        return restored
+
+    def set_chain_head(self, head: int):
+        if self.journal:
+            self.journal.set_head(head)
+
+    def may_reorg(self, block_number: int) -> bool:
+        return self.journal is not None and self.journal.tracks(block_number)
+
+    def check_blocks(self, blocks: list):
+        if self.journal:
+            return self.journal.check(blocks)
+        return None
+
+    def get_block_hash(self, block_number: int):
+        if self.journal:
+            return self.journal.get_hash(block_number)
+        return None
 
     def start_chunk(self, block_number):
-        pass
+        if self.chunk_buffer:
+            self.chunk_buffer.begin(block_number)
 
     def end_chunk(self, block_number):
         """保存在每个块的末尾，这样可以在崩溃或 CTRL+C 的情况下恢复"""
         # 下次启动扫描时，将从该块恢复
         self.state["last_scanned_block"] = block_number
+        self.registry.flush()
+        if self.journal:
+            self.journal.flush()
+        # 提交点, 之前的写入都可以在重启后重做或丢弃
+        if self.chunk_buffer:
+            self.chunk_buffer.commit(block_number)
 
         # 每分钟保存一次缓存文件
         if time.time() - self.last_save > 60:
@@ -135,5 +227,10 @@ class ScannerState(BaseScannerState):
                     new_contract_address(contract_name, contract_address)
             return False  # 如果返回True将不会调用handle
 
-        # 调用事件处理器插件处理
-        self.events.callHandle(eventLog, contracts, check_create_contract)
+        # 调用事件处理器插件处理, 写入经过 chunk 缓冲, 可能重组的区块中记录改写前的值
+        with ExitStack() as stack:
+            if self.chunk_buffer:
+                stack.enter_context(self.chunk_buffer.bind())
+            if self.journal and self.journal.tracks(eventLog.blockNumber):
+                stack.enter_context(self.journal.bind(eventLog.blockNumber))
+            self.events.callHandle(eventLog, contracts, check_create_contract)
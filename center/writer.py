@@ -0,0 +1,104 @@
+import asyncio
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+from center.logger import Logger
+
+
+class BackgroundWriter:
+    """在专用线程中执行阻塞的数据库写入。
+
+    区块与收据归档这类写入不需要等待结果, `submit` 提交到写入线程后立即返回, 事件循环中的下载任务不会被数据库阻塞;
+    同时未完成的写入数超过 `max_pending` 时 `submit` 会等待, 数据库跟不上时反压到下载。
+    写入线程只有一个, 写入按提交顺序执行。检查点之前调用 `flush` 等待所有写入完成, 失败的写入在 `flush` 中重试,
+    重试后仍然失败时抛出异常, 保存的进度不会超过已归档的数据。提交的写入应当可以重复执行。
+    """
+
+    def __init__(self, max_pending: int = 1000, max_retries: int = 3, logger: Logger = None):
+        """
+        :param max_pending: 同时未完成的写入数上限
+        :param max_retries: `flush` 中失败写入的重试次数
+        :param logger: 日志对象
+        """
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.logger = logger
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="writer")
+        self.pending = set()
+        self.failed = []  # 失败的 (fn, args), 按完成顺序
+        self.slots: asyncio.Semaphore = None
+        self.submitted = 0
+        self.errors = 0
+        self.max_queue = 0
+        self.blocked = 0.0
+
+    def _slots(self) -> asyncio.Semaphore:
+        # 信号量要在事件循环中创建
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_pending)
+        return self.slots
+
+    def _done(self, future: Future, loop: asyncio.AbstractEventLoop, fn: Callable, args: tuple):
+        if future.exception() is not None:
+            self.errors += 1
+            self.failed.append((fn, args))
+            if self.logger:
+                self.logger.error(f"background write error: {future.exception()}")
+        loop.call_soon_threadsafe(self._release, future)
+
+    def _release(self, future: Future):
+        self.pending.discard(future)
+        self.slots.release()
+
+    async def submit(self, fn: Callable, *args):
+        """提交一次写入, 不等待写入完成"""
+        slots = self._slots()
+        if slots.locked():
+            start = time.time()
+            await slots.acquire()
+            self.blocked += time.time() - start
+        else:
+            await slots.acquire()
+        loop = asyncio.get_running_loop()
+        future = self.executor.submit(fn, *args)
+        self.pending.add(future)
+        self.submitted += 1
+        self.max_queue = max(self.max_queue, len(self.pending))
+        future.add_done_callback(lambda f: self._done(f, loop, fn, args))
+
+    async def run(self, fn: Callable, *args):
+        """在写入线程中执行并等待结果, 排在已提交的写入之后"""
+        return await asyncio.wrap_future(self.executor.submit(fn, *args))
+
+    async def flush(self):
+        """等待已提交的写入全部完成, 重试失败的写入, 重试后仍然失败时抛出最后的异常"""
+        while len(self.pending) > 0:
+            await asyncio.gather(*[asyncio.wrap_future(f) for f in list(self.pending)], return_exceptions=True)
+            # 完成回调通过 call_soon_threadsafe 执行, 让它先从 pending 中移除
+            await asyncio.sleep(0)
+        while len(self.failed) > 0:
+            fn, args = self.failed[0]
+            for retries in range(self.max_retries + 1):
+                try:
+                    await self.run(fn, *args)
+                    break
+                except Exception as e:
+                    if retries >= self.max_retries:
+                        # 留在 failed 中, 下次 flush 继续重试
+                        raise
+                    if self.logger:
+                        self.logger.warning(f"background write retry {retries + 1}: {e}")
+            self.failed.pop(0)
+
+    def stats(self) -> dict:
+        return {
+            "submitted": self.submitted,
+            "pending": len(self.pending),
+            "max_queue": self.max_queue,
+            "errors": self.errors,
+            "failed": len(self.failed),
+            "blocked_sec": round(self.blocked, 3),
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=True)
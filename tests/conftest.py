@@ -0,0 +1,110 @@
+import copy
+import time
+from types import SimpleNamespace
+from pymongo import DeleteOne, InsertOne, ReplaceOne
+from center.database.entity_view import apply_update
+
+
+def _match(doc, filter):
+    for key, cond in filter.items():
+        value = doc.get(key)
+        if isinstance(cond, dict):
+            if "$in" in cond and value not in cond["$in"]:
+                return False
+            if "$gt" in cond and not value > cond["$gt"]:
+                return False
+            if "$lte" in cond and not value <= cond["$lte"]:
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+class FakeCollection(object):
+    """内存中的集合, 只实现测试用到的 pymongo 方法
+
+        writes 统计写入的文档数, finds 统计查询次数;
+        fail 为 True 时 bulk_write 抛出 ConnectionError, 模拟写入时崩溃;
+        latency 为每次查询的等待秒数, 模拟数据库往返
+    """
+
+    def __init__(self, name="test"):
+        self.name = name
+        self.full_name = "test." + name
+        self.database = self.codec_options = self.read_preference = self.read_concern = self.write_concern = None
+        self.docs = {}
+        self.writes = 0
+        self.finds = 0
+        self.fail = False
+        self.latency = 0
+
+    def find(self, filter=None, projection=None):
+        self.finds += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [copy.deepcopy(d) for d in self.docs.values() if _match(d, filter or {})]
+
+    def find_one(self, filter):
+        docs = self.find(filter)
+        return docs[0] if len(docs) > 0 else None
+
+    def count_documents(self, filter):
+        return len([d for d in self.docs.values() if _match(d, filter)])
+
+    def insert_one(self, document):
+        assert document["_id"] not in self.docs
+        self.writes += 1
+        self.docs[document["_id"]] = copy.deepcopy(document)
+        return SimpleNamespace(inserted_id=document["_id"])
+
+    def insert_many(self, documents, ordered=True):
+        for document in documents:
+            self.writes += 1
+            _id = document.get("_id", len(self.docs))
+            self.docs[_id] = copy.deepcopy(dict(document, _id=_id))
+
+    def update_one(self, filter, update, upsert=False, array_filters=None):
+        self.writes += 1
+        for doc in self.docs.values():
+            if _match(doc, filter):
+                apply_update(doc, update)
+                return SimpleNamespace(upserted_id=None)
+        if not upsert:
+            return SimpleNamespace(upserted_id=None)
+        doc = self.docs[filter["_id"]] = { "_id": filter["_id"] }
+        apply_update(doc, update)
+        return SimpleNamespace(upserted_id=filter["_id"])
+
+    def update_many(self, filter, update):
+        for doc in self.docs.values():
+            if _match(doc, filter):
+                self.writes += 1
+                apply_update(doc, update)
+
+    def replace_one(self, filter, replacement, upsert=False):
+        self.writes += 1
+        self.docs[filter["_id"]] = copy.deepcopy(dict(replacement, _id=filter["_id"]))
+
+    def delete_one(self, filter):
+        self.docs.pop(filter["_id"], None)
+
+    def delete_many(self, filter):
+        self.docs = { k: d for k, d in self.docs.items() if not _match(d, filter) }
+
+    def bulk_write(self, requests, ordered=True):
+        if self.fail:
+            raise ConnectionError("crash")
+        upserted = {}
+        for i, request in enumerate(requests):
+            if isinstance(request, InsertOne):
+                self.insert_one(request._doc)
+            elif isinstance(request, ReplaceOne):
+                self.replace_one(request._filter, request._doc, upsert=request._upsert)
+            elif isinstance(request, DeleteOne):
+                self.writes += 1
+                self.delete_one(request._filter)
+            else:
+                result = self.update_one(request._filter, request._doc, upsert=request._upsert)
+                if result.upserted_id is not None:
+                    upserted[i] = result.upserted_id
+        return SimpleNamespace(acknowledged=True, upserted_ids=upserted)
@@ -0,0 +1,52 @@
+from center.address_registry import AddressRegistry
+from conftest import FakeCollection
+
+FACTORY = "0x" + "11"*20
+CHILD = "0x" + "22"*20
+LATE = "0x" + "33"*20
+
+
+class TestAddressRegistry(object):
+
+    def test_add_and_persist(self):
+        collection = FakeCollection()
+        registry = AddressRegistry(collection)
+        notified = []
+        registry.subscribe(lambda contract, address, version: notified.append((contract, address, version)))
+        registry.reset({ "Factory": FACTORY, "Pair": None })
+        version = registry.version
+        assert registry.get("Factory") == [FACTORY] and registry.get("Pair") == []
+
+        assert registry.add("Pair", CHILD, 100)
+        assert not registry.add("Pair", CHILD, 101) and not registry.add("Factory", FACTORY)
+        assert registry.has("Pair", CHILD) and not registry.has("Factory", CHILD)
+        assert notified == [("Pair", CHILD, version + 1)] and registry.version == version + 1
+        # chunk 结束时才批量写入, 固定地址不保存
+        assert collection.docs == {}
+        registry.add("Pair", LATE, 120)
+        registry.flush()
+        registry.flush()
+        # 每个地址只写入一次
+        assert collection.writes == 2 and sorted(d["address"] for d in collection.docs.values()) == [CHILD, LATE]
+
+        # 恢复时丢弃扫描进度之后发现的地址
+        restored = AddressRegistry(collection)
+        restored.load({ "Factory": FACTORY }, 110)
+        assert restored.get("Pair") == [CHILD] and restored.addresses["Pair"][CHILD] == 100
+        assert list(collection.docs) == [f"Pair-{CHILD}"]
+        restored.reset({ "Factory": FACTORY })
+        assert collection.docs == {} and restored.stats() == { "contracts": 1, "addresses": 1, "pending": 0 }
+
+    def test_rollback(self):
+        collection = FakeCollection()
+        registry = AddressRegistry(collection)
+        registry.reset({ "Factory": FACTORY })
+        registry.add("Pair", CHILD, 100)
+        registry.flush()
+        registry.add("Pair", LATE, 120)
+        version = registry.version
+        # 链重组回滚时删除分叉点之后发现的地址, 包括还没写入的
+        registry.rollback(110)
+        assert registry.get("Pair") == [CHILD] and registry.get("Factory") == [FACTORY]
+        assert registry.pending == [] and registry.version == version + 1
+        assert list(collection.docs) == [f"Pair-{CHILD}"]
@@ -0,0 +1,117 @@
+import asyncio
+import random
+from center.backfill import Backfill
+from center.block_scanner import ScanChunk
+
+
+class FakeState(object):
+
+    def __init__(self):
+        self.version = 0
+        self.applied = []
+        self.last = None
+
+    def get_address_version(self):
+        return self.version
+
+    def start_chunk(self, block_number):
+        pass
+
+    def end_chunk(self, block_number):
+        self.last = block_number
+
+    def process_event(self, event, contracts=None, new_contract_address=None):
+        self.applied.append(event)
+        # 第 25 块的事件添加了新的跟踪地址
+        if event == 25:
+            self.version += 1
+
+
+class FakeScanner(object):
+
+    def __init__(self):
+        self.state = FakeState()
+        self.contracts = {}
+        self.adaptive_rate = True
+        self.provider_pool = None
+        self.IS_RUN = False
+        self.fetched = []
+        self.forked = None  # 应用到该分片时发现链重组, 分叉点为它的前一个区块
+        self.rolled_back = []
+        self.scanned = []
+
+    async def fetch_chunk(self, start, end):
+        self.fetched.append((start, end, self.state.version))
+        await asyncio.sleep(random.random() * 0.01)
+        chunk = ScanChunk(start, end)
+        chunk.block_timestamp = end
+        chunk.events = list(range(start, end + 1))
+        return chunk
+
+    async def check_reorg(self, chunk):
+        if chunk.start == self.forked:
+            self.forked = None
+            return chunk.start - 1
+        return None
+
+    async def rollback(self, fork):
+        self.rolled_back.append(fork)
+        self.state.applied = [e for e in self.state.applied if e <= fork]
+
+    async def scan(self, start, end, progress_callback=None):
+        self.scanned.append((start, end))
+        self.state.applied += list(range(start, end + 1))
+        return end - start + 1, 1
+
+    async def apply_events(self, events, chunk=None):
+        for event in events:
+            self.state.process_event(event, self.contracts, self.new_dynamic_address)
+        return len(events)
+
+    async def end_chunk(self, block_number):
+        self.state.end_chunk(block_number)
+
+    def new_dynamic_address(self, contract, address):
+        pass
+
+
+class TestBackfill(object):
+
+    def test_ordered_apply(self):
+        scanner = FakeScanner()
+        backfill = Backfill(scanner, shard_size=10, workers=4)
+        processed, shards = asyncio.run(backfill.run(1, 95))
+        assert (processed, shards) == (95, 10)
+        assert scanner.state.applied == list(range(1, 96))
+        assert scanner.state.last == 95
+        # 新地址出现前已经下载的后续分片按新的地址集合重新获取
+        assert backfill.refetched > 0
+        latest = { start: version for start, _, version in scanner.fetched }
+        assert all(version == 1 for start, version in latest.items() if start > 30)
+
+    def test_reorg(self):
+        scanner = FakeScanner()
+        scanner.forked = 51
+        processed, _ = asyncio.run(Backfill(scanner, shard_size=10, workers=4).run(1, 95))
+        # 回滚到分叉点后从分叉点之后逐个 chunk 扫描, 之后已下载的分片不再应用
+        assert scanner.rolled_back == [50] and scanner.scanned == [(51, 95)]
+        assert scanner.state.applied == list(range(1, 96)) and processed == 95
+
+    def test_fetch_error(self):
+        scanner = FakeScanner()
+        fetch_chunk = scanner.fetch_chunk
+
+        async def failing(start, end):
+            if start == 41:
+                raise ValueError("fetch failed")
+            return await fetch_chunk(start, end)
+
+        scanner.fetch_chunk = failing
+        backfill = Backfill(scanner, shard_size=10, workers=3)
+        try:
+            asyncio.run(backfill.run(1, 100))
+            assert False
+        except ValueError:
+            pass
+        # 出错分片之前的分片已经按顺序应用
+        assert scanner.state.applied == list(range(1, 41))
@@ -0,0 +1,112 @@
+import asyncio
+from aiohttp import web
+from center.batch_rpc import BatchRpc
+from center.hedge import Hedge
+from center.provider_pool import ProviderPool
+
+
+class TestBatchRpc(object):
+
+    def test_split_and_retry_failed(self):
+        posts = []
+        failed_once = set()
+
+        async def handle(request):
+            payload = await request.json()
+            posts.append(len(payload))
+            resp = []
+            for call in payload:
+                n = call['params'][0]
+                # 每个 0x3 调用第一次返回错误
+                if n == "0x3" and n not in failed_once:
+                    failed_once.add(n)
+                    resp.append({ "jsonrpc": "2.0", "id": call['id'], "error": { "code": -32000, "message": "busy"} })
+                else:
+                    resp.append({ "jsonrpc": "2.0", "id": call['id'], "result": n })
+            return web.json_response(resp)
+
+        async def run():
+            app = web.Application()
+            app.router.add_post("/", handle)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = runner.addresses[0][1]
+            rpc = BatchRpc(f"http://127.0.0.1:{port}/", batch_size=2, retry_seconds=0)
+            try:
+                return await rpc.call_many("eth_test", [[hex(i)] for i in range(5)])
+            finally:
+                await rpc.close()
+                await runner.cleanup()
+
+        results, failed = asyncio.run(run())
+        assert failed == []
+        assert results == { i: hex(i) for i in range(5) }
+        # 5 个调用拆成 3 个批次, 之后只重试失败的 1 个
+        assert sorted(posts) == [1, 1, 2, 2]
+
+    def test_hedged_batch(self):
+        posts = []
+
+        async def handle(request):
+            payload = await request.json()
+            posts.append(len(payload))
+            # 第一个数组请求很慢, 对冲的请求先返回
+            if len(posts) == 1:
+                await asyncio.sleep(1)
+            return web.json_response([{ "jsonrpc": "2.0", "id": call['id'], "result": call['params'][0] } for call in payload])
+
+        async def run():
+            app = web.Application()
+            app.router.add_post("/", handle)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = runner.addresses[0][1]
+            hedge = Hedge(percentile=0.9, min_samples=1, min_delay=0.05)
+            hedge.record(0.01)
+            rpc = BatchRpc(f"http://127.0.0.1:{port}/", batch_size=10, retry_seconds=0, hedge=hedge)
+            try:
+                return await rpc.call_many("eth_test", [[hex(i)] for i in range(3)]), hedge.stats()
+            finally:
+                await rpc.close()
+                await runner.cleanup()
+
+        (results, failed), stats = asyncio.run(run())
+        assert failed == [] and results == { i: hex(i) for i in range(3) }
+        assert stats['hedges'] == 1 and stats['wins'] == 1
+
+    def test_hedged_batch_other_endpoint(self):
+        paths = []
+
+        async def handle(request):
+            payload = await request.json()
+            paths.append(request.path)
+            # 第一个数组请求很慢, 对冲的请求必须发给另一个节点
+            if len(paths) == 1:
+                await asyncio.sleep(1)
+            return web.json_response([{ "jsonrpc": "2.0", "id": call['id'], "result": call['params'][0] } for call in payload])
+
+        async def run():
+            app = web.Application()
+            app.router.add_post("/a", handle)
+            app.router.add_post("/b", handle)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", 0).start()
+            port = runner.addresses[0][1]
+            pool = ProviderPool([f"http://127.0.0.1:{port}/a", f"http://127.0.0.1:{port}/b"], lambda uri: None)
+            hedge = Hedge(percentile=0.9, min_samples=1, min_delay=0.05)
+            hedge.record(0.01)
+            rpc = BatchRpc(None, batch_size=10, retry_seconds=0, provider_pool=pool, hedge=hedge)
+            try:
+                return await rpc.call_many("eth_test", [[hex(i)] for i in range(3)])
+            finally:
+                await rpc.close()
+                await runner.cleanup()
+
+        results, failed = asyncio.run(run())
+        assert failed == [] and results == { i: hex(i) for i in range(3) }
+        assert sorted(paths) == ["/a", "/b"]
@@ -0,0 +1,28 @@
+from eth_utils import keccak
+from center.bloom import BloomFilter
+
+
+def make_bloom(values):
+    bloom = 0
+    for v in values:
+        h = keccak(v)
+        for i in range(0, 6, 2):
+            bloom |= 1 << (((h[i] << 8) | h[i + 1]) & 2047)
+    return bloom.to_bytes(256, 'big')
+
+
+class TestBloom(object):
+
+    def test_match(self):
+        address = "0x272A64DB94106e98d6733d599727AEDBB336c878"
+        topic = "0x" + keccak(text="Trade(address)").hex()
+        other = bytes.fromhex("99" * 20)
+        blooms = [
+            make_bloom([bytes.fromhex(address[2:]), bytes.fromhex(topic[2:])]),
+            make_bloom([bytes.fromhex(address[2:])]),
+            make_bloom([other, bytes.fromhex(topic[2:])]),
+            None,
+        ]
+        bf = BloomFilter([([address], [topic])])
+        assert bf.match(blooms).tolist() == [True, False, False, True]
+        assert BloomFilter([]).match(blooms).tolist() == [False, False, False, True]
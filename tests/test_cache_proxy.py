@@ -0,0 +1,73 @@
+import asyncio
+import pytest
+from aiohttp import ClientSession, web
+from center.cache_proxy import CacheProxy, CacheStore, cache_key, check_upstreams
+
+
+def make_block(n):
+    return { "number": hex(n), "hash": "0x" + f"{n:064x}", "transactions": [] }
+
+
+class TestCacheProxy(object):
+
+    def test_cache_key(self):
+        assert cache_key("eth_getBlockByNumber", ["0x10", True]) == "block:16:True"
+        assert cache_key("eth_getBlockByNumber", ["latest", True]) is None
+        assert cache_key("eth_getBlockReceipts", ["0x10"]) == "receipts:16"
+        assert cache_key("eth_blockNumber", []) is None
+
+    def test_check_upstreams(self):
+        check_upstreams(["https://rpc-canary-1.bevm.io/", "http://127.0.0.1:8546/"], "127.0.0.1", 8545)
+        # 转发给自己会一直循环
+        for uri in ["http://127.0.0.1:8545/", "http://localhost:8545", "http://0.0.0.0:8545/rpc"]:
+            with pytest.raises(ValueError):
+                check_upstreams([uri], "127.0.0.1", 8545)
+        with pytest.raises(ValueError):
+            check_upstreams(["https://proxy.local/"], "proxy.local", 443)
+
+    def test_serve_from_cache(self, tmp_path):
+        upstream_calls = []
+
+        async def upstream(request):
+            payload = await request.json()
+            resp = []
+            for call in payload:
+                upstream_calls.append(call['method'])
+                if call['method'] == "eth_blockNumber":
+                    resp.append({ "jsonrpc": "2.0", "id": call['id'], "result": hex(100) })
+                else:
+                    resp.append({ "jsonrpc": "2.0", "id": call['id'], "result": make_block(int(call['params'][0], 16)) })
+            return web.json_response(resp)
+
+        async def run():
+            app = web.Application()
+            app.router.add_post("/", upstream)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", 0).start()
+            upstream_uri = f"http://127.0.0.1:{runner.addresses[0][1]}/"
+
+            proxy = CacheProxy([upstream_uri], CacheStore(str(tmp_path / "cache.sqlite")), safety_blocks=3)
+            proxy_runner = web.AppRunner(proxy.create_app())
+            await proxy_runner.setup()
+            await web.TCPSite(proxy_runner, "127.0.0.1", 0).start()
+            proxy_uri = f"http://127.0.0.1:{proxy_runner.addresses[0][1]}/"
+
+            # 98 在安全块以上, 不缓存
+            batch = [{ "jsonrpc": "2.0", "id": i + 1, "method": "eth_getBlockByNumber", "params": [hex(n), True] } for i, n in enumerate([10, 11, 98])]
+            async with ClientSession() as session:
+                results = []
+                for _ in range(2):
+                    async with session.post(proxy_uri, json=batch) as resp:
+                        results.append(await resp.json())
+            await proxy_runner.cleanup()
+            await runner.cleanup()
+            return proxy, results, await proxy.store.count()
+
+        proxy, results, count = asyncio.run(run())
+        assert results[0] == results[1]
+        assert [r['id'] for r in results[1]] == [1, 2, 3]
+        assert results[1][0]['result'] == make_block(10)
+        assert upstream_calls.count("eth_getBlockByNumber") == 4
+        assert proxy.stats()['hits'] == 2
+        assert count == 4
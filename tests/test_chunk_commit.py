@@ -0,0 +1,117 @@
+from types import SimpleNamespace
+import pytest
+from center.chunk_commit import BufferCollection, ChunkBuffer, ChunkLog, NotAtomic
+from conftest import FakeCollection
+
+
+def transfer(buffer, accounts, sender, receiver, amount):
+    collection = BufferCollection(buffer, accounts)
+    collection.update_one({ "_id": sender }, { "$inc": { "balance": -amount } }, upsert=True)
+    collection.update_one({ "_id": receiver }, { "$inc": { "balance": amount } }, upsert=True)
+
+
+class TestChunkCommit(object):
+
+    def setup_method(self):
+        self.accounts = FakeCollection("accounts")
+        self.accounts.docs = { "a": { "_id": "a", "balance": 10 } }
+        self.checkpoints = FakeCollection("scan_checkpoint")
+        # 重启后按集合全名取得集合
+        self.checkpoints.database = SimpleNamespace(client={ "test": { "accounts": self.accounts } })
+        self.entries = FakeCollection("chunk_log")
+        self.buffer = ChunkBuffer(ChunkLog(self.checkpoints, self.entries))
+
+    def test_commit(self):
+        self.buffer.begin(100)
+        transfer(self.buffer, self.accounts, "a", "b", 3)
+        transfer(self.buffer, self.accounts, "b", "c", 1)
+        # 提交前数据库不变, 缓冲中读到最新的值
+        assert self.accounts.docs == { "a": { "_id": "a", "balance": 10 } }
+        assert BufferCollection(self.buffer, self.accounts).find_one({ "_id": "b"}) == { "_id": "b", "balance": 2 }
+        self.buffer.commit(104)
+        # 每个实体只写入一次
+        assert self.accounts.writes == 3
+        assert self.accounts.docs == { "a": { "_id": "a", "balance": 7 }, "b": { "_id": "b", "balance": 2 }, "c": { "_id": "c", "balance": 1 } }
+        assert self.checkpoints.docs == { "scanner": { "_id": "scanner", "lastScannedBlock": 104, "chunk": None } }
+        assert self.entries.docs == {} and self.buffer.docs == {}
+
+    def test_pipeline(self):
+        self.buffer.begin(100)
+        transfer(self.buffer, self.accounts, "a", "b", 3)
+        # 下一个 chunk 在上一个提交前开始
+        self.buffer.begin(105)
+        transfer(self.buffer, self.accounts, "a", "b", 2)
+        self.buffer.commit(104)
+        assert self.accounts.docs == { "a": { "_id": "a", "balance": 7 }, "b": { "_id": "b", "balance": 3 } }
+        self.buffer.commit(109)
+        assert self.accounts.docs == { "a": { "_id": "a", "balance": 5 }, "b": { "_id": "b", "balance": 5 } }
+        assert self.checkpoints.docs["scanner"]["lastScannedBlock"] == 109
+
+    def test_recover(self):
+        self.buffer.begin(100)
+        transfer(self.buffer, self.accounts, "a", "b", 3)
+        self.buffer.commit(104)
+        # 提交点之后写入数据时崩溃
+        self.buffer.begin(105)
+        transfer(self.buffer, self.accounts, "a", "b", 2)
+        self.accounts.fail = True
+        with pytest.raises(ConnectionError):
+            self.buffer.commit(109)
+        assert self.accounts.docs["a"]["balance"] == 7
+        self.accounts.fail = False
+        # 重启后按记录重做
+        log = ChunkLog(self.checkpoints, self.entries)
+        assert log.recover() == 109
+        assert self.accounts.docs == { "a": { "_id": "a", "balance": 5 }, "b": { "_id": "b", "balance": 5 } }
+        assert self.entries.docs == {} and self.checkpoints.docs["scanner"]["chunk"] is None
+
+    def test_discard_uncommitted(self):
+        self.buffer.begin(100)
+        transfer(self.buffer, self.accounts, "a", "b", 3)
+        self.buffer.commit(104)
+        # 写入记录后、提交点之前崩溃
+        self.entries.insert_many([{ "chunk": 109, "c": "test.accounts", "i": "a", "d": { "_id": "a", "balance": 0 } }])
+        assert ChunkLog(self.checkpoints, self.entries).recover() == 104
+        assert self.accounts.docs["a"]["balance"] == 7 and self.entries.docs == {}
+
+    def test_strict(self):
+        self.buffer.begin(100)
+        transfer(self.buffer, self.accounts, "a", "b", 3)
+        # 严格模式下缓冲不支持的操作停止扫描, 数据库不变
+        with pytest.raises(NotAtomic):
+            BufferCollection(self.buffer, self.accounts).update_many({}, { "$set": { "seen": True } })
+        assert self.accounts.docs == { "a": { "_id": "a", "balance": 10 } }
+
+    def test_spill(self):
+        buffer = ChunkBuffer(ChunkLog(self.checkpoints, self.entries), strict=False)
+        buffer.begin(100)
+        transfer(buffer, self.accounts, "a", "b", 3)
+        # 缓冲不支持的操作先写入之前的写入
+        BufferCollection(buffer, self.accounts).update_many({}, { "$set": { "seen": True } })
+        assert self.accounts.docs == { "a": { "_id": "a", "balance": 7, "seen": True }, "b": { "_id": "b", "balance": 3, "seen": True } }
+        assert buffer.stats()["spills"] == 1
+        buffer.commit(104)
+        assert self.checkpoints.docs["scanner"] == { "_id": "scanner", "lastScannedBlock": 104, "chunk": None }
+
+    def test_spill_restart(self):
+        buffer = ChunkBuffer(ChunkLog(self.checkpoints, self.entries), strict=False)
+        buffer.begin(100)
+        transfer(buffer, self.accounts, "a", "b", 3)
+        buffer.begin(105)
+        transfer(buffer, self.accounts, "a", "b", 2)
+        # 流水线中的下一个 chunk 开始后, 结束的 chunk 在 spill 时提交, 扫描进度越过它
+        buffer.begin(110)
+        BufferCollection(buffer, self.accounts).find({})
+        assert self.checkpoints.docs["scanner"] == { "_id": "scanner", "lastScannedBlock": 109, "chunk": None, "spilled": 110 }
+        # 之后按顺序到达的提交不再重复写入
+        writes = self.accounts.writes
+        buffer.commit(104)
+        buffer.commit(109)
+        assert self.accounts.writes == writes
+        assert self.accounts.docs == { "a": { "_id": "a", "balance": 5 }, "b": { "_id": "b", "balance": 5 } }
+        # 当前 chunk 提交前崩溃时重启报错, 不会重新执行它的事件处理器; 提交后标记清除
+        with pytest.raises(NotAtomic):
+            ChunkLog(self.checkpoints, self.entries).recover()
+        buffer.commit(114)
+        assert ChunkLog(self.checkpoints, self.entries).recover() == 114
+        assert self.accounts.docs == { "a": { "_id": "a", "balance": 5 }, "b": { "_id": "b", "balance": 5 } }
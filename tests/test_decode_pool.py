@@ -0,0 +1,53 @@
+import asyncio
+from eth_abi import encode
+from eth_utils import event_abi_to_log_topic
+from hexbytes import HexBytes
+from web3 import AsyncWeb3
+from web3._utils.events import get_event_data
+from web3.datastructures import AttributeDict
+from center.decode_pool import DecodePool, load_event_abis
+from center.decoder import DecoderRegistry
+
+TRADER = "0x" + "01"*20
+SUBJECT = "0x" + "02"*20
+
+
+def trade_logs(abi, count):
+    topic = HexBytes(event_abi_to_log_topic(abi))
+    logs = []
+    for i in range(count):
+        logs.append(
+            AttributeDict({
+                "address": "0x272A64DB94106e98d6733d599727AEDBB336c878",
+                "topics": [topic, HexBytes(encode(["address"], [TRADER])),
+                           HexBytes(encode(["address"], [SUBJECT]))],
+                "data": HexBytes(encode(["bool", "uint256", "uint256", "uint256", "uint256", "uint256"], [i % 2 == 0, i, 10**18 + i, 5, 6, 2**200])),
+                "logIndex": i,
+                "transactionIndex": 0,
+                "transactionHash": HexBytes("0x" + "ab"*32),
+                "blockHash": HexBytes("0x" + "cd"*32),
+                "blockNumber": 100,
+                "removed": False,
+            }))
+    return logs
+
+
+class TestDecodePool(object):
+
+    def test_same_as_get_event_data(self):
+        abi = [a for (contract, _), a in load_event_abis().items() if contract == "IPShare" and a["name"] == "Trade"][0]
+        codec = AsyncWeb3().codec
+        logs = trade_logs(abi, 30)
+        jobs = [("IPShare", log) for log in logs]
+        expected = [get_event_data(codec, abi, log) for log in logs]
+        decoders = DecoderRegistry(codec)
+        decoders.register("IPShare", abi)
+
+        pool = DecodePool(decoders, max_workers=2, batch_size=7, min_batch=0)
+        try:
+            events = asyncio.run(pool.decode(jobs))
+        finally:
+            pool.close()
+        assert events == expected
+        assert events[3].args.shareAmount == 3 and events[3].args.trader == expected[3].args.trader
+        assert pool.stats() == { "decoded": 30, "batches": 5 }
@@ -0,0 +1,111 @@
+from eth_abi import encode
+from eth_utils import event_abi_to_log_topic, keccak, to_checksum_address
+from hexbytes import HexBytes
+from web3 import AsyncWeb3
+from web3._utils.events import get_event_data
+from web3.datastructures import AttributeDict
+from web3.exceptions import LogTopicError, MismatchedABI
+from center.decode_pool import load_event_abis
+from center.decoder import DecoderRegistry, EventDecoder
+
+SAMPLES = {
+    "address": "0x" + "ab"*20,
+    "bool": True,
+    "bytes32": b"\x01" * 32,
+    "string": "data:application/json,{}",
+    "uint256": 2**255 + 7,
+    "address[]": ["0x" + "cd"*20, "0x" + "ef"*20],
+    "(address,uint256)": ("0x" + "12"*20, 5),
+}
+
+EXTRA_ABI = {
+    "type":
+    "event",
+    "name":
+    "Batch",
+    "anonymous":
+    False,
+    "inputs": [
+        {
+            "name": "tag",
+            "type": "string",
+            "indexed": True
+        },
+        {
+            "name": "owners",
+            "type": "address[]",
+            "indexed": False
+        },
+        {
+            "name": "order",
+            "type": "tuple",
+            "indexed": False,
+            "components": [{
+                "name": "maker",
+                "type": "address"
+            }, {
+                "name": "amount",
+                "type": "uint256"
+            }]
+        },
+    ],
+}
+
+
+def sample_log(abi, index=0):
+    topics = [HexBytes(event_abi_to_log_topic(abi))]
+    data_types = []
+    data_values = []
+    for i in abi["inputs"]:
+        type_str = "(address,uint256)" if i["type"] == "tuple" else i["type"]
+        if i["indexed"]:
+            if type_str == "string":
+                topics.append(HexBytes(keccak(text=SAMPLES[type_str])))
+            else:
+                topics.append(HexBytes(encode([type_str], [SAMPLES[type_str]])))
+        else:
+            data_types.append(type_str)
+            data_values.append(SAMPLES[type_str])
+    return AttributeDict({
+        "address": "0x272A64DB94106e98d6733d599727AEDBB336c878",
+        "topics": topics,
+        "data": HexBytes(encode(data_types, data_values)),
+        "logIndex": index,
+        "transactionIndex": 0,
+        "transactionHash": HexBytes("0x" + "ab"*32),
+        "blockHash": HexBytes("0x" + "cd"*32),
+        "blockNumber": 100,
+        "removed": False,
+    })
+
+
+class TestDecoder(object):
+
+    def test_same_as_get_event_data(self):
+        codec = AsyncWeb3().codec
+        registry = DecoderRegistry(codec)
+        jobs = []
+        expected = []
+        for (contract, _), abi in list(load_event_abis().items()) + [(("Extra", None), EXTRA_ABI)]:
+            registry.register(contract, abi)
+            log = sample_log(abi, len(jobs))
+            jobs.append((contract, log))
+            expected.append(get_event_data(codec, abi, log))
+            # 普通字典的日志返回普通字典
+            assert EventDecoder(codec, abi).decode(dict(log)) == get_event_data(codec, abi, dict(log))
+        assert registry.decode_many(jobs) == expected
+        extra = registry.decode_many(jobs[-1:])[0]
+        assert extra.args.order.maker == "0x" + "12"*20 and extra.args.owners[0] == to_checksum_address("0x" + "cd"*20)
+
+    def test_errors(self):
+        decoder = EventDecoder(AsyncWeb3().codec, EXTRA_ABI)
+        log = sample_log(EXTRA_ABI)
+        for topics, error in [([], MismatchedABI), ([HexBytes("0x" + "00"*32)], MismatchedABI), (log["topics"][:1], LogTopicError)]:
+            try:
+                decoder.decode_args(topics, log["data"])
+                assert False
+            except error:
+                pass
+        registry = DecoderRegistry(AsyncWeb3().codec)
+        registry.register("Extra", EXTRA_ABI)
+        assert registry.get("Extra", { "topics": [] }) is None and registry.get("Other", log) is None
@@ -0,0 +1,22 @@
+import asyncio
+from center.deploy_discovery import DeployDiscovery
+
+
+class TestDeployDiscovery(object):
+
+    def test_discover(self):
+        deployed = { "0xa": 1234, "0xb": 10, "0xc": None, "0xd": 500 }
+        calls = []
+
+        async def get_code(address, block_number):
+            calls.append(address)
+            if address == "0xd":
+                raise ValueError("missing trie node")
+            block = deployed[address]
+            return b"\x60\x80" if block is not None and block_number >= block else b""
+
+        discovery = DeployDiscovery(get_code)
+        blocks = asyncio.run(discovery.discover({ "A": "0xa", "B": "0xb", "C": "0xc", "D": "0xd"}, 100, 100000))
+        # 在 low 之前部署, 没有代码以及查询失败时都不跳过区块
+        assert blocks == { "A": 1234, "B": 100, "C": 100, "D": 100 }
+        assert calls.count("0xa") <= 20
@@ -0,0 +1,261 @@
+import asyncio
+import logging
+from eth_abi import encode
+from eth_utils import encode_hex, event_abi_to_log_topic
+from hexbytes import HexBytes
+from web3 import AsyncWeb3
+from web3.datastructures import AttributeDict
+from center.block_scanner import BlockScanner, ScanChunk
+from center.decoder import CalldataMatcher, TopicFilter
+from center.decorator import new_contract, topic_filter
+from center.dispatch import DispatchTable
+from center.events import Events
+
+SHARE = "0x" + "11"*20
+MARKET = "0x" + "22"*20
+OTHER = "0x" + "33"*20
+CHILD = "0x" + "55"*20
+
+
+class FakeState(object):
+
+    def __init__(self, address):
+        self.address = address
+        self.version = 0
+        self.listeners = []
+        self.processed = []
+
+    def get_address(self, contract):
+        return list(self.address.get(contract, []))
+
+    def get_address_version(self):
+        return self.version
+
+    def add_address(self, contract, address, block_number=0):
+        if self.has_address(contract, address):
+            return False
+        self.address.setdefault(contract, []).append(address)
+        self.version += 1
+        for listener in self.listeners:
+            listener(contract, address, self.version)
+        return True
+
+    def has_address(self, contract, address):
+        return address in self.address.get(contract, [])
+
+    def process_event(self, event, contracts=None, new_contract_address=None):
+        self.processed.append((event.event.address, event.eventName, event.blockNumber, event.index))
+        # 工厂事件添加新的跟踪地址
+        if event.eventName == "CreateIPshare":
+            new_contract_address("IPShare", CHILD)
+
+    def subscribe_address(self, listener):
+        self.listeners.append(listener)
+
+
+def log(address, topic):
+    return AttributeDict({ "address": address, "topics": [HexBytes(topic), HexBytes("0x" + "00"*32)], "logIndex": 0 })
+
+
+def tx(to, data):
+    return AttributeDict({ "to": to, "input": data })
+
+
+def share_log(events, address, name, block, index):
+    """IPShare 合约 name 事件的日志, 每个区块一笔交易"""
+    abi = events.getEvent("IPShare", name)._get_event_abi()
+    if name == "CreateIPshare":
+        topics, data = [encode(["address"], [OTHER]), encode(["uint256"], [1])], encode(["uint256"], [2])
+    else:
+        topics, data = [encode(["address"], [OTHER]), encode(["address"], [SHARE]), encode(["uint256"], [3])], b""
+    return AttributeDict({
+        "address": address,
+        "topics": [HexBytes(event_abi_to_log_topic(abi))] + [HexBytes(t) for t in topics],
+        "data": HexBytes(data),
+        "logIndex": index,
+        "blockNumber": block,
+        "transactionIndex": 0,
+        "transactionHash": HexBytes(block.to_bytes(32, "big")),
+        "blockHash": HexBytes("0x" + "cd"*32),
+    })
+
+
+def share_receipt(block, logs):
+    return AttributeDict({ "transactionHash": HexBytes(block.to_bytes(32, "big")), "blockNumber": block, "status": 1, "logs": logs })
+
+
+def share_block(block):
+    transactions = [AttributeDict({ "hash": HexBytes(block.to_bytes(32, "big")), "to": SHARE, "blockNumber": block })]
+    return AttributeDict({ "number": block, "timestamp": block * 10, "logsBloom": None, "transactions": transactions })
+
+
+async def apply_chunk(scanner, chunk):
+    tx_map = scanner.get_transaction_map([t for b in chunk.blocks for t in b.transactions])
+    chunk.events = await scanner.build_events(chunk.receipts, tx_map, scanner.get_block_timestamp(chunk.blocks))
+    return await scanner.apply_events(chunk.events, chunk)
+
+
+class TestDispatchTable(object):
+
+    def test_routes_match_events(self):
+        events = Events(AsyncWeb3(), logging.getLogger("test"))
+        state = FakeState({ "IPShare": [SHARE], "BevscriptionsMarket": [MARKET] })
+        dispatch = DispatchTable(events, state).refresh()
+        _, topics = events.getTopics("IPShare")
+
+        for topic in topics:
+            routes = dispatch.route_log(log(SHARE, topic))
+            assert [(c, decoder.abi) for c, _, decoder in routes] == [("IPShare", events.getEventAbi("IPShare", log(SHARE, topic)))]
+            # 其他地址或没有处理器的 topic 不会被路由
+            assert dispatch.route_log(log(OTHER, topic)) == []
+            assert dispatch.route_log(log(MARKET, topic)) == []
+        assert dispatch.route_log(AttributeDict({ "address": SHARE, "topics": [] })) == []
+        # 市场合约的 _transfer 只处理 input 以 data:application/json, 开头的交易
+        listing = "0x" + 'data:application/json,{"p":"src-20"}'.encode().hex()
+        assert dispatch.route_transaction(tx(MARKET, listing)) == [("BevscriptionsMarket", "_transfer", None)]
+        assert dispatch.route_transaction(tx(MARKET, HexBytes(listing))) == [("BevscriptionsMarket", "_transfer", None)]
+        assert dispatch.route_transaction(tx(MARKET, "0xa9059cbb")) == []
+        assert dispatch.route_transaction(tx(SHARE, listing)) == [] and dispatch.route_transaction(tx(None, listing)) == []
+
+        # 地址变化后重建
+        dispatch.refresh()
+        assert dispatch.rebuilds == 1
+        state.add_address("IPShare", OTHER)
+        assert dispatch.refresh().route_log(log(OTHER, topics[0]))[0][0] == "IPShare"
+        assert dispatch.rebuilds == 2
+
+    def test_topic_filter(self):
+        subject = "0x" + "44"*20
+
+        @topic_filter(subject=[subject])
+        @new_contract()
+        def handleTrade(eventInfo, **kv):
+            pass
+
+        assert handleTrade.topic_filters == { "subject": [subject] }
+        # 放在 new_contract 里面也能保留
+        assert new_contract()(topic_filter(trader=SHARE)(lambda eventInfo, **kv: None)).topic_filters == { "trader": [SHARE] }
+
+        events = Events(AsyncWeb3(), logging.getLogger("test"))
+        events.contracts["IPShare"]["filters"]["Trade"] = handleTrade.topic_filters
+        events._init_topic()
+        abi = events.getEvent("IPShare", "Trade")._get_event_abi()
+        topic = encode_hex(event_abi_to_log_topic(abi))
+        state = FakeState({ "IPShare": [SHARE] })
+        dispatch = DispatchTable(events, state).refresh()
+
+        def trade(trader, subject):
+            return AttributeDict({
+                "address": SHARE,
+                "topics": [HexBytes(topic), HexBytes(encode(["address"], [trader])),
+                           HexBytes(encode(["address"], [subject]))]
+            })
+
+        assert len(dispatch.route_log(trade(OTHER, subject))) == 1
+        assert dispatch.route_log(trade(subject, OTHER)) == []
+        assert dispatch.route_log(AttributeDict({ "address": SHARE, "topics": [HexBytes(topic)] })) == []
+
+        scanner = BlockScanner(web3=None, state=state, events=events)
+        filters = scanner.get_log_filters(["IPShare"])
+        assert filters[1] == { "address": [SHARE], "topics": [[topic], None, [encode_hex(encode(["address"], [subject]))]] }
+        assert topic not in filters[0]["topics"][0] and len(filters[0]["topics"][0]) == 2
+        try:
+            TopicFilter(abi, { "isBuy": [True] })
+            assert False
+        except ValueError:
+            pass
+
+    def test_calldata_function(self):
+        abi = [{
+            "type": "function",
+            "name": "list",
+            "stateMutability": "nonpayable",
+            "outputs": [],
+            "inputs": [{
+                "name": "tick",
+                "type": "string"
+            }, {
+                "name": "owners",
+                "type": "address[]"
+            }, {
+                "name": "amount",
+                "type": "uint256"
+            }],
+        }]
+        web3 = AsyncWeb3()
+        contract = web3.eth.contract(abi=abi)
+        data = HexBytes(contract.encodeABI(fn_name="list", args=["donut", [OTHER], 7]))
+        matcher = CalldataMatcher(web3.codec, abi, function="list")
+        assert matcher.match(bytes(data)) and not matcher.match(b"data:application/json,")
+        call = matcher.decode(bytes(data))
+        fn, args = contract.decode_function_input(data)
+        assert call.function == fn.fn_name and dict(call.args) == args
+        assert CalldataMatcher(web3.codec, abi, selector="0x" + bytes(data[:4]).hex()).decode(bytes(data)) is None
+
+    def test_reroute_new_address(self):
+        events = Events(AsyncWeb3(), logging.getLogger("test"))
+        state = FakeState({ "IPShare": [SHARE] })
+        scanner = BlockScanner(web3=None, state=state, events=events, logger=logging.getLogger("test"))
+        chunk = ScanChunk(100, 102)
+        chunk.blocks = [share_block(b) for b in (100, 101, 102)]
+        chunk.receipts = [
+            share_receipt(100, [
+                share_log(events, CHILD, "ValueCaptured", 100, 0),
+                share_log(events, SHARE, "CreateIPshare", 100, 1),
+                share_log(events, CHILD, "ValueCaptured", 100, 2)
+            ]),
+            share_receipt(101, [share_log(events, SHARE, "ValueCaptured", 101, 0),
+                                share_log(events, CHILD, "ValueCaptured", 101, 1)]),
+        ]
+        fetched = []
+
+        async def fetch_transaction_receipts(transactions):
+            # logsBloom 筛选时跳过的第 102 块
+            fetched.extend(t.blockNumber for t in transactions)
+            return [share_receipt(102, [share_log(events, CHILD, "ValueCaptured", 102, 0)])]
+
+        scanner.fetch_transaction_receipts = fetch_transaction_receipts
+
+        assert asyncio.run(apply_chunk(scanner, chunk)) == 5
+        # 新地址在工厂事件之后的日志按顺序插入, 之前的日志不处理
+        assert state.processed == [
+            (SHARE, "CreateIPshare", 100, 1),
+            (CHILD, "ValueCaptured", 100, 2),
+            (SHARE, "ValueCaptured", 101, 0),
+            (CHILD, "ValueCaptured", 101, 1),
+            (CHILD, "ValueCaptured", 102, 0),
+        ]
+        assert fetched == [102] and state.address["IPShare"] == [SHARE, CHILD]
+        # 分发表增量加入新地址, 没有重建
+        assert scanner.dispatch.stats()["increments"] == 1 and scanner.dispatch.rebuilds == 1
+
+    def test_reroute_hybrid(self):
+        events = Events(AsyncWeb3(), logging.getLogger("test"))
+        state = FakeState({ "IPShare": [SHARE] })
+        scanner = BlockScanner(web3=None, state=state, events=events, logger=logging.getLogger("test"), scan_mode="hybrid")
+        # 混合模式下 chunk 只有工厂有日志的区块
+        chunk = ScanChunk(100, 102)
+        chunk.blocks = [share_block(100)]
+        chunk.receipts = [share_receipt(100, [share_log(events, SHARE, "CreateIPshare", 100, 0)])]
+        queries = []
+        fetched = []
+
+        async def fetch_logs(start_block, end_block, filters):
+            queries.append((start_block, end_block, filters["address"]))
+            return [share_log(events, CHILD, "ValueCaptured", 102, 0)]
+
+        async def fetch_blocks(block_numbers):
+            return [share_block(b) for b in block_numbers]
+
+        async def fetch_transaction_receipts(transactions):
+            fetched.extend(t.blockNumber for t in transactions)
+            return [share_receipt(102, [share_log(events, CHILD, "ValueCaptured", 102, 0)])]
+
+        scanner.fetch_logs = fetch_logs
+        scanner.fetch_blocks = fetch_blocks
+        scanner.fetch_transaction_receipts = fetch_transaction_receipts
+        assert asyncio.run(apply_chunk(scanner, chunk)) == 2
+        # 新地址在工厂没有日志的区块中的日志也会处理
+        assert queries == [(100, 102, [CHILD])] and fetched == [102]
+        assert state.processed == [(SHARE, "CreateIPshare", 100, 0), (CHILD, "ValueCaptured", 102, 0)]
+        assert [b.number for b in chunk.blocks] == [100, 102]
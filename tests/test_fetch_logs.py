@@ -0,0 +1,110 @@
+import asyncio
+import contextlib
+import logging
+from types import SimpleNamespace
+import pytest
+from aiohttp import ClientResponseError, RequestInfo
+from multidict import CIMultiDict
+from yarl import URL
+from web3 import AsyncWeb3
+from web3.datastructures import AttributeDict
+from center.block_scanner import BlockScanner
+from center.events import Events
+
+LIMIT = { "code": -32005, "message": "query returned more than 10000 results"}
+
+
+class FakeNode(object):
+    """每个查询最多返回 limit 条日志, 超过时返回节点的错误"""
+
+    def __init__(self, logs, limit, error=LIMIT):
+        self.logs = logs
+        self.limit = limit
+        self.error = error
+        self.calls = 0
+
+    async def get_logs(self, params):
+        self.calls += 1
+        topics = params["topics"][0]
+        logs = [
+            log for log in self.logs if params["fromBlock"] <= log.blockNumber <= params["toBlock"] and log.address in params["address"] and log.topic in topics
+        ]
+        if len(logs) > self.limit:
+            raise ValueError(self.error)
+        return logs
+
+
+def log(block_number, index, address, topic="t"):
+    return AttributeDict({ "blockNumber": block_number, "logIndex": index, "address": address, "topic": topic })
+
+
+def http_error(status):
+    return ClientResponseError(RequestInfo(URL("http://node/"), "POST", CIMultiDict()), (), status=status)
+
+
+def scanner_for(node, **kwargs):
+    scanner = BlockScanner(web3=None,
+                           state=None,
+                           events=Events(AsyncWeb3(), logging.getLogger("test")),
+                           logger=logging.getLogger("test"),
+                           request_retry_seconds=0,
+                           **kwargs)
+    scanner.select_web3 = lambda exclude=None: (SimpleNamespace(eth=node), contextlib.nullcontext())
+    return scanner
+
+
+class TestFetchLogs(object):
+
+    def test_split_filter(self):
+        logs = [log(5, i, address, topic) for i, (address, topic) in enumerate([("a", "t"), ("a", "u"), ("b", "t"), ("b", "u"), ("c", "t")])]
+        node = FakeNode(logs, 2)
+        filters = { "address": ["a", "b", "c"], "topics": [["t", "u"]] }
+        result = asyncio.run(scanner_for(node).fetch_logs(5, 5, filters))
+        # 单个区块的结果超过上限时按地址与 topic 拆分, 不重试同样的查询
+        assert result == logs and node.calls < 10
+
+    def test_rejected_query(self):
+        node = FakeNode([log(5, 0, "a"), log(5, 1, "a")], 1)
+        with pytest.raises(ValueError):
+            asyncio.run(scanner_for(node).fetch_logs(5, 5, { "address": ["a"], "topics": [["t"]] }))
+        assert node.calls == 1
+
+    def test_retry_transient(self):
+        node = FakeNode([log(5, 0, "a")], 1)
+        get_logs = node.get_logs
+
+        async def flaky(params):
+            if node.calls < 2:
+                node.calls += 1
+                raise ValueError("connection reset")
+            return await get_logs(params)
+
+        node.get_logs = flaky
+        assert asyncio.run(scanner_for(node).fetch_logs(5, 5, { "address": ["a"], "topics": [["t"]] })) == node.logs
+        assert node.calls == 3
+
+    def test_retry_http_error(self):
+        node = FakeNode([log(5, 0, "a")], 1)
+        get_logs = node.get_logs
+
+        async def gateway(params):
+            if node.calls < 1:
+                node.calls += 1
+                raise http_error(502)
+            return await get_logs(params)
+
+        # 网关错误不会中止扫描, 和其他错误一样重试
+        node.get_logs = gateway
+        assert asyncio.run(scanner_for(node).fetch_logs(5, 5, { "address": ["a"], "topics": [["t"]] })) == node.logs
+
+    def test_throttled_limit(self):
+        node = FakeNode([], 1)
+
+        async def throttled(params):
+            node.calls += 1
+            raise http_error(429)
+
+        node.get_logs = throttled
+        with pytest.raises(ClientResponseError):
+            asyncio.run(scanner_for(node, max_request_retries=3).fetch_logs(5, 5, { "address": ["a"], "topics": [["t"]] }))
+        assert node.calls == 4
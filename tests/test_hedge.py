@@ -0,0 +1,83 @@
+import asyncio
+from center.hedge import Hedge
+
+
+class TestHedge(object):
+
+    def test_no_hedge_without_samples(self):
+        hedge = Hedge(min_samples=5)
+
+        async def attempt():
+            await asyncio.sleep(0.01)
+            return 1
+
+        assert asyncio.run(hedge.run(attempt)) == 1
+        assert hedge.stats()['hedges'] == 0
+
+    def test_slow_request_is_hedged(self):
+        hedge = Hedge(percentile=0.9, min_samples=5, min_delay=0.01)
+        for _ in range(10):
+            hedge.record(0.01)
+        delays = [0.5, 0.01]
+
+        async def attempt():
+            await asyncio.sleep(delays.pop(0))
+            return "ok"
+
+        assert asyncio.run(hedge.run(attempt)) == "ok"
+        stats = hedge.stats()
+        assert stats['hedges'] == 1
+        assert stats['wins'] == 1
+        assert stats['wasted'] == 1
+
+    def test_cancelled_attempt_is_sampled(self):
+        hedge = Hedge(percentile=0.9, min_samples=5, min_delay=0.01)
+        for _ in range(10):
+            hedge.record(0.01)
+        delays = [0.5, 0.1]
+
+        async def attempt():
+            await asyncio.sleep(delays.pop(0))
+            return "ok"
+
+        assert asyncio.run(hedge.run(attempt)) == "ok"
+        # 对冲请求与被取消的原请求都计入样本, 原请求记录取消前等待的时间
+        latencies = sorted(hedge._latencies)
+        assert len(latencies) == 12 and latencies[-1] >= 0.1 and latencies[-2] >= 0.1
+
+    def test_failed_attempt_falls_back(self):
+        hedge = Hedge(percentile=0.9, min_samples=1, min_delay=0.01)
+        hedge.record(0.01)
+        calls = []
+
+        async def attempt():
+            calls.append(1)
+            if len(calls) == 1:
+                await asyncio.sleep(0.05)
+                raise ValueError("fail")
+            await asyncio.sleep(0.1)
+            return "ok"
+
+        assert asyncio.run(hedge.run(attempt)) == "ok"
+        assert hedge.stats()['wasted'] == 0
+
+    def test_cancelled_caller(self):
+        hedge = Hedge(percentile=0.9, min_samples=1, min_delay=0.01)
+        hedge.record(0.01)
+        started = []
+
+        async def attempt():
+            task = asyncio.current_task()
+            started.append(task)
+            await asyncio.sleep(10)
+
+        async def run():
+            caller = asyncio.ensure_future(hedge.run(attempt))
+            await asyncio.sleep(0.05)
+            caller.cancel()
+            await asyncio.gather(caller, return_exceptions=True)
+            await asyncio.sleep(0)
+            # 调用方被取消时原请求与对冲请求都被取消
+            return [task.cancelled() for task in started]
+
+        assert asyncio.run(run()) == [True, True]
@@ -0,0 +1,151 @@
+import copy
+from types import SimpleNamespace
+from center.database.entity_view import EntityView, ViewCollection, Unsupported, apply_update, current_view
+from center.parallel_apply import ParallelApply
+from conftest import FakeCollection
+
+
+def accounts():
+    collection = FakeCollection("accounts")
+    # 模拟数据库往返
+    collection.latency = 0.001
+    return collection
+
+
+class TransferState(object):
+    """按事件在账户间转账, 每个事件读写两个账户"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def _collection(self):
+        view = current_view()
+        return ViewCollection(view, self.collection) if view else self.collection
+
+    def process_event(self, event, contracts=None, new_contract_address=None):
+        collection = self._collection()
+        sender = list(collection.find({ "_id": { "$in": [event.sender] } }))
+        balance = sender[0]["balance"] if sender else 0
+        if event.amount == "all":
+            amount = balance
+        else:
+            amount = event.amount
+        collection.update_one({ "_id": event.sender }, { "$set": { "balance": balance - amount } }, upsert=True)
+        collection.update_one({ "_id": event.receiver }, { "$inc": { "balance": amount }, "$push": { "history": event.sender } }, upsert=True)
+        if event.sender == "x":
+            collection.count_documents({})
+        if new_contract_address and event.receiver == "new":
+            new_contract_address("Token", event.sender)
+
+
+def transfers():
+    events = [
+        SimpleNamespace(sender="a", receiver="b", amount=5),
+        SimpleNamespace(sender="c", receiver="d", amount=1),
+        SimpleNamespace(sender="b", receiver="e", amount="all"),
+        SimpleNamespace(sender="f", receiver="new", amount=2),
+        SimpleNamespace(sender="x", receiver="g", amount=0),
+        SimpleNamespace(sender="e", receiver="a", amount="all"),
+        SimpleNamespace(sender="h", receiver="i", amount=3),
+    ]
+    return events
+
+
+class TestEntityView(object):
+
+    def test_apply_update(self):
+        doc = { "_id": 1, "items": [{ "n": 1 }], "tags": ["a"] }
+        apply_update(doc, { "$set": { "items.0.n": 2, "meta.name": "x"}, "$inc": { "count": 3 }, "$push": { "tags": { "$each": ["b", "c"] } } })
+        apply_update(doc, { "$addToSet": { "tags": "a"}, "$pull": { "tags": "b"}, "$unset": { "meta.name": 1 } })
+        assert doc == { "_id": 1, "items": [{ "n": 2 }], "tags": ["a", "c"], "meta": {}, "count": 3 }
+        try:
+            apply_update(doc, { "$push": { "tags": { "$each": ["d"], "$slice": 1 } } })
+            assert False
+        except Unsupported:
+            pass
+
+    def test_writes_stay_in_view(self):
+        collection = accounts()
+        collection.docs["a"] = { "_id": "a", "balance": 10 }
+        view = EntityView()
+        state = TransferState(collection)
+        with view:
+            state.process_event(SimpleNamespace(sender="a", receiver="b", amount=4))
+        assert collection.docs == { "a": { "_id": "a", "balance": 10 } }
+        assert view.reads == {("test.accounts", "a"), ("test.accounts", "b")}
+        assert view.writes == view.reads
+        view.commit()
+        assert collection.docs["a"]["balance"] == 6 and collection.docs["b"] == { "_id": "b", "balance": 4, "history": ["a"] }
+
+
+class TestParallelApply(object):
+
+    def test_same_as_serial(self):
+        serial = accounts()
+        serial.docs = { "a": { "_id": "a", "balance": 10 }, "c": { "_id": "c", "balance": 10 } }
+        parallel = copy.deepcopy(serial)
+
+        state = TransferState(serial)
+        serial_created = []
+        for event in transfers():
+            state.process_event(event, None, lambda contract, address: serial_created.append((contract, address)))
+
+        created = []
+        executor = ParallelApply(TransferState(parallel), workers=4)
+        try:
+            executor.apply(transfers(), None, lambda contract, address: created.append((contract, address)))
+        finally:
+            executor.close()
+        assert parallel.docs == serial.docs
+        assert created == serial_created == [("Token", "f")]
+        stats = executor.stats()
+        # b -> e 读到了 a -> b 写入的 b, e -> a 读到了 b -> e 写入的 e, x 使用了视图不支持的 count_documents, 之后的事件都重新执行
+        assert stats["events"] == 7 and stats["serial"] == 1
+        assert stats["reexecuted"] == 4
+
+    def test_stop_on_new_address(self):
+        collection = accounts()
+        executor = ParallelApply(TransferState(collection), workers=4)
+        try:
+            # 添加了新地址的第 4 个事件之后停止, 之后的事件不提交
+            assert executor.apply(transfers(), None, lambda contract, address: True) == 4
+            assert "g" not in collection.docs and collection.docs["new"]["balance"] == 2
+            assert executor.apply(transfers()[4:], None, lambda contract, address: True) == 3
+        finally:
+            executor.close()
+        assert executor.stats()["events"] == 7
+
+    def test_counter_increments_do_not_conflict(self):
+        collection = accounts()
+
+        class CounterState(object):
+
+            def process_event(self, event, contracts=None, new_contract_address=None):
+                view = current_view()
+                target = ViewCollection(view, collection) if view else collection
+                # 每个事件都累加同一个全局计数
+                target.update_one({ "_id": "total"}, { "$inc": { "count": event.amount } }, upsert=True)
+                target.update_one({ "_id": event.sender }, { "$set": { "balance": event.amount } }, upsert=True)
+
+        executor = ParallelApply(CounterState(), workers=4)
+        try:
+            executor.apply([SimpleNamespace(sender=str(i), amount=i) for i in range(10)])
+        finally:
+            executor.close()
+        assert collection.docs["total"]["count"] == 45
+        assert executor.stats()["reexecuted"] == 0
+
+    def test_serial_when_conflicting(self):
+        collection = accounts()
+        collection.docs["a"] = { "_id": "a", "balance": 100 }
+        executor = ParallelApply(TransferState(collection), workers=4, probe_interval=2)
+        chain = [SimpleNamespace(sender="a", receiver="a", amount=1) for _ in range(4)]
+        try:
+            # 每个事件都读写 a, 之后的 chunk 顺序执行, 每 2 个 chunk 再并行试一次
+            for _ in range(4):
+                executor.apply(chain)
+        finally:
+            executor.close()
+        stats = executor.stats()
+        assert stats["events"] == 16 and stats["serial_chunks"] == 2
+        assert stats["reexecuted"] == 6
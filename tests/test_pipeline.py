@@ -0,0 +1,55 @@
+import asyncio
+import random
+from center.pipeline import Pipeline
+
+
+class TestPipeline(object):
+
+    def test_order_and_backpressure(self):
+        applied = []
+        fetched = []
+
+        async def fetch(item):
+            fetched.append(item)
+            # 下载不能领先应用太多
+            assert item - len(applied) <= 4
+            await asyncio.sleep(random.random() * 0.005)
+            return item * 10
+
+        async def apply(item):
+            await asyncio.sleep(0.002)
+            applied.append(item)
+            return item
+
+        pipeline = Pipeline([("fetch", fetch), ("apply", apply)], maxsize=1)
+        asyncio.run(pipeline.run(range(30)))
+        assert applied == [i * 10 for i in range(30)]
+        stats = pipeline.stats()
+        assert stats["fetch"]["items"] == 30 and stats["apply"]["items"] == 30
+        assert stats["apply"]["max_queue"] <= 1
+        assert 0 < stats["apply"]["utilization"] <= 1
+
+    def test_stop_and_error(self):
+        applied = []
+        running = { "value": True }
+
+        async def apply(item):
+            applied.append(item)
+            if item == 5:
+                running["value"] = False
+            return item
+
+        asyncio.run(Pipeline([("apply", apply)]).run(range(100), running=lambda: running["value"]))
+        # 停止后不再送入新数据, 已送入的数据处理完
+        assert applied[:6] == list(range(6)) and len(applied) < 10
+
+        async def fail(item):
+            if item == 3:
+                raise ValueError("stage failed")
+            return item
+
+        try:
+            asyncio.run(Pipeline([("fail", fail), ("apply", apply)]).run(range(10)))
+            assert False
+        except ValueError:
+            pass
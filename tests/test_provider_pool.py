@@ -0,0 +1,89 @@
+import asyncio
+from aiohttp import web
+from web3 import AsyncWeb3
+from center.http_session import PooledHTTPProvider, SessionPool
+from center.provider_pool import ProviderPool
+
+
+class FakeEth(object):
+
+    def __init__(self):
+        self.fail = False
+
+    @property
+    async def block_number(self):
+        if self.fail:
+            raise ValueError("down")
+        return 100
+
+
+class FakeWeb3(object):
+
+    def __init__(self, uri):
+        self.uri = uri
+        self.eth = FakeEth()
+
+
+class TestProviderPool(object):
+
+    def test_weighted_select(self):
+        pool = ProviderPool(["a", "b"], web3_factory=FakeWeb3)
+        a, b = pool.endpoints
+        pool.report(a, 0.1)
+        pool.report(b, 1.0)
+        counts = { "a": 0, "b": 0 }
+        for _ in range(1000):
+            counts[pool.select().uri] += 1
+        assert counts["a"] > counts["b"] * 3
+
+    def test_eject_and_recover(self):
+        pool = ProviderPool(["a", "b"], web3_factory=FakeWeb3, max_failures=2, eject_seconds=0)
+        a, b = pool.endpoints
+        pool.report(a, 0.1, ok=False, throttled=True)
+        assert not a.healthy
+        assert all(pool.select() is b for _ in range(20))
+        # 至少保留一个节点
+        pool.report(b, 0.1, ok=False, throttled=True)
+        assert b.healthy
+        a.web3.eth.fail = True
+        asyncio.run(pool.recover())
+        assert not a.healthy
+        a.web3.eth.fail = False
+        a.ejected_until = 0.001
+        asyncio.run(pool.recover())
+        assert a.healthy
+
+    def test_quota_from_single_calls(self):
+
+        async def handle(request):
+            payload = await request.json()
+            return web.json_response({
+                "jsonrpc": "2.0",
+                "id": payload['id'],
+                "result": "0x64"
+            },
+                                     headers={
+                                         "x-ratelimit-remaining": "25",
+                                         "x-ratelimit-limit": "100"
+                                     })
+
+        async def run():
+            app = web.Application()
+            app.router.add_post("/", handle)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", 0).start()
+            sessions = SessionPool()
+            uri = f"http://127.0.0.1:{runner.addresses[0][1]}/"
+            pool = ProviderPool([uri], web3_factory=lambda uri: AsyncWeb3(PooledHTTPProvider(uri, sessions)))
+            endpoint = pool.endpoints[0]
+            try:
+                assert await endpoint.web3.eth.block_number == 100
+                return endpoint
+            finally:
+                await sessions.close()
+                await runner.cleanup()
+
+        # web3 的单个调用也读取剩余额度
+        endpoint = asyncio.run(run())
+        assert endpoint.quota_remaining == 25 and endpoint.quota_limit == 100
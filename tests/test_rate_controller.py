@@ -0,0 +1,40 @@
+import asyncio
+from center.rate_controller import RateController
+
+
+class TestRateController(object):
+
+    def test_aimd(self):
+        rc = RateController(initial_concurrency=4, initial_rate=10, target_latency=1.0)
+        # 一轮健康的请求后并发加一
+        for _ in range(4):
+            rc.in_flight += 1
+            rc.release(0.1)
+        assert rc.stats()['concurrency'] == 5
+        assert rc.rate > 10
+        # 429 时成倍下降, 同一冷却周期内只下降一次
+        rc.in_flight += 2
+        rc.release(0.1, ok=False, throttled=True)
+        rc.release(0.1, ok=False, throttled=True)
+        stats = rc.stats()
+        assert stats['concurrency'] == 2
+        assert stats['throttled'] == 2
+        assert stats['decreases'] == 1
+
+    def test_concurrency_limit(self):
+        rc = RateController(initial_concurrency=2, initial_rate=1000, max_concurrency=2)
+        peak = 0
+
+        async def work():
+            nonlocal peak
+            async with rc.slot():
+                peak = max(peak, rc.in_flight)
+                await asyncio.sleep(0.01)
+
+        async def run():
+            await asyncio.gather(*[work() for _ in range(10)])
+
+        asyncio.run(run())
+        assert peak == 2
+        assert rc.stats()['requests'] == 10
+        assert rc.in_flight == 0
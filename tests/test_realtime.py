@@ -0,0 +1,59 @@
+import asyncio
+import json
+import websockets
+from center.realtime import HeadTracker
+
+
+class TestHeadTracker(object):
+
+    def test_subscription_and_fallback(self):
+
+        async def run():
+            chain = { "head": 10 }
+            sockets = []
+
+            async def handler(ws):
+                sockets.append(ws)
+                request = json.loads(await ws.recv())
+                assert request["method"] == "eth_subscribe"
+                await ws.send(json.dumps({ "jsonrpc": "2.0", "id": request["id"], "result": "0xsub"}))
+                while True:
+                    await asyncio.sleep(0.05)
+                    chain["head"] += 1
+                    await ws.send(
+                        json.dumps({
+                            "jsonrpc": "2.0",
+                            "method": "eth_subscription",
+                            "params": {
+                                "subscription": "0xsub",
+                                "result": {
+                                    "number": hex(chain["head"])
+                                }
+                            }
+                        }))
+
+            async def poll():
+                return chain["head"]
+
+            server = await websockets.serve(handler, "127.0.0.1", 0)
+            port = list(server.sockets)[0].getsockname()[1]
+            tracker = HeadTracker(f"ws://127.0.0.1:{port}", poll=poll, block_time=0.05, min_poll_interval=0.01, reconnect_seconds=10)
+            await tracker.start()
+            assert tracker.head == 10
+            assert await asyncio.wait_for(tracker.wait_for(13), 2) >= 13
+            assert tracker.connected
+            assert tracker.notifications >= 3
+            # 断开后改为轮询
+            server.close()
+            for ws in sockets:
+                await ws.close()
+            await server.wait_closed()
+            await asyncio.sleep(0.05)
+            assert not tracker.connected
+            chain["head"] += 5
+            target = chain["head"]
+            assert await asyncio.wait_for(tracker.wait_for(target), 2) == target
+            assert tracker.polls >= 2
+            tracker.stop()
+
+        asyncio.run(run())
@@ -0,0 +1,142 @@
+import pickle
+from center.batch_rpc import format_block, format_receipt
+from center.database.block import BlockLog, EventInfo, ReceiptLog, LOG_FORMAT_RAW
+from center.records import RecordView, block_record, receipt_record
+
+TX_HASH = "0x" + "ab"*32
+BLOCK_HASH = "0x" + "cd"*32
+ADDRESS = "0x272a64db94106e98d6733d599727aedbb336c878"
+TOPIC = "0x" + "11"*32
+
+RAW_LOG = {
+    "address": ADDRESS,
+    "topics": [TOPIC],
+    "data": "0x" + "00"*31 + "05",
+    "logIndex": "0x2",
+    "blockNumber": "0x64",
+    "blockHash": BLOCK_HASH,
+    "transactionHash": TX_HASH,
+    "transactionIndex": "0x0",
+    "removed": False
+}
+RAW_RECEIPT = {
+    "transactionHash": TX_HASH,
+    "transactionIndex": "0x0",
+    "blockNumber": "0x64",
+    "blockHash": BLOCK_HASH,
+    "from": ADDRESS,
+    "to": ADDRESS,
+    "cumulativeGasUsed": "0x1",
+    "gasUsed": "0x1",
+    "contractAddress": None,
+    "logs": [RAW_LOG],
+    "logsBloom": "0x" + "00"*256,
+    "status": "0x1",
+    "effectiveGasPrice": "0x1",
+    "type": "0x0"
+}
+RAW_BLOCK = {
+    "number":
+    "0x64",
+    "hash":
+    BLOCK_HASH,
+    "parentHash":
+    "0x" + "ef"*32,
+    "timestamp":
+    "0x6553f100",
+    "extraData":
+    "0x",
+    "logsBloom":
+    "0x" + "00"*256,
+    "gasLimit":
+    "0x1",
+    "gasUsed":
+    "0x1",
+    "miner":
+    ADDRESS,
+    "size":
+    "0x1",
+    "difficulty":
+    "0x0",
+    "nonce":
+    "0x0000000000000000",
+    "sha3Uncles":
+    "0x" + "00"*32,
+    "uncles": [],
+    "transactions": [{
+        "hash": TX_HASH,
+        "from": ADDRESS,
+        "to": ADDRESS,
+        "input": "0x1234",
+        "value": "0xa",
+        "blockNumber": "0x64",
+        "blockHash": BLOCK_HASH,
+        "transactionIndex": "0x0",
+        "gas": "0x1",
+        "gasPrice": "0x1",
+        "nonce": "0x0",
+        "v": "0x1b",
+        "r": "0x1",
+        "s": "0x1",
+        "type": "0x0"
+    }]
+}
+
+
+class TestRecords(object):
+
+    def test_same_as_web3(self):
+        block = block_record(RAW_BLOCK)
+        expected = format_block(RAW_BLOCK)
+        for key in ("number", "hash", "parentHash", "timestamp", "logsBloom"):
+            assert block[key] == expected[key]
+        for key in ("hash", "from", "to", "input", "value", "blockNumber", "transactionIndex"):
+            assert block.transactions[0][key] == expected.transactions[0][key]
+        receipt = receipt_record(RAW_RECEIPT)
+        expected = format_receipt(RAW_RECEIPT)
+        for key in ("transactionHash", "blockNumber", "from", "to", "status", "contractAddress"):
+            assert receipt[key] == expected[key]
+        assert dict(receipt.logs[0]) == dict(expected.logs[0])
+
+    def test_raw_log(self):
+        log = BlockLog.create_log(block_record(RAW_BLOCK))
+        assert log.format == LOG_FORMAT_RAW
+        assert log.get().transactions[0]['from'] == block_record(RAW_BLOCK).transactions[0]['from']
+        log = ReceiptLog.create_log(receipt_record(RAW_RECEIPT))
+        assert log.txHash == TX_HASH
+        assert log.get().logs[0].logIndex == 2
+
+    def test_lazy_fields(self):
+
+        def decoded(record, name):
+            try:
+                type(record).__dict__[name].__get__(record)
+                return True
+            except AttributeError:
+                return False
+
+        receipt = receipt_record(RAW_RECEIPT)
+        # 没有访问的字段不解码, 访问后缓存在 slot 中
+        assert not decoded(receipt, "logs") and not decoded(receipt, "from")
+        assert receipt.logs is receipt['logs'] and decoded(receipt, "logs")
+        assert not decoded(receipt.logs[0], "data")
+        assert receipt.get("effectiveGasPrice") is None and "status" in receipt and len(receipt) == 9
+        try:
+            receipt.status = 0
+            assert False
+        except AttributeError:
+            pass
+        block = block_record(RAW_BLOCK)
+        assert not decoded(block.transactions[0], "input") and block.transactions[0].input == format_block(RAW_BLOCK).transactions[0].input
+        # 进程间只传递原始结果
+        copy = pickle.loads(pickle.dumps(receipt.logs[0]))
+        assert copy.raw == RAW_LOG and dict(copy) == dict(receipt.logs[0])
+
+    def test_view_and_event_info(self):
+        log = ReceiptLog.create_log(format_receipt(RAW_RECEIPT))
+        view = log.get()
+        assert isinstance(view, RecordView) and view.logs[0].data == format_receipt(RAW_RECEIPT).logs[0].data
+        assert view.logs[0] is view['logs'][0] and view.logs[0].topics[0].hex() == TOPIC
+        assert pickle.loads(pickle.dumps(view)).transactionHash.hex() == TX_HASH
+        event = EventInfo(contract="IPShare", index=2)
+        assert event.eventName is None and event.blockNumber == 0 and not hasattr(event, "__dict__")
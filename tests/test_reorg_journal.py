@@ -0,0 +1,158 @@
+import asyncio
+import logging
+from types import SimpleNamespace
+from hexbytes import HexBytes
+from pymongo import DeleteOne, InsertOne, UpdateOne
+from web3 import AsyncWeb3
+from web3.datastructures import AttributeDict
+from center.block_scanner import BlockScanner, ScanChunk
+from center.database.entity_view import EntityView, ViewCollection
+from center.events import Events
+from center.reorg_journal import JournalCollection, ReorgJournal
+from conftest import FakeCollection
+
+
+def block(number, parent, fork=""):
+    return AttributeDict({ "number": number, "hash": HexBytes(f"{fork}{number}".encode().rjust(32, b"\0")), "parentHash": HexBytes(parent) })
+
+
+class TestReorgJournal(object):
+
+    def test_record_and_rollback(self):
+        accounts = FakeCollection("accounts")
+        accounts.docs = { "a": { "_id": "a", "balance": 10 } }
+        journal = ReorgJournal(10, FakeCollection("reorg_journal"))
+        journal.set_head(105)
+        assert journal.tracks(96) and not journal.tracks(95)
+
+        def transfer(block_number, sender, receiver, amount):
+            collection = JournalCollection(journal, accounts, block_number)
+            collection.update_one({ "_id": sender }, { "$inc": { "balance": -amount } }, upsert=True)
+            collection.update_one({ "_id": receiver }, { "$inc": { "balance": amount } }, upsert=True)
+
+        transfer(101, "a", "b", 3)
+        finds = accounts.finds
+        transfer(101, "a", "b", 2)
+        # 同一区块中已经记录过的实体不再读取
+        assert accounts.finds == finds
+        journal.flush()
+        transfer(102, "b", "c", 4)
+        JournalCollection(journal, accounts, 102).delete_one({ "_id": "a"})
+        # 实体视图提交时的写操作也被记录
+        view = EntityView()
+        with view:
+            ViewCollection(view, JournalCollection(journal, accounts, 103)).update_one({ "_id": "c"}, { "$set": { "frozen": True } })
+        view.commit()
+        journal.flush()
+        assert accounts.docs == { "b": { "_id": "b", "balance": 1 }, "c": { "_id": "c", "balance": 4, "frozen": True } }
+
+        assert journal.rollback(102) == 1
+        assert accounts.docs["c"] == { "_id": "c", "balance": 4 }
+        assert journal.rollback(101) == 3
+        assert accounts.docs == { "a": { "_id": "a", "balance": 5 }, "b": { "_id": "b", "balance": 5 } }
+        assert journal.rollback(100) == 2
+        assert accounts.docs == { "a": { "_id": "a", "balance": 10 } }
+        assert journal.collection.docs == {} and journal.stats()["rollbacks"] == 3
+
+    def test_bulk_write(self):
+        accounts = FakeCollection("accounts")
+        accounts.docs = { "a": { "_id": "a", "balance": 10 }, "b": { "_id": "b", "balance": 1 } }
+        journal = ReorgJournal(10, FakeCollection("reorg_journal"))
+        journal.set_head(105)
+        requests = [
+            UpdateOne({ "_id": "a"}, { "$inc": {
+                "balance": -4
+            } }),
+            UpdateOne({ "_id": "c"}, { "$inc": {
+                "balance": 4
+            } }, upsert=True),
+            DeleteOne({ "_id": "b"}),
+            InsertOne({
+                "_id": "d",
+                "balance": 0
+            }),
+        ]
+        JournalCollection(journal, accounts, 101).bulk_write(requests)
+        assert accounts.docs == { "a": { "_id": "a", "balance": 6 }, "c": { "_id": "c", "balance": 4 }, "d": { "_id": "d", "balance": 0 } }
+        assert journal.rollback(100) == 4
+        assert accounts.docs == { "a": { "_id": "a", "balance": 10 }, "b": { "_id": "b", "balance": 1 } }
+
+    def test_check_and_rescan(self):
+        journal = ReorgJournal(10, FakeCollection("reorg_journal"))
+        journal.set_head(110)
+        journal.hashes[100] = journal.hashes[99] = "0x" + "00"*32
+        parent = HexBytes(journal.hashes[100])
+        chain = [block(101, parent), block(102, block(101, parent).hash), block(103, block(102, parent).hash)]
+        assert journal.check(chain) is None and journal.get_hash(103) == chain[-1].hash.hex()
+        # 新链的 103 接在另一个 102 上
+        assert journal.check([block(103, block(102, parent, "x").hash, "x")]) == 103
+
+        restored = []
+        state = SimpleNamespace(check_blocks=journal.check,
+                                get_block_hash=journal.get_hash,
+                                delete_data=lambda since: restored.append(since) or 0,
+                                subscribe_address=lambda listener: None,
+                                get_address_version=lambda: 0)
+        scanner = BlockScanner(web3=None,
+                               state=state,
+                               events=Events(AsyncWeb3(), logging.getLogger("test")),
+                               logger=logging.getLogger("test"),
+                               max_reorg_depth=5)
+        node = { 101: block(101, parent), 102: block(102, block(101, parent).hash, "x"), 103: block(103, block(102, parent, "x").hash, "x") }
+
+        async def fetch_chunk(start, end):
+            chunk = ScanChunk(start, end)
+            chunk.blocks = [block(104, block(103, parent, "x").hash, "x")]
+            return chunk
+
+        async def hedged_request(request):
+            return await request(SimpleNamespace(eth=SimpleNamespace(get_block=lambda n: asyncio.sleep(0, node[n]))))
+
+        scanner.fetch_chunk = fetch_chunk
+        scanner.hedged_request = hedged_request
+        end, _, applied = asyncio.run(scanner.scan_chunk(104, 104))
+        # 103 与 102 都已分叉, 从 101 之后重新扫描
+        assert (end, applied) == (101, 0) and restored == [101]
+
+    def test_sparse_chunk(self):
+        journal = ReorgJournal(10, FakeCollection("reorg_journal"))
+        journal.set_head(110)
+        journal.hashes[100] = "0x" + "00"*32
+        parent = HexBytes(journal.hashes[100])
+        chain = [block(101, parent), block(102, block(101, parent).hash), block(103, block(102, parent).hash)]
+        assert journal.check(chain) is None
+        restored = []
+        state = SimpleNamespace(check_blocks=journal.check,
+                                get_block_hash=journal.get_hash,
+                                may_reorg=journal.tracks,
+                                delete_data=lambda since: restored.append(since) or 0,
+                                subscribe_address=lambda listener: None,
+                                get_address_version=lambda: 0)
+        scanner = BlockScanner(web3=None,
+                               state=state,
+                               events=Events(AsyncWeb3(), logging.getLogger("test")),
+                               logger=logging.getLogger("test"),
+                               max_reorg_depth=5)
+        node = { 102: chain[1], 103: block(103, chain[1].hash, "x") }
+
+        async def fetch_chunk(start, end):
+            # 混合模式下没有日志的 chunk 只有结束区块头
+            chunk = ScanChunk(start, end)
+            chunk.head = block(108, HexBytes("0x" + "11"*32), "x")
+            return chunk
+
+        async def hedged_request(request):
+            return await request(SimpleNamespace(eth=SimpleNamespace(get_block=lambda n: asyncio.sleep(0, node[n]))))
+
+        scanner.fetch_chunk = fetch_chunk
+        scanner.hedged_request = hedged_request
+        end, _, applied = asyncio.run(scanner.scan_chunk(104, 108))
+        # 上一个 chunk 结束的 103 已分叉
+        assert (end, applied) == (102, 0) and restored == [102]
+        # 没有分叉时记录结束区块的哈希, 下一个 chunk 检查
+        node[103] = chain[2]
+        journal.hashes[103] = chain[2].hash.hex()
+        chunk = ScanChunk(104, 104)
+        chunk.head = block(104, chain[2].hash)
+        assert asyncio.run(scanner.check_reorg(chunk)) is None
+        assert journal.get_hash(104) == chunk.head.hash.hex()
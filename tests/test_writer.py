@@ -0,0 +1,77 @@
+import asyncio
+import threading
+import time
+from center.writer import BackgroundWriter
+
+
+class TestBackgroundWriter(object):
+
+    def test_order_backpressure_and_flush(self):
+        written = []
+        loop_thread = threading.get_ident()
+
+        def write(i):
+            assert threading.get_ident() != loop_thread
+            time.sleep(0.002)
+            written.append(i)
+
+        async def main():
+            writer = BackgroundWriter(max_pending=3)
+            for i in range(20):
+                await writer.submit(write, i)
+                assert len(writer.pending) <= 3
+            # 提交不等待写入完成
+            assert len(written) < 20
+            await writer.flush()
+            assert written == list(range(20))
+            assert await writer.run(len, written) == 20
+            stats = writer.stats()
+            writer.close()
+            return stats
+
+        stats = asyncio.run(main())
+        assert stats["submitted"] == 20 and stats["pending"] == 0 and stats["max_queue"] == 3
+        assert stats["blocked_sec"] > 0
+
+    def test_error_does_not_stop_writer(self):
+        written = []
+        attempts = []
+
+        def write(i):
+            attempts.append(i)
+            # 第一次写入失败, flush 中重试成功
+            if attempts.count(i) == 1 and i == 1:
+                raise ValueError("connection reset")
+            written.append(i)
+
+        async def main():
+            writer = BackgroundWriter(max_pending=10)
+            for i in range(3):
+                await writer.submit(write, i)
+            await writer.flush()
+            writer.close()
+            return writer.stats()
+
+        stats = asyncio.run(main())
+        assert stats["errors"] == 1 and stats["failed"] == 0
+        assert sorted(written) == [0, 1, 2]
+
+    def test_flush_raises(self):
+
+        def write():
+            raise ValueError("disk full")
+
+        async def main():
+            writer = BackgroundWriter(max_pending=10, max_retries=2)
+            await writer.submit(write)
+            # 重试后仍然失败时不能保存进度
+            try:
+                await writer.flush()
+                return None
+            except ValueError:
+                return writer.stats()
+            finally:
+                writer.close()
+
+        stats = asyncio.run(main())
+        assert stats is not None and stats["errors"] == 1 and stats["failed"] == 1